@@ -0,0 +1,119 @@
+# admin_digest.py
+"""Сводка уведомлений администратору.
+
+Каждое событие (новый пользователь, новый подписчик, выдача промокода,
+отписка) раньше уходило отдельным сообщением, и один /start мог отправить
+администратору три сообщения. Во время наплыва это расходует лимит Telegram
+на отправку в один чат и задерживает ответы пользователям.
+
+В режиме сводки события копятся в памяти и раз в ``interval`` секунд уходят
+одним сообщением: счётчики по типам и первые ``max_details`` строк
+подробностей по каждому типу. Типы из ``immediate`` по-прежнему
+отправляются сразу. Если сводку отправить не удалось, события остаются
+в очереди до следующей попытки.
+"""
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from localization import t
+
+logger = logging.getLogger(__name__)
+
+EVENT_NEW_USER = "new_user"
+EVENT_NEW_SUBSCRIBER = "new_subscriber"
+EVENT_PROMO_RECEIVED = "promo_received"
+EVENT_UNSUBSCRIBED = "unsubscribed"
+
+EVENT_TYPES = (EVENT_NEW_USER, EVENT_NEW_SUBSCRIBER, EVENT_PROMO_RECEIVED, EVENT_UNSUBSCRIBED)
+
+# Ограничение Telegram на длину текста сообщения
+_MAX_MESSAGE_LENGTH = 4096
+
+
+class AdminDigest:
+    """Очередь событий для администратора со сводной отправкой раз в ``interval`` секунд."""
+
+    def __init__(
+        self,
+        chat_id: Optional[int],
+        interval: float,
+        immediate: Iterable[str] = (),
+        max_details: int = 10,
+        lang: str = "ru",
+    ):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.immediate = set(immediate)
+        self.max_details = max_details
+        self.lang = lang
+        self._counts: Dict[str, int] = {}
+        self._details: Dict[str, List[str]] = {}
+        # Метрики
+        self.sent = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    @property
+    def pending(self) -> int:
+        """Сколько событий ждёт отправки."""
+        return sum(self._counts.values())
+
+    def disable(self) -> None:
+        """Переключает на немедленную отправку (например, если нет JobQueue)."""
+        self.interval = 0
+
+    def should_queue(self, event_type: str) -> bool:
+        """Копить ли событие в сводке (а не отправлять сразу)."""
+        return self.enabled and event_type not in self.immediate
+
+    def add(self, event_type: str, detail: str) -> None:
+        """Добавляет событие; подробностей хранится не больше ``max_details`` на тип."""
+        self._counts[event_type] = self._counts.get(event_type, 0) + 1
+        details = self._details.setdefault(event_type, [])
+        if len(details) < self.max_details:
+            details.append(detail)
+
+    def render(self, counts: Dict[str, int], details: Dict[str, List[str]], header: Optional[str] = None) -> str:
+        """Текст сводки: заголовок, затем по каждому типу счётчик и подробности."""
+        lines = [header or t(self.lang, "admin_digest_header", minutes=max(1, round(self.interval / 60)))]
+        for event_type in EVENT_TYPES:
+            count = counts.get(event_type, 0)
+            if not count:
+                continue
+            lines.append("")
+            lines.append(t(self.lang, f"admin_digest_{event_type}", count=count))
+            shown = details.get(event_type, [])
+            lines.extend(f"• {detail}" for detail in shown)
+            if count > len(shown):
+                lines.append(t(self.lang, "admin_digest_more", count=count - len(shown)))
+        text = "\n".join(lines)
+        if len(text) > _MAX_MESSAGE_LENGTH:
+            text = text[: _MAX_MESSAGE_LENGTH - 1] + "…"
+        return text
+
+    async def flush(self, bot, header: Optional[str] = None) -> bool:
+        """Отправляет накопленные события одной сводкой. True, если что-то отправлено.
+
+        ``header`` заменяет стандартный заголовок «сводка за N мин.».
+        """
+        if not self._counts or not self.chat_id:
+            return False
+        counts, self._counts = self._counts, {}
+        details, self._details = self._details, {}
+        try:
+            await bot.send_message(chat_id=self.chat_id, text=self.render(counts, details, header))
+        except Exception as e:
+            # Возвращаем события в очередь: они уйдут со следующей сводкой
+            self.failed += 1
+            for event_type, count in counts.items():
+                self._counts[event_type] = self._counts.get(event_type, 0) + count
+                merged = details.get(event_type, []) + self._details.get(event_type, [])
+                self._details[event_type] = merged[: self.max_details]
+            logger.warning("Не удалось отправить сводку администратору: %s", e)
+            return False
+        self.sent += 1
+        logger.info("📬 Сводка администратору отправлена: %s событий", sum(counts.values()))
+        return True
@@ -0,0 +1,6 @@
+# benchmarks/__init__.py
+"""Бенчмарки бота на поддельных gspread и Telegram Bot API (без сети и ключей).
+
+Запуск: ``python -m benchmarks.run`` (см. ``benchmarks/run.py``); сохранённые
+прогоны для сравнения лежат в ``benchmarks/baselines/``.
+"""
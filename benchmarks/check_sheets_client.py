@@ -0,0 +1,249 @@
+# benchmarks/check_sheets_client.py
+"""Проверка ``sheets_async_client`` на локальном поддельном Sheets API.
+
+Поднимает ``benchmarks.fake_sheets_server`` и генерирует одноразовый ключ
+сервисного аккаунта, после чего проверяет:
+
+* операции get / batch_get / update / batch_update / append / clear — по
+  содержимому листа;
+* одновременные запросы — укладываются в пул соединений, а токен
+  получается один раз;
+* отозванный токен (401) и временные ошибки (503, 429 с Retry-After) —
+  запрос повторяется и завершается успешно; ``append`` после 503 не
+  повторяется (строки могли дописаться), а после 429 — повторяется;
+* квота — запросы ждут токен, не блокируя event loop;
+
+и сравнивает время запроса с путём gspread: передача в поток и
+``requests.Session``.
+
+    python -m benchmarks.check_sheets_client
+    python -m benchmarks.check_sheets_client --requests 2000 --latency 0.005
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import requests  # noqa: E402
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+
+from benchmarks.fake_sheets_server import FakeSheetsServer  # noqa: E402
+from sheets_async_client import AsyncSheetsClient, SheetsAPIError, ServiceAccountAuth, sheet_range  # noqa: E402
+from sheets_scheduler import QuotaScheduler  # noqa: E402
+
+SPREADSHEET_ID = "check-spreadsheet"
+SHEET = "Подписчики"
+
+
+def make_service_account(token_uri: str) -> Dict[str, str]:
+    """Ключ сервисного аккаунта в формате JSON-файла Google (ключ — одноразовый)."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    return {
+        "type": "service_account",
+        "client_email": "bot@check.iam.gserviceaccount.com",
+        "private_key_id": "check",
+        "private_key": pem,
+        "token_uri": token_uri,
+    }
+
+
+def make_scheduler(per_minute: float = 0, burst: int = 1) -> QuotaScheduler:
+    return QuotaScheduler(per_minute=per_minute, burst=burst, max_retries=3, backoff_base=0.01, backoff_max=0.05)
+
+
+class Checks:
+    def __init__(self):
+        self.failed: List[str] = []
+
+    def expect(self, name: str, condition: bool, detail: str = "") -> None:
+        print(f"{'✅' if condition else '❌'} {name}" + (f" ({detail})" if detail else ""))
+        if not condition:
+            self.failed.append(name)
+
+
+async def check_operations(server: FakeSheetsServer, info: Dict, checks: Checks) -> None:
+    async with AsyncSheetsClient(
+        SPREADSHEET_ID, ServiceAccountAuth(info), base_url=server.url + "/v4", scheduler=make_scheduler()
+    ) as client:
+        await client.update(sheet_range(SHEET, "A1:C1"), [["user_id", "username", "status"]])
+        response = await client.append(sheet_range(SHEET, "A1"), [["1", "a", "подписан"], ["2", "b", "подписан"]])
+        checks.expect("append: номер строки в updatedRange", response["updates"]["updatedRange"].endswith("A2:C3"),
+                      response["updates"]["updatedRange"])
+        await client.batch_update([
+            {"range": sheet_range(SHEET, "C2"), "values": [["отписан"]]},
+            {"range": sheet_range(SHEET, "B3:C3"), "values": [["bb", "отписан"]]},
+        ])
+        rows = await client.get(sheet_range(SHEET))
+        checks.expect("update / append / batch_update → get", rows == [
+            ["user_id", "username", "status"], ["1", "a", "отписан"], ["2", "bb", "отписан"],
+        ], str(rows))
+        header, second = await client.batch_get([sheet_range(SHEET, "1:1"), sheet_range(SHEET, "A3:B3")])
+        checks.expect("batch_get", header == [["user_id", "username", "status"]] and second == [["2", "bb"]])
+        await client.clear(sheet_range(SHEET, "A2:C3"))
+        checks.expect("clear", await client.get(sheet_range(SHEET)) == [["user_id", "username", "status"]])
+        checks.expect("пустой диапазон", await client.get(sheet_range(SHEET, "A10:C12")) == [])
+
+
+async def check_pool(server: FakeSheetsServer, info: Dict, checks: Checks, n: int, pool: int) -> None:
+    state = server.state
+    tokens, connections = state.calls["token"], state.connections
+    auth = ServiceAccountAuth(info)
+    async with AsyncSheetsClient(
+        SPREADSHEET_ID, auth, base_url=server.url + "/v4", pool_size=pool, scheduler=make_scheduler()
+    ) as client:
+        await asyncio.gather(*(client.get(sheet_range(SHEET, "A1:C1")) for _ in range(n)))
+        opened = state.connections - connections
+        checks.expect(f"{n} одновременных запросов: соединений ≤ {pool}", opened <= pool, f"открыто {opened}")
+        checks.expect("токен получен один раз", state.calls["token"] - tokens == 1 and auth.refreshes == 1)
+
+        state.revoke_tokens()
+        await asyncio.gather(*(client.get(sheet_range(SHEET, "A1:C1")) for _ in range(20)))
+        checks.expect("401 → новый токен и повтор", auth.refreshes >= 2, f"обновлений {auth.refreshes}")
+
+        retries = client.scheduler.retries
+        state.fail_next(503, 2)
+        rows = await client.get(sheet_range(SHEET, "A1:A1"))
+        checks.expect("503 ×2 → успешный повтор", rows == [["user_id"]] and client.scheduler.retries - retries == 2)
+
+        state.fail_next(429, 1, retry_after=0.2)
+        started = time.perf_counter()
+        await client.get(sheet_range(SHEET, "A1:A1"))
+        waited = time.perf_counter() - started
+        checks.expect("429 с Retry-After: пауза перед повтором", waited >= 0.2, f"{waited:.2f} с")
+
+        retries = client.scheduler.retries
+        state.fail_next(503, 1)
+        try:
+            await client.append(sheet_range(SHEET, "A1"), [["3", "c", "подписан"]])
+            code = 200
+        except SheetsAPIError as e:
+            code = e.code
+        checks.expect("append: 503 не повторяется", code == 503 and client.scheduler.retries == retries, f"код {code}")
+        state.fail_next(429, 1)
+        response = await client.append(sheet_range(SHEET, "A1"), [["3", "c", "подписан"]])
+        checks.expect("append: 429 → повтор", client.scheduler.retries - retries == 1 and "updates" in response)
+
+
+async def _loop_lag(stop: asyncio.Event) -> float:
+    """Наибольшая задержка event loop, пока не выставлен ``stop``."""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        worst = max(worst, time.perf_counter() - started - 0.005)
+    return worst
+
+
+async def check_quota(server: FakeSheetsServer, info: Dict, checks: Checks) -> None:
+    # 600 в минуту = 10 в секунду, без запаса: 5 запросов ≈ 0.4 с
+    scheduler = make_scheduler(per_minute=600, burst=1)
+    async with AsyncSheetsClient(
+        SPREADSHEET_ID, ServiceAccountAuth(info), base_url=server.url + "/v4", scheduler=scheduler
+    ) as client:
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(_loop_lag(stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(client.get(sheet_range(SHEET, "A1:A1")) for _ in range(5)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        lag = await lag_task
+    checks.expect("квота: запросы ждут токен", elapsed >= 0.35, f"{elapsed:.2f} с")
+    checks.expect("квота: event loop не блокируется", lag < 0.05, f"задержка loop до {lag * 1000:.0f} мс")
+
+
+async def _timed(n: int, call: Callable[[], Awaitable], concurrency: int) -> List[float]:
+    latencies: List[float] = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with slots:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(n)))
+    return latencies
+
+
+def _report(name: str, latencies: List[float], elapsed: float) -> None:
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(
+        f"  {name:<34} p50 {statistics.median(ordered) * 1000:6.2f} мс   p95 {p95 * 1000:6.2f} мс   "
+        f"{len(latencies) / elapsed:7.0f} запр/с"
+    )
+
+
+async def compare(server: FakeSheetsServer, info: Dict, n: int, concurrency: int) -> None:
+    """Путь gspread (поток + requests.Session) против асинхронного клиента."""
+    print(f"\n⏱️ {n} запросов values.get, одновременно {concurrency}:")
+    auth = ServiceAccountAuth(info)
+    async with AsyncSheetsClient(
+        SPREADSHEET_ID, auth, base_url=server.url + "/v4", pool_size=concurrency, scheduler=make_scheduler()
+    ) as client:
+        await client.get(sheet_range(SHEET, "A1:C1"))
+        token = await auth.token(client._http)
+        url = f"{server.url}/v4/spreadsheets/{SPREADSHEET_ID}/values/" + requests.utils.quote(sheet_range(SHEET, "A1:C1"), safe="")
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount("http://", adapter)
+        session.headers["Authorization"] = f"Bearer {token}"
+
+        def threaded_get() -> Dict:
+            response = session.get(url)
+            response.raise_for_status()
+            return response.json()
+
+        # Свой пул на ``concurrency`` потоков, как SheetsExecutor: пул asyncio по умолчанию
+        # (cpu + 4 потока) на малом числе ядер сам ограничил бы параллельность
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            started = time.perf_counter()
+            latencies = await _timed(n, lambda: loop.run_in_executor(executor, threaded_get), concurrency)
+            _report("поток + requests (как gspread)", latencies, time.perf_counter() - started)
+        session.close()
+
+        started = time.perf_counter()
+        latencies = await _timed(n, lambda: client.get(sheet_range(SHEET, "A1:C1")), concurrency)
+        _report("AsyncSheetsClient", latencies, time.perf_counter() - started)
+
+
+async def run(args: argparse.Namespace) -> int:
+    checks = Checks()
+    with FakeSheetsServer(latency=args.latency) as server:
+        info = make_service_account(server.url + "/token")
+        await check_operations(server, info, checks)
+        await check_pool(server, info, checks, n=200, pool=args.pool)
+        await check_quota(server, info, checks)
+        await compare(server, info, args.requests, args.pool)
+        print(f"\nЗапросы к поддельному API: {dict(server.state.calls)}; соединений: {server.state.connections}")
+    if checks.failed:
+        print(f"\n❌ Не прошли проверки: {', '.join(checks.failed)}")
+        return 1
+    print("\n✅ Все проверки пройдены")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="запросов в сравнении скорости")
+    parser.add_argument("--pool", type=int, default=10, help="размер пула соединений")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа API, сек")
+    return asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
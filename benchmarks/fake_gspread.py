@@ -0,0 +1,201 @@
+# benchmarks/fake_gspread.py
+"""Резидентная замена gspread: Client / Spreadsheet / Worksheet.
+
+Поддерживает те методы, которыми пользуется бот (чтение строк и всего листа,
+дозапись, диапазонные и пакетные обновления, очистка). Каждый метод,
+соответствующий запросу к Google Sheets API, учитывается в ``CallStats`` и
+может ждать ``latency`` секунд — как настоящий сетевой вызов.
+"""
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+import gspread
+from gspread.utils import a1_to_rowcol
+
+# Потоки фоновых задач: их запросы не приписываются обработчикам
+BACKGROUND_THREADS = ("promo-log-writer", "sheets-mirror", "notified-users-compactor")
+
+
+class CallStats:
+    """Счётчики вызовов API по методам (отдельно — из фоновых потоков)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: Counter = Counter()
+        self.background: Counter = Counter()
+
+    def record(self, method: str) -> None:
+        thread = threading.current_thread().name
+        with self._lock:
+            if thread.startswith(BACKGROUND_THREADS):
+                self.background[method] += 1
+            else:
+                self.calls[method] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self.background.clear()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.calls)
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+
+def _cell(range_name: str) -> tuple:
+    """'Sheet1'!B5:H5 → (5, 2) — левая верхняя ячейка диапазона."""
+    start = range_name.split("!")[-1].split(":")[0]
+    if re.fullmatch(r"[A-Z]+", start):
+        start += "1"
+    return a1_to_rowcol(start)
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: "FakeSpreadsheet", title: str, rows: Optional[List[List[str]]] = None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self._rows: List[List[str]] = [list(map(str, r)) for r in rows or []]
+        self._lock = threading.Lock()
+
+    def _api(self, method: str) -> None:
+        self.spreadsheet.client.api(method)
+
+    @property
+    def rows(self) -> List[List[str]]:
+        """Содержимое листа (для проверок, без учёта как вызов API)."""
+        return self._rows
+
+    # ---------- Чтение ----------
+    def row_values(self, row: int, **kwargs) -> List[str]:
+        self._api("row_values")
+        with self._lock:
+            values = list(self._rows[row - 1]) if len(self._rows) >= row else []
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def get_all_values(self, **kwargs) -> List[List[str]]:
+        self._api("get_all_values")
+        with self._lock:
+            return [list(r) for r in self._rows]
+
+    def get_values(self, range_name: Optional[str] = None, **kwargs) -> List[List[str]]:
+        self._api("get_values")
+        with self._lock:
+            if range_name is None:
+                return [list(r) for r in self._rows]
+            row, col = _cell(range_name)
+            return [list(r[col - 1:]) for r in self._rows[row - 1:]]
+
+    # ---------- Запись ----------
+    def _write(self, row: int, col: int, values: Sequence[Sequence]) -> None:
+        for ri, vals in enumerate(values):
+            r = row + ri - 1
+            while len(self._rows) <= r:
+                self._rows.append([])
+            target = self._rows[r]
+            for ci, value in enumerate(vals):
+                c = col + ci - 1
+                while len(target) <= c:
+                    target.append("")
+                target[c] = "" if value is None else str(value)
+
+    def _append(self, values: Sequence[Sequence]) -> Dict:
+        with self._lock:
+            start = len(self._rows) + 1
+            for vals in values:
+                self._rows.append(["" if v is None else str(v) for v in vals])
+            end = len(self._rows)
+        width = max((len(v) for v in values), default=1)
+        last_col = gspread.utils.rowcol_to_a1(1, max(width, 1)).rstrip("1")
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:{last_col}{end}"}}
+
+    def append_row(self, values: Sequence, **kwargs) -> Dict:
+        self._api("append_row")
+        return self._append([values])
+
+    def append_rows(self, values: Sequence[Sequence], **kwargs) -> Dict:
+        self._api("append_rows")
+        return self._append(values)
+
+    def update(self, values=None, range_name: Optional[str] = None, **kwargs) -> Dict:
+        self._api("update")
+        row, col = _cell(range_name or "A1")
+        with self._lock:
+            self._write(row, col, values)
+        return {"updatedRange": range_name}
+
+    def batch_update(self, data: Sequence[Dict], **kwargs) -> Dict:
+        self._api("batch_update")
+        with self._lock:
+            for item in data:
+                row, col = _cell(item["range"])
+                self._write(row, col, item["values"])
+        return {"totalUpdatedCells": sum(len(v) for d in data for v in d["values"])}
+
+    def clear(self) -> Dict:
+        self._api("clear")
+        with self._lock:
+            self._rows = []
+        return {}
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: "FakeClient"):
+        self.client = client
+        self._worksheets: Dict[str, FakeWorksheet] = {}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.client.api("worksheet")
+        if title not in self._worksheets:
+            raise gspread.WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        self.client.api("worksheets")
+        return list(self._worksheets.values())
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, **kwargs) -> FakeWorksheet:
+        self.client.api("add_worksheet")
+        ws = FakeWorksheet(self, title)
+        self._worksheets[title] = ws
+        return ws
+
+    def put_worksheet(self, title: str, rows: List[List[str]]) -> FakeWorksheet:
+        """Создаёт лист с данными без учёта как вызов API (подготовка данных)."""
+        ws = FakeWorksheet(self, title, rows)
+        self._worksheets[title] = ws
+        return ws
+
+
+class FakeClient:
+    """Клиент с одной таблицей; ``latency`` — задержка каждого вызова API в секундах."""
+
+    def __init__(self, latency: float = 0.0, stats: Optional[CallStats] = None):
+        self.latency = latency
+        self.stats = stats or CallStats()
+        self.spreadsheet = FakeSpreadsheet(self)
+
+    def api(self, method: str) -> None:
+        self.stats.record(method)
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def open_by_url(self, url: str) -> FakeSpreadsheet:
+        self.api("open")
+        return self.spreadsheet
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self.api("open")
+        return self.spreadsheet
+
+    def open(self, title: str) -> FakeSpreadsheet:
+        self.api("open")
+        return self.spreadsheet
@@ -0,0 +1,283 @@
+# benchmarks/fake_sheets_server.py
+"""Локальный HTTP-сервер, изображающий Google Sheets API (values) и сервер токенов.
+
+Нужен для проверки ``sheets_async_client`` без сети и ключей:
+
+* ``POST /token`` — обмен JWT на токен доступа (подпись не проверяется);
+* ``/v4/spreadsheets/{id}/values/...`` — get, batchGet, update, batchUpdate,
+  append и clear над листами в памяти; запросы без выданного токена
+  получают 401;
+* ``fail_next(status, count)`` — следующие ``count`` запросов к API
+  завершатся ошибкой (для проверки повторов);
+* счётчики запросов по операциям, выданных токенов и TCP-соединений
+  (по ним видно, что клиент переиспользует соединения).
+
+HTTP/1.1 с keep-alive, каждое соединение — отдельный поток.
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+_CELL = re.compile(r"^([A-Z]*)(\d*)$")
+
+
+def _col_index(letters: str) -> int:
+    index = 0
+    for ch in letters:
+        index = index * 26 + ord(ch) - ord("A") + 1
+    return index
+
+
+def _col_letters(index: int) -> str:
+    letters = ""
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+def parse_range(range_name: str) -> Tuple[str, int, int, Optional[int], Optional[int]]:
+    """``'Лист'!B2:D5`` → (лист, первая строка, первая колонка, последняя строка, последняя колонка).
+
+    Строки и колонки с 1; None — до конца листа.
+    """
+    if "!" in range_name:
+        title, cells = range_name.rsplit("!", 1)
+    else:
+        title, cells = range_name, ""
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    if not cells:
+        return title, 1, 1, None, None
+    start, _, end = cells.partition(":")
+    m1 = _CELL.match(start)
+    m2 = _CELL.match(end or start)
+    if not m1 or not m2:
+        raise ValueError(f"Неверный диапазон: {range_name}")
+    row1 = int(m1.group(2) or 1)
+    col1 = _col_index(m1.group(1)) if m1.group(1) else 1
+    row2 = int(m2.group(2)) if m2.group(2) else None
+    col2 = _col_index(m2.group(1)) if m2.group(1) else None
+    return title, row1, col1, row2, col2
+
+
+class FakeSheetsState:
+    """Листы таблицы, выданные токены, ошибки по запросу и счётчики."""
+
+    def __init__(self, token_ttl: int = 3600, latency: float = 0.0):
+        self.token_ttl = token_ttl
+        self.latency = latency
+        self.sheets: Dict[str, List[List[str]]] = {}
+        self.tokens: set = set()
+        self.calls: Counter = Counter()
+        self.connections = 0
+        self._failures: List[Tuple[int, float]] = []
+        self.lock = threading.Lock()
+
+    def fail_next(self, status: int, count: int = 1, retry_after: float = 0.0) -> None:
+        with self.lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def revoke_tokens(self) -> None:
+        with self.lock:
+            self.tokens.clear()
+
+    def take_failure(self) -> Optional[Tuple[int, float]]:
+        with self.lock:
+            return self._failures.pop(0) if self._failures else None
+
+    # ---------- Значения ----------
+    def read(self, range_name: str) -> Dict:
+        title, row1, col1, row2, col2 = parse_range(range_name)
+        rows = self.sheets.get(title, [])
+        last_row = len(rows) if row2 is None else min(row2, len(rows))
+        values = []
+        for r in range(row1 - 1, last_row):
+            row = rows[r][col1 - 1:col2]
+            # Sheets не возвращает пустые хвосты строк и пустые строки в конце
+            while row and row[-1] == "":
+                row.pop()
+            values.append(row)
+        while values and not values[-1]:
+            values.pop()
+        result = {"range": range_name, "majorDimension": "ROWS"}
+        if values:
+            result["values"] = values
+        return result
+
+    def write(self, range_name: str, values: List[List]) -> Dict:
+        title, row1, col1, _, _ = parse_range(range_name)
+        rows = self.sheets.setdefault(title, [])
+        for i, row_values in enumerate(values):
+            r = row1 - 1 + i
+            while len(rows) <= r:
+                rows.append([])
+            row = rows[r]
+            for j, value in enumerate(row_values):
+                c = col1 - 1 + j
+                while len(row) <= c:
+                    row.append("")
+                row[c] = "" if value is None else str(value)
+        width = max((len(v) for v in values), default=0)
+        last = f"{_col_letters(col1 + max(width, 1) - 1)}{row1 + max(len(values), 1) - 1}"
+        return {
+            "updatedRange": f"{title}!{_col_letters(col1)}{row1}:{last}",
+            "updatedRows": len(values),
+            "updatedCells": sum(len(v) for v in values),
+        }
+
+    def append(self, range_name: str, values: List[List]) -> Dict:
+        title, _, col1, _, _ = parse_range(range_name)
+        rows = self.sheets.setdefault(title, [])
+        # Таблица заканчивается на последней непустой строке
+        last = len(rows)
+        while last and not any(rows[last - 1]):
+            last -= 1
+        updates = self.write(f"{title}!{_col_letters(col1)}{last + 1}", values)
+        return {"tableRange": f"{title}!A1", "updates": updates}
+
+    def clear(self, range_name: str) -> Dict:
+        title, row1, col1, row2, col2 = parse_range(range_name)
+        rows = self.sheets.get(title, [])
+        last_row = len(rows) if row2 is None else min(row2, len(rows))
+        for r in range(row1 - 1, last_row):
+            row = rows[r]
+            end = len(row) if col2 is None else min(col2, len(row))
+            for c in range(col1 - 1, end):
+                row[c] = ""
+        return {"clearedRange": range_name}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят разными send(): без TCP_NODELAY ответ ждёт delayed ACK
+    disable_nagle_algorithm = True
+    state: FakeSheetsState
+
+    def setup(self) -> None:
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _reply(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._reply(status, {"error": {"code": status, "message": message, "errors": []}}, headers)
+
+    def do_GET(self) -> None:
+        self._dispatch("GET")
+
+    def do_PUT(self) -> None:
+        self._dispatch("PUT")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str) -> None:
+        state = self.state
+        url = urlsplit(self.path)
+        raw = self._body()
+        if url.path == "/token":
+            state.calls["token"] += 1
+            token = f"token-{time.monotonic_ns()}"
+            with state.lock:
+                state.tokens.add(token)
+            self._reply(200, {"access_token": token, "expires_in": state.token_ttl, "token_type": "Bearer"})
+            return
+
+        match = re.match(r"^/v4/spreadsheets/[^/]+/values(.*)$", url.path)
+        if not match:
+            self._error(404, "not found")
+            return
+        auth = self.headers.get("Authorization", "")
+        if auth.removeprefix("Bearer ") not in state.tokens:
+            state.calls["unauthorized"] += 1
+            self._error(401, "Request had invalid authentication credentials.")
+            return
+        if state.latency:
+            time.sleep(state.latency)
+        failure = state.take_failure()
+        if failure is not None:
+            status, retry_after = failure
+            state.calls[f"fail_{status}"] += 1
+            self._error(status, "injected failure", {"Retry-After": str(retry_after)} if retry_after else None)
+            return
+
+        tail = unquote(match.group(1))
+        query = parse_qs(url.query)
+        body = json.loads(raw) if raw else {}
+        with state.lock:
+            if tail == ":batchGet" and method == "GET":
+                state.calls["values.batchGet"] += 1
+                result = {"valueRanges": [state.read(r) for r in query.get("ranges", [])]}
+            elif tail == ":batchUpdate" and method == "POST":
+                state.calls["values.batchUpdate"] += 1
+                responses = [state.write(d["range"], d["values"]) for d in body.get("data", [])]
+                result = {"totalUpdatedCells": sum(r["updatedCells"] for r in responses), "responses": responses}
+            elif tail.endswith(":append") and method == "POST":
+                state.calls["values.append"] += 1
+                result = state.append(tail[1:-len(":append")], body.get("values", []))
+            elif tail.endswith(":clear") and method == "POST":
+                state.calls["values.clear"] += 1
+                result = state.clear(tail[1:-len(":clear")])
+            elif method == "GET":
+                state.calls["values.get"] += 1
+                result = state.read(tail[1:])
+            elif method == "PUT":
+                state.calls["values.update"] += 1
+                result = state.write(tail[1:], body.get("values", []))
+            else:
+                self._error(400, f"unsupported {method} {tail}")
+                return
+        self._reply(200, result)
+
+
+class FakeSheetsServer:
+    """Сервер на свободном порту ``127.0.0.1`` в фоновом потоке."""
+
+    def __init__(self, token_ttl: int = 3600, latency: float = 0.0):
+        self.state = FakeSheetsState(token_ttl=token_ttl, latency=latency)
+        handler = type("Handler", (_Handler,), {"state": self.state})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeSheetsServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-sheets", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeSheetsServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
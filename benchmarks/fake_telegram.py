@@ -0,0 +1,174 @@
+# benchmarks/fake_telegram.py
+"""Замена ``telegram.Bot`` для бенчмарков и построение синтетических апдейтов.
+
+``FakeBot`` отвечает на ``get_chat_member`` по заданному множеству
+подписчиков, принимает ``send_message`` (в том числе из ``Message.reply_text``)
+и считает вызовы по методам. ``FakeBotAPIRequest`` — то же на уровне
+транспорта: настоящий ``telegram.Bot`` (и ``Application``) получает ответы
+Bot API без сети. Апдейты строятся настоящим ``Update.de_json``, так что
+обработчики работают с теми же объектами, что и в боте.
+"""
+import asyncio
+import itertools
+import json
+import time
+import types
+from collections import Counter
+from typing import Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+class FakeBot:
+    """Бот без сети: ``is_subscribed(user_id)`` решает, подписан ли пользователь."""
+
+    def __init__(self, is_subscribed: Callable[[int], bool], latency: float = 0.0):
+        self.is_subscribed = is_subscribed
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    async def _api(self, method: str) -> None:
+        self.calls[method] += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    def reset(self) -> None:
+        self.calls.clear()
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.calls)
+
+    async def get_chat_member(self, chat_id, user_id, **kwargs):
+        await self._api("getChatMember")
+        status = "member" if self.is_subscribed(int(user_id)) else "left"
+        return types.SimpleNamespace(status=status, user=types.SimpleNamespace(id=user_id))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._api("sendMessage")
+        return None
+
+    async def set_my_commands(self, commands, **kwargs) -> bool:
+        await self._api("setMyCommands")
+        return True
+
+
+class FakeBotAPIRequest(BaseRequest):
+    """Транспорт Bot API без сети: отвечает на вызовы, которые делает бот.
+
+    ``getChatMember`` — по ``is_subscribed(user_id)``, ``sendMessage`` —
+    сообщением в тот же чат, остальные методы — ``true``. Каждый вызов ждёт
+    ``latency`` секунд и учитывается в ``calls``.
+    """
+
+    # Числовой id канала для ответов на send_message(chat_id="@канал")
+    CHANNEL_ID = -1001000000000
+
+    def __init__(self, is_subscribed: Callable[[int], bool], latency: float = 0.0):
+        self.is_subscribed = is_subscribed
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def reset(self) -> None:
+        self.calls.clear()
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.calls)
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data is not None else {}
+        result = self._result(api_method, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+    def _result(self, api_method: str, params: Dict):
+        if api_method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bot", "username": "fake_bot"}
+        if api_method == "getChatMember":
+            user_id = int(params["user_id"])
+            return {
+                "status": "member" if self.is_subscribed(user_id) else "left",
+                "user": {"id": user_id, "is_bot": False, "first_name": "User"},
+            }
+        if api_method == "sendMessage":
+            chat_id = params["chat_id"]
+            if isinstance(chat_id, str) and not chat_id.lstrip("-").isdigit():
+                chat = {"id": self.CHANNEL_ID, "type": "channel", "username": chat_id.lstrip("@")}
+            else:
+                chat = {"id": int(chat_id), "type": "private"}
+            return {"message_id": next(_message_ids), "date": int(time.time()), "chat": chat,
+                    "text": params.get("text", "")}
+        return True
+
+
+def _user(user_id: int, language_code: Optional[str]) -> Dict:
+    return {
+        "id": user_id,
+        "is_bot": False,
+        "first_name": "User",
+        "last_name": str(user_id),
+        "username": f"user{user_id}",
+        "language_code": language_code,
+    }
+
+
+def make_update(bot: FakeBot, user_id: int, text: str = "/start", language_code: Optional[str] = "ru") -> Update:
+    """Апдейт с личным сообщением ``text`` от пользователя ``user_id``."""
+    user = _user(user_id, language_code)
+    data = {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        data["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return Update.de_json(data, bot)  # type: ignore[arg-type]
+
+
+def make_callback_update(bot, user_id: int, data: str, language_code: Optional[str] = "ru") -> Update:
+    """Апдейт с нажатием inline-кнопки ``data`` под сообщением бота."""
+    payload = {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id, language_code),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_message_ids),
+                # date=0 означало бы недоступное сообщение (без reply_text)
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "",
+            },
+        },
+    }
+    return Update.de_json(payload, bot)  # type: ignore[arg-type]
+
+
+def make_context(bot: FakeBot, args=None):
+    """Минимальный контекст обработчика: ``context.bot`` и ``context.args``."""
+    return types.SimpleNamespace(bot=bot, args=list(args or []), bot_data={}, user_data={}, chat_data={})
@@ -0,0 +1,397 @@
+# benchmarks/loadgen.py
+"""Нагрузочный тест: синтетические апдейты через настоящее ``Application``.
+
+Приложение собирается ``bot_service_account.build_application`` — те же
+обработчики, процессор апдейтов и хуки, что и в боте. Bot API подменяется
+``benchmarks.fake_telegram.FakeBotAPIRequest``, Google Sheets —
+``benchmarks.fake_gspread``. Апдейты (команды, кнопки меню, нажатия inline-кнопок
+``check`` / ``go_channel``) приходят в очередь приложения потоком Пуассона
+с заданной частотой — так же, как их кладёт webhook-сервер.
+
+Задержка считается от запланированного момента прихода апдейта до конца его
+обработки (ожидание в очереди входит), поэтому перегрузка видна сразу, а не
+маскируется отстающим генератором. Для каждой частоты выводятся пропускная
+способность, перцентили задержки по типам апдейтов, задержка event loop, глубина очереди
+исходящих сообщений и число вызовов Bot API и Sheets API на апдейт.
+
+    python -m benchmarks.loadgen                              # 10, 25, 50, 100, 200 апд/с
+    python -m benchmarks.loadgen --rates 50 100 --duration 20 --users 50000
+    python -m benchmarks.loadgen --mix start=1 --subscribed 0.5 --telegram-latency 0.05
+    python -m benchmarks.loadgen --storage sqlite --output load.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application, ContextTypes, TypeHandler  # noqa: E402
+
+import config  # noqa: E402
+import bot_service_account as bot  # noqa: E402
+import google_sheets_async as gsa  # noqa: E402
+from benchmarks import run as bench  # noqa: E402
+from benchmarks.fake_telegram import FakeBotAPIRequest, make_callback_update, make_update  # noqa: E402
+from localization import t  # noqa: E402
+
+DEFAULT_RATES = [10.0, 25.0, 50.0, 100.0, 200.0]
+DEFAULT_MIX = "start=6,check=1,promo=1,menu=1,cb_check=1,cb_go_channel=1"
+MENU_BUTTONS = ("btn_start", "btn_check", "btn_promo", "btn_go_to_channel")
+# Шаг замера задержки event loop, сек
+LAG_INTERVAL = 0.01
+
+
+# ---------- Пользователи и апдейты ----------
+class Population:
+    """Пользователи 1..``users``: первые ``known`` уже есть в таблице, доля ``subscribed`` подписана на канал."""
+
+    def __init__(self, users: int, known: int, subscribed: float, seed: int):
+        self.users = users
+        self.known = known
+        rng = random.Random(seed)
+        self._subscribed = bytearray(rng.random() < subscribed for _ in range(users + 1))
+
+    def is_subscribed(self, user_id: int) -> bool:
+        return 0 < user_id <= self.users and bool(self._subscribed[user_id])
+
+
+def _command(text: str) -> Callable[[Any, int, random.Random], Tuple[str, Update]]:
+    return lambda tg, user_id, rng: (text, make_update(tg, user_id, text))
+
+
+def _menu(tg, user_id: int, rng: random.Random) -> Tuple[str, Update]:
+    key = rng.choice(MENU_BUTTONS)
+    return f"menu:{key}", make_update(tg, user_id, t("ru", key))
+
+
+def _callback(data: str) -> Callable[[Any, int, random.Random], Tuple[str, Update]]:
+    return lambda tg, user_id, rng: (f"callback:{data}", make_callback_update(tg, user_id, data))
+
+
+# Тип апдейта в --mix → (метка в отчёте, апдейт)
+KINDS: Dict[str, Callable[[Any, int, random.Random], Tuple[str, Update]]] = {
+    "start": _command("/start"),
+    "check": _command("/check"),
+    "promo": _command("/promo"),
+    "menu": _menu,
+    "cb_check": _callback("check"),
+    "cb_go_channel": _callback("go_channel"),
+}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in KINDS:
+            raise argparse.ArgumentTypeError(f"неизвестный тип апдейта {name!r} (есть: {', '.join(KINDS)})")
+        mix[name] = float(weight or 1)
+    if not any(w > 0 for w in mix.values()):
+        raise argparse.ArgumentTypeError("в --mix нет типов с положительным весом")
+    return mix
+
+
+# ---------- Замеры ----------
+class Tracker:
+    """Время прихода, начала и конца обработки каждого апдейта.
+
+    Подключается обработчиками ``TypeHandler`` в крайних группах: первая
+    видит апдейт до основных обработчиков, последняя — после них.
+    """
+
+    def __init__(self):
+        self.pending: Dict[int, Tuple[str, float]] = {}
+        self.started: Dict[int, float] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.waits: List[float] = []
+        self.errors: Counter = Counter()
+        self.last_done = 0.0
+        self.drained = asyncio.Event()
+
+    def reset(self) -> None:
+        self.latencies.clear()
+        self.waits.clear()
+        self.errors.clear()
+        self.last_done = 0.0
+
+    def arrived(self, update: Update, label: str, at: float) -> None:
+        self.pending[update.update_id] = (label, at)
+        self.drained.clear()
+
+    async def on_start(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if isinstance(update, Update) and update.update_id in self.pending:
+            self.started[update.update_id] = time.perf_counter()
+
+    async def on_done(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if not isinstance(update, Update):
+            return
+        entry = self.pending.pop(update.update_id, None)
+        if entry is None:
+            return
+        now = time.perf_counter()
+        label, arrived = entry
+        started = self.started.pop(update.update_id, now)
+        self.latencies[label].append(now - arrived)
+        self.waits.append(started - arrived)
+        self.last_done = now
+        if not self.pending:
+            self.drained.set()
+
+    async def on_error(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if isinstance(update, Update) and update.update_id in self.pending:
+            self.errors[self.pending[update.update_id][0]] += 1
+
+    def attach(self, app: Application) -> None:
+        app.add_handler(TypeHandler(Update, self.on_start), group=-100)
+        app.add_handler(TypeHandler(Update, self.on_done), group=100)
+        app.add_error_handler(self.on_error)
+
+
+async def _loop_lag(stop: asyncio.Event, lags: List[float], outbox: List[int]) -> None:
+    """Насколько позже заказанного просыпается корутина (занятость event loop); заодно — очередь исходящих."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - started - LAG_INTERVAL))
+        outbox.append(bot.OUTBOX.depth)
+
+
+def _ms(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    return {
+        "p50": round(bench._percentile(ordered, 0.50) * 1000, 2),
+        "p95": round(bench._percentile(ordered, 0.95) * 1000, 2),
+        "p99": round(bench._percentile(ordered, 0.99) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2),
+    }
+
+
+def _per_update(counts: Dict[str, int], updates: int) -> Dict[str, float]:
+    return {method: round(count / max(updates, 1), 3) for method, count in sorted(counts.items())}
+
+
+# ---------- Прогон ----------
+async def run_step(
+    app: Application,
+    tracker: Tracker,
+    env: "bench.Env",
+    api: FakeBotAPIRequest,
+    population: Population,
+    mix: Dict[str, float],
+    rate: float,
+    args: argparse.Namespace,
+    rng: random.Random,
+) -> Dict[str, Any]:
+    """Апдейты с частотой ``rate`` в течение ``args.duration`` секунд и ожидание их обработки."""
+    kinds, weights = list(mix), list(mix.values())
+    tracker.reset()
+    api.reset()
+    env.client.stats.reset()
+    lags: List[float] = []
+    outbox: List[int] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(_loop_lag(stop, lags, outbox))
+
+    started = time.perf_counter()
+    end = started + args.duration
+    next_at = started
+    sent = 0
+    while True:
+        next_at += rng.expovariate(rate)
+        if next_at >= end:
+            break
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        user_id = rng.randint(1, population.users)
+        label, update = KINDS[rng.choices(kinds, weights)[0]](app.bot, user_id, rng)
+        tracker.arrived(update, label, next_at)
+        # Очередь ограничена, как у webhook-сервера: при переполнении ждём места
+        await app.update_queue.put(update)
+        sent += 1
+
+    if tracker.pending:
+        try:
+            await asyncio.wait_for(tracker.drained.wait(), timeout=args.drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+    # Посты в канал и уведомления администратору уходят после ответов — дожидаемся и их
+    await bot.OUTBOX.join(args.drain_timeout)
+    stop.set()
+    await lag_task
+
+    unfinished = len(tracker.pending)
+    tracker.pending.clear()
+    tracker.started.clear()
+    done = sum(len(v) for v in tracker.latencies.values())
+    elapsed = max(tracker.last_done, end) - started
+    sheets = env.client.stats.snapshot()
+    for method, count in env.client.stats.background.items():
+        sheets[f"{method} (фон)"] = count
+    return {
+        "rate": rate,
+        "sent": sent,
+        "offered": round(sent / args.duration, 1),
+        "done": done,
+        "unfinished": unfinished,
+        "throughput": round(done / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": _ms([x for v in tracker.latencies.values() for x in v]),
+        "queue_wait_ms": _ms(tracker.waits),
+        "by_update": {label: _ms(v) | {"count": len(v)} for label, v in sorted(tracker.latencies.items())},
+        "errors": dict(tracker.errors),
+        "loop_lag_ms": _ms(lags),
+        "outbox_depth_max": max(outbox, default=0),
+        "telegram_calls": _per_update(api.snapshot(), sent),
+        "sheets_calls": _per_update(sheets, sent),
+    }
+
+
+def _print_step(result: Dict[str, Any]) -> None:
+    lat, lag = result["latency_ms"], result["loop_lag_ms"]
+    print(
+        f"\n📈 {result['rate']:g} апд/с: отправлено {result['sent']}, обработано {result['done']} "
+        f"({result['throughput']} апд/с), не дождались {result['unfinished']}, ошибок {sum(result['errors'].values())}"
+    )
+    if lat:
+        print(
+            f"   задержка p50 {lat['p50']} мс, p95 {lat['p95']} мс, p99 {lat['p99']} мс, max {lat['max']} мс; "
+            f"в очереди p95 {result['queue_wait_ms']['p95']} мс"
+        )
+    if lag:
+        print(
+            f"   задержка event loop p99 {lag['p99']} мс, max {lag['max']} мс; "
+            f"очередь исходящих до {result['outbox_depth_max']}"
+        )
+    for label, stats in result["by_update"].items():
+        print(
+            f"   {label:<24} n={stats['count']:<6} p50={stats['p50']:>9} мс p95={stats['p95']:>9} мс "
+            f"p99={stats['p99']:>9} мс"
+        )
+    print(f"   Bot API на апдейт: {result['telegram_calls']}")
+    print(f"   Sheets API на апдейт: {result['sheets_calls']}")
+
+
+def _sustained(results: List[Dict[str, Any]], slo_ms: float) -> Optional[float]:
+    """Наибольшая частота, при которой p95 в пределах SLO и апдейты не копятся."""
+    best = None
+    for result in results:
+        lat = result["latency_ms"]
+        keeps_up = result["unfinished"] == 0 and result["throughput"] >= result["offered"] * 0.9
+        if lat and lat["p95"] <= slo_ms and keeps_up:
+            best = result["rate"]
+    return best
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    population = Population(args.users, min(args.known, args.users), args.subscribed, args.seed)
+    api = FakeBotAPIRequest(population.is_subscribed, latency=args.telegram_latency)
+    rng = random.Random(args.seed)
+    results: List[Dict[str, Any]] = []
+
+    with tempfile.TemporaryDirectory(prefix="bot-load-") as tmp:
+        # Таблица, хранилище и кэши — как в benchmarks.run; FakeBot оттуда не используется
+        env = bench.setup(population.known, args, Path(tmp))
+        app = bot.build_application(request=api)
+        tracker = Tracker()
+        tracker.attach(app)
+        try:
+            await app.initialize()
+            if app.post_init:
+                await app.post_init(app)
+            await app.start()
+            for rate in args.rates:
+                result = await run_step(app, tracker, env, api, population, args.mix, rate, args, rng)
+                results.append(result)
+                _print_step(result)
+        finally:
+            if app.running:
+                await app.stop()
+            await app.shutdown()
+            bench.teardown()
+            gsa.shutdown(wait=True)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rates", type=float, nargs="+", default=DEFAULT_RATES, help="частоты апдейтов, апд/с")
+    parser.add_argument("--duration", type=float, default=10.0, help="длительность каждой частоты, сек")
+    parser.add_argument("--users", type=int, default=10_000, help="сколько разных пользователей пишут боту")
+    parser.add_argument("--known", type=int, default=5_000, help="сколько из них уже есть в таблице подписчиков")
+    parser.add_argument("--subscribed", type=float, default=0.8, help="доля подписанных на канал")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"типы апдейтов с весами ({DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=config.UPDATE_CONCURRENCY,
+                        help="апдейтов одновременно (UPDATE_CONCURRENCY)")
+    parser.add_argument("--storage", choices=("sheets", "sqlite"), default="sheets", help="основное хранилище")
+    parser.add_argument("--sheets-latency", type=float, default=0.05, help="задержка вызова Sheets API, сек")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="задержка вызова Bot API, сек")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="сколько ждать обработки после шага, сек")
+    parser.add_argument("--slo", type=float, default=500.0, help="допустимая p95 задержка, мс")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора")
+    parser.add_argument("--output", type=Path, help="куда сохранить результаты (JSON)")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи бота")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    # Апдейты кладутся в очередь приложения напрямую — как в режиме webhook, без Updater
+    config.BOT_MODE = "webhook"
+    config.UPDATE_CONCURRENCY = args.concurrency
+    config.RECONCILE_INTERVAL = 0
+    config.TELEGRAM_BOT_TOKEN = config.TELEGRAM_BOT_TOKEN or "123456:loadtest"
+    if config.ADMIN_ID is None:
+        # Уведомления администратору — часть пути обработчиков
+        config.ADMIN_ID = 1
+
+    started = time.perf_counter()
+    results = asyncio.run(run(args))
+    best = _sustained(results, args.slo)
+    if best is None:
+        print(f"\n⚠️ Ни одна частота не уложилась в p95 ≤ {args.slo:g} мс")
+    else:
+        print(f"\n✅ Бот держит {best:g} апд/с при p95 ≤ {args.slo:g} мс")
+
+    if args.output:
+        report = {
+            "meta": {
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "commit": bench._git_commit(),
+                "storage": args.storage,
+                "users": args.users,
+                "known": args.known,
+                "subscribed": args.subscribed,
+                "mix": args.mix,
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+                "sheets_latency": args.sheets_latency,
+                "telegram_latency": args.telegram_latency,
+                "slo_ms": args.slo,
+                "sustained_rate": best,
+                "duration_s": round(time.perf_counter() - started, 1),
+            },
+            "results": results,
+        }
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"💾 Результаты сохранены: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
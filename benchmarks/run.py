@@ -0,0 +1,396 @@
+# benchmarks/run.py
+"""Бенчмарк обработчиков бота и функций google_sheets_service_account.
+
+Обработчики (``handle_start_command``, ``check_subscription``, ``promo``) и
+функции ``gs`` прогоняются на поддельных gspread и Telegram Bot API
+(``benchmarks.fake_gspread``, ``benchmarks.fake_telegram``) с таблицей
+подписчиков заданного размера. Для каждого сценария выводятся перцентили
+задержки, число вызовов Sheets/Telegram API на одну операцию и выделения
+памяти (tracemalloc).
+
+    python -m benchmarks.run                                  # 1k, 10k, 100k строк
+    python -m benchmarks.run --sizes 1000 --iterations 50
+    python -m benchmarks.run --sheets-latency 0.05 --telegram-latency 0.02
+    python -m benchmarks.run --output benchmarks/baselines/new.json \\
+        --compare benchmarks/baselines/baseline.json
+
+Результаты сохраняются в JSON (``--output``); ``--compare`` печатает разницу
+с сохранённым прогоном.
+"""
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import logging
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import config  # noqa: E402
+import bot_service_account as bot  # noqa: E402
+import google_sheets_async as gsa  # noqa: E402
+import google_sheets_service_account as gs  # noqa: E402
+from benchmarks.fake_gspread import FakeClient  # noqa: E402
+from benchmarks.fake_telegram import FakeBot, make_context, make_update  # noqa: E402
+from notified_users import NotifiedUsers  # noqa: E402
+from outbox import OutboundDispatcher  # noqa: E402
+from subscribers import COLUMNS, STATUS_SUBSCRIBED, STATUS_UNSUBSCRIBED, set_storage  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+WARMUP = 3
+ALLOC_ITERATIONS = 10
+
+
+# ---------- Данные ----------
+def make_rows(n: int) -> List[List[str]]:
+    """Строки листа подписчиков с user_id 1..n.
+
+    Чётные — с промокодом, каждый десятый — отписан; остальные подписаны без промокода.
+    """
+    rows = []
+    for i in range(1, n + 1):
+        unsubscribed = i % 10 == 0
+        rows.append([
+            str(i),
+            f"user{i}",
+            f"User {i}",
+            "2024-01-01 12:00:00",
+            config.PROMO_CODE if i % 2 == 0 else "",
+            "start" if i % 2 == 0 else "",
+            STATUS_UNSUBSCRIBED if unsubscribed else STATUS_SUBSCRIBED,
+            "2024-02-01 12:00:00" if unsubscribed else "",
+        ])
+    return rows
+
+
+class Env:
+    """Подготовленное окружение для одного размера таблицы: фейки, хранилище и пулы user_id."""
+
+    def __init__(self, n: int, client: FakeClient, telegram_latency: float = 0.0):
+        self.n = n
+        self.client = client
+        self.bot = FakeBot(self.is_subscribed, latency=telegram_latency)
+        self.left: set = set()
+        new_ids = itertools.count(n + 1)
+        self._new = {True: (i for i in new_ids if i % 2 == 0), False: (i for i in new_ids if i % 2 == 1)}
+        # Конечные пулы — для сценариев, меняющих запись (повтор был бы холостым)
+        self._finite: Dict[str, Deque[int]] = {
+            "leavers": deque(i for i in range(1, n + 1) if i % 10 == 2),
+            "unsubscribe": deque(i for i in range(1, n + 1) if i % 10 == 4),
+            "no_promo": deque(i for i in range(1, n + 1) if i % 10 in (1, 3)),
+        }
+        self._cycled: Dict[str, Iterator[int]] = {
+            "promo": itertools.cycle([i for i in range(1, n + 1) if i % 10 in (6, 8)]),
+            "any": itertools.repeat(1),
+        }
+
+    def is_subscribed(self, user_id: int) -> bool:
+        if user_id in self.left:
+            return False
+        if user_id > self.n:
+            return user_id % 2 == 0
+        return user_id % 10 != 0
+
+    def available(self, pool: str) -> Optional[int]:
+        """Сколько ID осталось в пуле (None — бесконечный)."""
+        if pool in self._finite:
+            return len(self._finite[pool])
+        return None
+
+    def take(self, pool: str) -> int:
+        if pool in ("new_subscribed", "new_left"):
+            return next(self._new[pool == "new_subscribed"])
+        if pool in self._cycled:
+            return next(self._cycled[pool])
+        user_id = self._finite[pool].popleft()
+        if pool == "leavers":
+            # Был подписан, теперь вышел из канала
+            self.left.add(user_id)
+        return user_id
+
+
+# ---------- Сценарии ----------
+@dataclass
+class Scenario:
+    name: str
+    pool: str
+    prepare: Callable[[Env, int], Callable[[], Any]]
+    heavy: bool = False
+
+
+def _handler(handler, text: str):
+    def prepare(env: Env, user_id: int):
+        update = make_update(env.bot, user_id, text)
+        context = make_context(env.bot)
+        return lambda: handler(update, context)
+    return prepare
+
+
+def _gs(fn: Callable[[int], Any]):
+    def prepare(env: Env, user_id: int):
+        return lambda: fn(user_id)
+    return prepare
+
+
+SCENARIOS = [
+    Scenario("start/new_subscribed", "new_subscribed", _handler(bot.handle_start_command, "/start")),
+    Scenario("start/new_not_subscribed", "new_left", _handler(bot.handle_start_command, "/start")),
+    Scenario("start/existing_with_promo", "promo", _handler(bot.handle_start_command, "/start")),
+    Scenario("check/existing_with_promo", "promo", _handler(bot.check_subscription, "/check")),
+    Scenario("check/left_channel", "leavers", _handler(bot.check_subscription, "/check")),
+    Scenario("promo/existing_with_promo", "promo", _handler(bot.promo, "/promo")),
+    Scenario("promo/not_subscribed", "new_left", _handler(bot.promo, "/promo")),
+    Scenario("gs.refresh_subscriber_index", "any", _gs(lambda _: gs.refresh_subscriber_index()), heavy=True),
+    Scenario("gs.load_subscribers_df", "any", _gs(lambda _: gs.load_subscribers_df()), heavy=True),
+    Scenario("gs.user_has_promo", "promo", _gs(gs.user_has_promo)),
+    Scenario(
+        "gs.save_subscriber_to_sheet/new",
+        "new_subscribed",
+        _gs(lambda uid: gs.save_subscriber_to_sheet(uid, f"user{uid}", f"User {uid}", config.PROMO_CODE, "bench")),
+    ),
+    Scenario(
+        "gs.save_subscriber_to_sheet/existing",
+        "no_promo",
+        _gs(lambda uid: gs.save_subscriber_to_sheet(uid, f"user{uid}", f"User {uid}", config.PROMO_CODE, "bench")),
+    ),
+    Scenario("gs.mark_unsubscribed", "unsubscribe", _gs(gs.mark_unsubscribed)),
+    Scenario("gs.log_promo_issue", "new_subscribed", _gs(lambda uid: gs.log_promo_issue(uid, config.PROMO_CODE, source="bench"))),
+]
+
+
+# ---------- Измерение ----------
+async def _invoke(fn: Callable[[], Any]) -> None:
+    result = fn()
+    if inspect.isawaitable(result):
+        await result
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def _per_op(counts: Dict[str, int], ops: int) -> Dict[str, float]:
+    return {method: round(count / ops, 3) for method, count in sorted(counts.items())}
+
+
+async def measure(env: Env, scenario: Scenario, iterations: int) -> Optional[Dict[str, Any]]:
+    if scenario.heavy:
+        iterations = max(3, iterations // 20)
+    alloc_iterations = min(ALLOC_ITERATIONS, iterations)
+    available = env.available(scenario.pool)
+    if available is not None:
+        iterations = min(iterations, available - WARMUP - alloc_iterations)
+        if iterations <= 0:
+            return None
+
+    # Пул "promo" общий для сценариев: кэш подписки не должен переноситься между ними
+    bot.MEMBERSHIP_CACHE.clear()
+    for _ in range(WARMUP):
+        await _invoke(scenario.prepare(env, env.take(scenario.pool)))
+
+    # Задержка и вызовы API
+    env.client.stats.reset()
+    env.bot.reset()
+    latencies: List[float] = []
+    for _ in range(iterations):
+        fn = scenario.prepare(env, env.take(scenario.pool))
+        started = time.perf_counter()
+        await _invoke(fn)
+        latencies.append(time.perf_counter() - started)
+    # Посты в канал и уведомления уходят из очереди после ответа — учитываем и их
+    await bot.OUTBOX.join()
+    sheets_calls = env.client.stats.snapshot()
+    telegram_calls = env.bot.snapshot()
+
+    # Выделения памяти — отдельным проходом: tracemalloc сильно замедляет код
+    peaks: List[int] = []
+    nets: List[int] = []
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_iterations):
+            fn = scenario.prepare(env, env.take(scenario.pool))
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await _invoke(fn)
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            nets.append(after - before)
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 3),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3),
+        },
+        "sheets_calls": _per_op(sheets_calls, iterations),
+        "sheets_calls_total": round(sum(sheets_calls.values()) / iterations, 3),
+        "telegram_calls": _per_op(telegram_calls, iterations),
+        "telegram_calls_total": round(sum(telegram_calls.values()) / iterations, 3),
+        "alloc_kib": {
+            "peak": round(sum(peaks) / len(peaks) / 1024, 1) if peaks else 0.0,
+            "net": round(sum(nets) / len(nets) / 1024, 1) if nets else 0.0,
+        },
+    }
+
+
+def setup(n: int, args: argparse.Namespace, workdir: Path) -> Env:
+    """Таблица на ``n`` строк в фейковом gspread и хранилище поверх неё."""
+    client = FakeClient(latency=args.sheets_latency)
+    client.spreadsheet.put_worksheet(config.SHEET_NAME, [list(COLUMNS)] + make_rows(n))
+    client.spreadsheet.put_worksheet(gs.PROMO_LOG_SHEET, [list(gs.PROMO_LOG_HEADER)])
+
+    gs._SESSION._client_factory = lambda: client
+    gs._SESSION.reset()
+    gs._INDEX.invalidate()
+    gs._PROMO_LOG = gs._PromoLogWriter(str(workdir / f"promo_log_spool_{n}.jsonl"))
+
+    bot.NOTIFIED_USERS = NotifiedUsers(workdir / f"notified_users_{n}.json")
+    bot.NOTIFIED_USERS.load()
+    bot.MEMBERSHIP_CACHE.clear()
+
+    if args.storage == "sqlite":
+        from sqlite_storage import SQLiteSubscriberStorage
+        # Зеркало в Sheets не запускаем: измеряем путь обработчика
+        config.SHEETS_MIRROR_INTERVAL = 0
+        storage = SQLiteSubscriberStorage(str(workdir / f"subscribers_{n}.db"))
+    else:
+        storage = gs.sheets_storage()
+    storage.start()
+    set_storage(storage)
+
+    return Env(n, client, telegram_latency=args.telegram_latency)
+
+
+def teardown() -> None:
+    from subscribers import get_storage
+    get_storage().close()
+    gs._PROMO_LOG.stop()
+    set_storage(None)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, Any]] = {}
+    selected = [s for s in SCENARIOS if not args.only or any(p in s.name for p in args.only)]
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as tmp:
+        for n in args.sizes:
+            env = setup(n, args, Path(tmp))
+            # Лимиты Telegram на отправку измеряли бы очередь, а не обработчики
+            bot.OUTBOX = OutboundDispatcher(global_rate=0, private_rate=0, group_rate=0)
+            size_results: Dict[str, Any] = {}
+            try:
+                for scenario in selected:
+                    result = await measure(env, scenario, args.iterations)
+                    if result is None:
+                        continue
+                    size_results[scenario.name] = result
+                    lat = result["latency_ms"]
+                    print(
+                        f"{n:>7} {scenario.name:<38} p50={lat['p50']:>9.3f}ms p95={lat['p95']:>9.3f}ms "
+                        f"p99={lat['p99']:>9.3f}ms sheets={result['sheets_calls_total']:<6} "
+                        f"tg={result['telegram_calls_total']:<5} alloc={result['alloc_kib']['peak']}KiB",
+                        flush=True,
+                    )
+            finally:
+                teardown()
+            results[str(n)] = size_results
+    gsa.shutdown()
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Печатает изменение p50/p95 и числа вызовов API относительно ``baseline``."""
+    print(f"\nСравнение с {baseline.get('meta', {}).get('commit') or 'базовым прогоном'}:")
+    for size, scenarios in current["results"].items():
+        base_size = baseline.get("results", {}).get(size, {})
+        for name, result in scenarios.items():
+            base = base_size.get(name)
+            if base is None:
+                continue
+            parts = []
+            for q in ("p50", "p95"):
+                old, new = base["latency_ms"][q], result["latency_ms"][q]
+                delta = (new - old) / old * 100 if old else 0.0
+                parts.append(f"{q} {old:.3f}→{new:.3f}ms ({delta:+.0f}%)")
+            for key, label in (("sheets_calls_total", "sheets"), ("telegram_calls_total", "tg")):
+                if base[key] != result[key]:
+                    parts.append(f"{label} {base[key]}→{result[key]}")
+            print(f"{size:>7} {name:<38} " + "  ".join(parts))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="размеры таблицы подписчиков")
+    parser.add_argument("--iterations", type=int, default=100, help="операций на сценарий")
+    parser.add_argument("--only", nargs="*", help="только сценарии, содержащие эти подстроки")
+    parser.add_argument("--storage", choices=("sheets", "sqlite"), default="sheets", help="основное хранилище")
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="задержка вызова Sheets API, сек")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="задержка вызова Bot API, сек")
+    parser.add_argument("--output", type=Path, help="куда сохранить результаты (JSON)")
+    parser.add_argument("--compare", type=Path, help="сравнить с сохранённым прогоном")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи бота")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    if config.ADMIN_ID is None:
+        # Уведомления администратору — часть пути обработчиков
+        config.ADMIN_ID = 1
+
+    started = time.perf_counter()
+    results = asyncio.run(run(args))
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "storage": args.storage,
+            "iterations": args.iterations,
+            "sheets_latency": args.sheets_latency,
+            "telegram_latency": args.telegram_latency,
+            "duration_s": round(time.perf_counter() - started, 1),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"\n💾 Результаты сохранены: {args.output}")
+    if args.compare:
+        compare(report, json.loads(args.compare.read_text(encoding="utf-8")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,13 @@
 # bot_service_account.py
+import asyncio
+import functools
 import logging
+import time
 from datetime import datetime
-from typing import Optional, cast
+from typing import Optional, Tuple, cast
+
+# Отсчёт времени запуска — до импорта telegram и остальных зависимостей
+_STARTED_AT = time.perf_counter()
 
 from telegram import (
     Update,
@@ -18,15 +24,33 @@ from telegram.ext import (
     ContextTypes,
     MessageHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
+    TypeHandler,
     filters,
 )
 from telegram.error import BadRequest
-
-from localization import detect_lang, t
+from telegram.request import BaseRequest
+
+from admin_digest import (
+    EVENT_NEW_SUBSCRIBER,
+    EVENT_NEW_USER,
+    EVENT_PROMO_RECEIVED,
+    EVENT_UNSUBSCRIBED,
+    AdminDigest,
+)
+from localization import detect_lang, normalize_button, reverse_index, t
+from membership_cache import SUBSCRIBED_STATUSES, MembershipCache
+import metrics
+from notified_users import NotifiedUsers
+from outbox import PRIORITY_ADMIN, PRIORITY_CHANNEL, PRIORITY_REPLY, OutboundDispatcher
+from reconciliation import SubscriptionReconciler
+from singleflight import AsyncSingleFlight
+from subscribers import SubscriberContext, get_storage
+from update_processor import PerUserUpdateProcessor
 import config
 
-# Работаем с Google Sheets через Service Account
-import google_sheets_service_account as gs
+# Хранилище подписчиков и Google Sheets — только через пул потоков, чтобы не блокировать event loop
+import google_sheets_async as gsa
 import json
 from pathlib import Path
 import os
@@ -46,37 +70,8 @@ UserType = User
 # ---------- Локальный кэш уведомлённых пользователей ----------
 # Файл, в котором храним список user_id, о которых уже уведомляли администратора.
 NOTIFIED_USERS_FILE = Path(getattr(config, 'NOTIFIED_USERS_FILE', Path(__file__).with_name('notified_users.json')))
-
-
-def _load_notified_users() -> set:
-    try:
-        if NOTIFIED_USERS_FILE.exists():
-            with NOTIFIED_USERS_FILE.open('r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    return set(int(x) for x in data)
-        return set()
-    except Exception as e:
-        logger.warning("Не удалось загрузить кэш уведомлённых пользователей: %s", e)
-        return set()
-
-
-def _save_notified_users(users: set) -> None:
-    try:
-        tmp = NOTIFIED_USERS_FILE.with_suffix('.tmp')
-        with tmp.open('w', encoding='utf-8') as f:
-            json.dump(sorted(list(users)), f, ensure_ascii=False)
-        tmp.replace(NOTIFIED_USERS_FILE)
-    except Exception as e:
-        logger.warning("Не удалось сохранить кэш уведомлённых пользователей: %s", e)
-
-
-def _mark_user_notified(user_id: int) -> None:
-    users = _load_notified_users()
-    if user_id in users:
-        return
-    users.add(int(user_id))
-    _save_notified_users(users)
+# Множество загружается один раз; новые ID дописываются в журнал рядом со снимком.
+NOTIFIED_USERS = NotifiedUsers(NOTIFIED_USERS_FILE, compact_threshold=config.NOTIFIED_USERS_COMPACT_THRESHOLD)
 
 
 # ---------- State persistence for dynamic settings (CHANNEL_POST) ----------
@@ -114,11 +109,16 @@ def _save_state(channel_post: int) -> None:
         # Update runtime config values
         config.CHANNEL_POST = int(channel_post)
         config.PINNED_POST_URL = f"https://t.me/{config.CHANNEL_USERNAME.lstrip('@')}/{config.CHANNEL_POST}"
+        # Клавиатуры со ссылкой на старый пост больше не нужны
+        _channel_keyboard.cache_clear()
     except Exception as e:
         logger.warning("Не удалось сохранить состояние: %s", e)
 
 
 # ---------- Клавиатуры ----------
+# Разметка неизменяема (объекты telegram замораживаются), поэтому клавиатуры
+# строятся один раз на язык и дальше переиспользуются во всех ответах.
+@functools.lru_cache(maxsize=None)
 def menu_for_not_subscribed(lang: str) -> ReplyKeyboardMarkup:
     """Меню для неподписанных пользователей."""
     keyboard = [
@@ -128,6 +128,7 @@ def menu_for_not_subscribed(lang: str) -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
+@functools.lru_cache(maxsize=None)
 def menu_for_subscribed(lang: str) -> ReplyKeyboardMarkup:
     """Меню для подписанных пользователей."""
     keyboard = [
@@ -137,6 +138,7 @@ def menu_for_subscribed(lang: str) -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
+@functools.lru_cache(maxsize=None)
 def inline_menu_for_not_subscribed(lang: str) -> InlineKeyboardMarkup:
     """Inline-меню для неподписанных пользователей."""
     buttons = [
@@ -146,6 +148,7 @@ def inline_menu_for_not_subscribed(lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(buttons)
 
 
+@functools.lru_cache(maxsize=None)
 def inline_menu_for_subscribed(lang: str) -> InlineKeyboardMarkup:
     """Inline-меню для подписанных пользователей."""
     buttons = [
@@ -158,13 +161,18 @@ def inline_menu_for_subscribed(lang: str) -> InlineKeyboardMarkup:
 # ---------- Клавиатура с кнопкой перехода в канал ----------
 def inline_channel_keyboard(lang: str) -> InlineKeyboardMarkup:
     """Inline-клавиатура для перехода к 3-му посту канала."""
+    # Кэш по языку и номеру поста; /setpost очищает его (_save_state)
+    return _channel_keyboard(lang, getattr(config, 'CHANNEL_POST', 1))
+
+
+@functools.lru_cache(maxsize=64)
+def _channel_keyboard(lang: str, post) -> InlineKeyboardMarkup:
     label = t(lang, "go_to_channel") if lang else "📢 Перейти в канал"
     # Build URL to the 3rd post of the configured channel. Support values like
     # '@channelname' or 'channelname' in config.CHANNEL_USERNAME.
     channel = getattr(config, 'CHANNEL_USERNAME', None)
     if channel:
         ch = str(channel).lstrip('@')
-        post = getattr(config, 'CHANNEL_POST', 1)
         try:
             post = int(post)
         except Exception:
@@ -180,18 +188,114 @@ def inline_channel_keyboard(lang: str) -> InlineKeyboardMarkup:
 
 
 # ---------- Проверка подписки ----------
+# Кэш ответов get_chat_member: повторные нажатия в течение TTL не ходят в Telegram API
+MEMBERSHIP_CACHE = MembershipCache(
+    max_size=config.MEMBERSHIP_CACHE_SIZE,
+    positive_ttl=config.MEMBERSHIP_TTL_POSITIVE,
+    negative_ttl=config.MEMBERSHIP_TTL_NEGATIVE,
+)
+
+
+metrics.gauge("bot_membership_cache_size", "Записей в кэше проверки подписки", lambda: len(MEMBERSHIP_CACHE))
+metrics.gauge(
+    "bot_membership_cache_events_total",
+    "Попадания, промахи и вытеснения кэша проверки подписки",
+    lambda: {
+        ("hit",): MEMBERSHIP_CACHE.hits,
+        ("miss",): MEMBERSHIP_CACHE.misses,
+        ("eviction",): MEMBERSHIP_CACHE.evictions,
+    },
+    labelnames=("event",),
+    kind="counter",
+)
+metrics.gauge(
+    "bot_notified_users", "Пользователей, о которых администратор уже уведомлён", lambda: len(NOTIFIED_USERS)
+)
+
+
+def invalidate_membership(user_id: int) -> None:
+    """Сбрасывает закэшированный статус подписки пользователя."""
+    MEMBERSHIP_CACHE.invalidate(user_id)
+
+
+MEMBERSHIP_FLIGHT = AsyncSingleFlight("membership")
+
+
+async def _fetch_membership(bot, user_id: int) -> bool:
+    member = await bot.get_chat_member(chat_id=config.CHANNEL_USERNAME, user_id=user_id)
+    return member.status in SUBSCRIBED_STATUSES
+
+
 async def is_user_subscribed(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
+    cached = MEMBERSHIP_CACHE.get(user_id)
+    if cached is not None:
+        return cached
+
     try:
-        member = await context.bot.get_chat_member(
-            chat_id=config.CHANNEL_USERNAME, user_id=user_id
-        )
-        return member.status in ("member", "administrator", "creator")
+        # Одновременные проверки одного пользователя — один запрос get_chat_member
+        subscribed = await MEMBERSHIP_FLIGHT.do(user_id, _fetch_membership, context.bot, user_id)
     except Exception as e:
+        # Ошибку не кэшируем: это не ответ «не подписан»
         logger.warning("Проверка подписки не удалась для %s: %s", user_id, e)
         return False
 
+    MEMBERSHIP_CACHE.put(user_id, subscribed)
+    return subscribed
+
+
+# ---------- Исходящие сообщения ----------
+# Ответы пользователям, посты в канал и уведомления администратору — через одну очередь
+# с приоритетами и лимитами Telegram; RetryAfter не теряет сообщение, а откладывает его
+OUTBOX = OutboundDispatcher(
+    global_rate=config.OUTBOX_GLOBAL_RATE,
+    private_rate=config.OUTBOX_PRIVATE_RATE,
+    private_burst=config.OUTBOX_PRIVATE_BURST,
+    group_rate=config.OUTBOX_GROUP_RATE / 60,
+    group_burst=config.OUTBOX_GROUP_BURST,
+    max_retries=config.OUTBOX_MAX_RETRIES,
+)
+
+
+def post_to_channel(context: ContextTypes.DEFAULT_TYPE, text: str) -> None:
+    """Ставит пост в канал в очередь: обработчик не ждёт его отправки."""
+    send = functools.partial(context.bot.send_message, chat_id=config.CHANNEL_USERNAME, text=text)
+    OUTBOX.submit(config.CHANNEL_USERNAME, send, PRIORITY_CHANNEL)
+
 
 # ---------- Уведомления администратору ----------
+# В режиме сводки (ADMIN_DIGEST_INTERVAL > 0) события копятся и уходят одним сообщением
+ADMIN_DIGEST = AdminDigest(
+    chat_id=config.ADMIN_ID,
+    interval=config.ADMIN_DIGEST_INTERVAL,
+    immediate=config.ADMIN_DIGEST_IMMEDIATE,
+    max_details=config.ADMIN_DIGEST_MAX_DETAILS,
+    lang=config.ADMIN_DIGEST_LANG,
+)
+
+
+def _admin_detail(user: UserType, username: str) -> str:
+    """Строка о пользователе для сводки администратору."""
+    return f"{user.full_name} ({username}, {user.id})"
+
+
+metrics.gauge("bot_admin_digest_pending", "События, ждущие сводки администратору", lambda: ADMIN_DIGEST.pending)
+
+
+async def send_admin_event(context: ContextTypes.DEFAULT_TYPE, event_type: str, text: str, detail: str) -> None:
+    """Отправляет событие администратору сразу или ставит его в сводку."""
+    if ADMIN_DIGEST.should_queue(event_type):
+        ADMIN_DIGEST.add(event_type, detail)
+        return
+    # Уведомление уходит после ответов пользователям; обработчик его не ждёт
+    send = functools.partial(context.bot.send_message, chat_id=config.ADMIN_ID, text=text)
+    OUTBOX.submit(config.ADMIN_ID, send, PRIORITY_ADMIN)
+
+
+async def send_admin_digest(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Задача JobQueue: отправляет накопленную сводку."""
+    await ADMIN_DIGEST.flush(OUTBOX.queued_bot(context.bot, PRIORITY_ADMIN))
+
+
 async def notify_admin_new_user(context: ContextTypes.DEFAULT_TYPE, user: UserType, lang: str):
     """Уведомляет администратора о новом пользователе бота."""
     if not config.ADMIN_ID:
@@ -209,7 +313,7 @@ async def notify_admin_new_user(context: ContextTypes.DEFAULT_TYPE, user: UserTy
             time=now,
         )
 
-        await context.bot.send_message(chat_id=config.ADMIN_ID, text=text)
+        await send_admin_event(context, EVENT_NEW_USER, text, _admin_detail(user, username))
     except Exception as e:
         logger.warning("Не удалось уведомить о новом пользователе: %s", e)
 
@@ -232,7 +336,7 @@ async def notify_admin_new_subscriber(context: ContextTypes.DEFAULT_TYPE, user:
             channel=config.CHANNEL_USERNAME,
         )
 
-        await context.bot.send_message(chat_id=config.ADMIN_ID, text=text)
+        await send_admin_event(context, EVENT_NEW_SUBSCRIBER, text, _admin_detail(user, username))
     except Exception as e:
         logger.warning("Не удалось уведомить о новом подписчике: %s", e)
 
@@ -266,7 +370,8 @@ async def notify_admin_promo_received(
             source=(source or "-"),
         )
 
-        await context.bot.send_message(chat_id=config.ADMIN_ID, text=text)
+        detail = f"{_admin_detail(user, username)}: {promo} ({source or '-'})"
+        await send_admin_event(context, EVENT_PROMO_RECEIVED, text, detail)
     except Exception as e:
         logger.warning("Не удалось уведомить о получении промокода: %s", e)
 
@@ -292,24 +397,83 @@ async def notify_admin_unsubscribed(context: ContextTypes.DEFAULT_TYPE, user: Us
             channel=config.CHANNEL_USERNAME,
         )
 
-        await context.bot.send_message(chat_id=config.ADMIN_ID, text=text)
+        await send_admin_event(context, EVENT_UNSUBSCRIBED, text, _admin_detail(user, username))
     except Exception as e:
         logger.warning("Не удалось уведомить об отписке: %s", e)
 
 
+# ---------- Сверка подписок ----------
+RECONCILER = SubscriptionReconciler(
+    channel=config.CHANNEL_USERNAME,
+    checkpoint_file=config.RECONCILE_CHECKPOINT_FILE,
+    concurrency=config.RECONCILE_CONCURRENCY,
+    rate=config.RECONCILE_RATE,
+    chunk_size=config.RECONCILE_CHUNK,
+)
+# Отписки, найденные сверкой, копятся здесь и уходят администратору одним
+# сообщением в конце сверки (а не сотнями отдельных уведомлений)
+RECONCILE_REPORT = AdminDigest(
+    chat_id=config.ADMIN_ID,
+    interval=0,
+    max_details=config.ADMIN_DIGEST_MAX_DETAILS,
+    lang=config.ADMIN_DIGEST_LANG,
+)
+
+
+def _on_reconciled_unsubscribe(record: dict) -> None:
+    MEMBERSHIP_CACHE.put(record["user_id"], False)
+    username = f"@{record['username']}" if record.get("username") else 'нет'
+    RECONCILE_REPORT.add(EVENT_UNSUBSCRIBED, f"{record.get('full_name') or ''} ({username}, {record['user_id']})")
+
+
+async def reconcile_subscriptions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Задача JobQueue: сверка подписок и сводка отписавшихся администратору."""
+    try:
+        result = await RECONCILER.run(context.bot, _on_reconciled_unsubscribe)
+    except Exception as e:
+        logger.error("❌ Сверка подписок прервана: %s", e)
+        return
+    if result is None:
+        return
+    header = t(RECONCILE_REPORT.lang, "admin_reconcile_header", checked=result["checked"], errors=result["errors"])
+    await RECONCILE_REPORT.flush(OUTBOX.queued_bot(context.bot, PRIORITY_ADMIN), header)
+
+
 async def send_reply(update: Update, text: str, reply_markup=None):
-    """Helper: send reply to message or to callback_query.message."""
+    """Helper: send reply to message or to callback_query.message.
+
+    Ответ уходит через OUTBOX с высшим приоритетом; функция ждёт его отправки.
+    """
+    msg: Optional[Message] = None
     # Try to reply to a normal message if present
     if getattr(update, 'message', None) is not None and update.message is not None:
         msg = cast(Message, update.message)
-        await msg.reply_text(text, reply_markup=reply_markup)
 
     # Otherwise, try to reply to the message attached to a callback_query
     elif getattr(update, 'callback_query', None) is not None:
         cq = update.callback_query
         if cq is not None and getattr(cq, 'message', None) is not None and cq.message is not None:
             msg = cast(Message, cq.message)
-            await msg.reply_text(text, reply_markup=reply_markup)
+
+    if msg is not None:
+        await OUTBOX.send(msg.chat_id, functools.partial(msg.reply_text, text, reply_markup=reply_markup), PRIORITY_REPLY)
+
+
+# ---------- Уведомление о новом пользователе ----------
+async def notify_admin_if_new_user(
+    context: ContextTypes.DEFAULT_TYPE,
+    user: UserType,
+    lang: str,
+    sub: SubscriberContext,
+) -> None:
+    """Уведомляет администратора о новом пользователе только при первом взаимодействии."""
+    try:
+        if user.id not in NOTIFIED_USERS:
+            if not sub.exists:
+                await notify_admin_new_user(context, user, lang)
+            NOTIFIED_USERS.add(user.id)
+    except Exception as e:
+        logger.warning("Ошибка при работе с локальным кэшем уведомлений: %s", e)
 
 
 # ---------- Приветствие при первом запуске ----------
@@ -324,26 +488,10 @@ async def welcome_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     logger.info("Новый пользователь %s (%s)", user_id, user.username)
 
-    # Уведомляем администратора о новом пользователе только при первом взаимодействии
-    try:
-        notified = _load_notified_users()
-        if user_id not in notified:
-            try:
-                existing = gs.user_row(user_id)
-            except Exception as e:
-                logger.warning("Ошибка проверки записи пользователя в Google Sheets: %s", e)
-                # При ошибке доступа к Google Sheets — не уведомляем админа сейчас,
-                # но добавляем в локальный кэш, чтобы не повторять попытки.
-                _mark_user_notified(user_id)
-                existing = True
-
-            if existing is None:
-                await notify_admin_new_user(context, user, lang)
-                _mark_user_notified(user_id)
-            else:
-                _mark_user_notified(user_id)
-    except Exception as e:
-        logger.warning("Ошибка при работе с локальным кэшем уведомлений: %s", e)
+    # Запись пользователя загружаем один раз на весь апдейт
+    sub = await gsa.load_subscriber(user_id)
+
+    await notify_admin_if_new_user(context, user, lang, sub)
 
     # Проверяем подписку сразу при приветствии
     subscribed = await is_user_subscribed(context, user_id)
@@ -354,7 +502,7 @@ async def welcome_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         # Подписан - показываем приветствие и меню (reply keyboard для совместимости)
         # Проверяем, есть ли у пользователя уже промокод
-        has_promo, existing_promo = gs.user_has_promo(user_id)
+        has_promo, existing_promo = sub.promo()
         if has_promo and existing_promo:
             # Пользователь уже имеет промокод — показываем сообщение с промокодом
             text = t(lang, "promo_already_received", promo=existing_promo)
@@ -376,24 +524,10 @@ async def handle_start_command(update: Update, context: ContextTypes.DEFAULT_TYP
     full_name = user.full_name
     lang = detect_lang(user.language_code)
 
-    # Уведомляем администратора о новом пользователе только при первом взаимодействии
-    try:
-        notified = _load_notified_users()
-        if user_id not in notified:
-            try:
-                existing = gs.user_row(user_id)
-            except Exception as e:
-                logger.warning("Ошибка проверки записи пользователя в Google Sheets: %s", e)
-                _mark_user_notified(user_id)
-                existing = True
+    # Запись пользователя загружаем один раз; изменения записываются одной операцией в конце
+    sub = await gsa.load_subscriber(user_id)
 
-            if existing is None:
-                await notify_admin_new_user(context, user, lang)
-                _mark_user_notified(user_id)
-            else:
-                _mark_user_notified(user_id)
-    except Exception as e:
-        logger.warning("Ошибка при работе с локальным кэшем уведомлений: %s", e)
+    await notify_admin_if_new_user(context, user, lang, sub)
 
     logger.info("Пользователь %s (%s) нажал /start", user_id, username)
 
@@ -407,12 +541,9 @@ async def handle_start_command(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     # Подписан - выдаем промокод или поздравление в зависимости от того, получал ли пользователь промокод ранее
-    menu = menu_for_subscribed(lang)
-
-    row = gs.user_row(user_id)
-    is_new_in_sheet = row is None
+    is_new_in_sheet = not sub.exists
 
-    has_promo, existing_promo = gs.user_has_promo(user_id)
+    has_promo, existing_promo = sub.promo()
 
     if has_promo and existing_promo:
         # Пользователь уже имеет промокод — показываем сообщение с промокодом и поздравлением
@@ -426,14 +557,12 @@ async def handle_start_command(update: Update, context: ContextTypes.DEFAULT_TYP
         # Уведомляем о получении промокода
         await notify_admin_promo_received(context, user, config.PROMO_CODE, source="start")
 
-        # Upsert в Google Sheets
-        created_now = gs.save_subscriber_to_sheet(
-            user_id, username, full_name, config.PROMO_CODE, issued_by="start"
-        )
+        # Upsert записи (запишется при commit в конце обработчика)
+        created_now = sub.upsert(username, full_name, config.PROMO_CODE, issued_by="start")
         is_new_in_sheet = is_new_in_sheet or created_now
         try:
             # Логируем выдачу промокода в отдельный лист promo_log
-            gs.log_promo_issue(user_id, config.PROMO_CODE, source="start")
+            await gsa.log_promo(user_id, config.PROMO_CODE, source="start")
         except Exception as e:
             logger.warning("Не удалось залогировать выдачу промокода: %s", e)
 
@@ -443,16 +572,16 @@ async def handle_start_command(update: Update, context: ContextTypes.DEFAULT_TYP
         except Exception:
             logger.debug("Не удалось отправить пользователю ссылку на пост после выдачи промо")
 
-        # Попытка опубликовать поздравление в канале (если бот имеет права)
-        try:
-            channel_text = t(lang, "channel_congrats", username=(username or full_name or str(user_id)), promo=config.PROMO_CODE)
-            await context.bot.send_message(chat_id=config.CHANNEL_USERNAME, text=channel_text)
-        except Exception as e:
-            logger.debug("Не удалось опубликовать сообщение в канале: %s", e)
+        # Поздравление в канале (если бот имеет права) — в очередь, после ответов пользователям
+        channel_text = t(lang, "channel_congrats", username=(username or full_name or str(user_id)), promo=config.PROMO_CODE)
+        post_to_channel(context, channel_text)
 
     # Если запись уже была, но статус мог быть «отписан» — возвращаем её к «подписан»
     if not is_new_in_sheet:
-        gs.mark_subscribed_if_exists(user_id)
+        sub.mark_subscribed()
+
+    # Все изменения записи — одной операцией
+    await gsa.commit_subscriber(sub)
 
     # Уведомляем администратора при первой записи (новый подписчик)
     if is_new_in_sheet:
@@ -470,18 +599,18 @@ async def check_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     is_sub = await is_user_subscribed(context, user_id)
 
-    row = gs.user_row(user_id)
-    prev_status = row.get("status") if row is not None else None
+    sub = await gsa.load_subscriber(user_id)
+    prev_status = sub.status
 
     if is_sub:
         text = t(lang, "welcome_subscribed")
         await send_reply(update, text, reply_markup=menu_for_subscribed(lang))
 
-        if prev_status != "подписан" and row is not None:
-            gs.mark_subscribed_if_exists(user_id)
+        if prev_status != "подписан" and sub.exists:
+            sub.mark_subscribed()
 
         # Если пользователь подписан - проверяем, есть ли у него уже промокод
-        has_promo, existing_promo = gs.user_has_promo(user_id)
+        has_promo, existing_promo = sub.promo()
         if has_promo and existing_promo:
             # Пользователь уже имеет промокод — показываем сообщение с промокодом и поздравлением
             text = t(lang, "promo_already_received", promo=existing_promo)
@@ -491,19 +620,18 @@ async def check_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE)
             promo_assigned_text = t(lang, "first_time_congrats", promo=config.PROMO_CODE)
             await send_reply(update, promo_assigned_text, reply_markup=menu_for_subscribed(lang))
             await notify_admin_promo_received(context, user, config.PROMO_CODE, source="check_subscription")
+            sub.upsert(user.username, user.full_name, config.PROMO_CODE, issued_by="check_subscription")
             try:
-                gs.save_subscriber_to_sheet(user_id, user.username, user.full_name, config.PROMO_CODE, issued_by="check_subscription")
-            except Exception:
-                logger.warning("Не удалось сохранить подписчика после выдачи промо при проверке подписки")
-            try:
-                gs.log_promo_issue(user_id, config.PROMO_CODE, source="check_subscription")
+                await gsa.log_promo(user_id, config.PROMO_CODE, source="check_subscription")
             except Exception:
                 logger.debug("Не удалось залогировать промо при проверке подписки")
-            try:
-                channel_text = t(lang, "channel_congrats", username=(user.username or user.full_name or str(user_id)), promo=config.PROMO_CODE)
-                await context.bot.send_message(chat_id=config.CHANNEL_USERNAME, text=channel_text)
-            except Exception as e:
-                logger.debug("Не удалось опубликовать сообщение в канале (check_subscription): %s", e)
+            channel_text = t(lang, "channel_congrats", username=(user.username or user.full_name or str(user_id)), promo=config.PROMO_CODE)
+            post_to_channel(context, channel_text)
+
+        try:
+            await gsa.commit_subscriber(sub)
+        except Exception:
+            logger.warning("Не удалось сохранить подписчика при проверке подписки")
     else:
         text = t(lang, "start_subscribe")
         # НЕ показываем меню, а сразу предлагаем перейти к 3-му посту
@@ -511,7 +639,13 @@ async def check_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await send_reply(update, text, reply_markup=inline_kb)
 
         if prev_status == "подписан":
-            changed = gs.mark_unsubscribed(user_id)
+            changed = sub.mark_unsubscribed()
+            if changed:
+                try:
+                    await gsa.commit_subscriber(sub)
+                except Exception as e:
+                    logger.error("❌ Ошибка отписки пользователя %s: %s", user_id, e)
+                    changed = False
             if changed:
                 await notify_admin_unsubscribed(context, user)
 
@@ -532,7 +666,8 @@ async def promo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_reply(update, text, reply_markup=inline_kb)
     else:
         # Пользователь подписан - проверяем, есть ли у него уже промокод
-        has_promo, existing_promo = gs.user_has_promo(user.id)
+        sub = await gsa.load_subscriber(user.id)
+        has_promo, existing_promo = sub.promo()
         if has_promo and existing_promo:
             # Пользователь уже имеет промокод — показываем сообщение с промокодом и поздравлением
             text = t(lang, "promo_already_received", promo=existing_promo)
@@ -545,48 +680,78 @@ async def promo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await send_reply(update, text, reply_markup=inline_kb)
 
 
-# ---------- Обработчик текстовых кнопок ----------
-async def menu_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message is None or update.effective_user is None:
+# ---------- Вступление в канал и выход (обновления chat_member) ----------
+# Типы обновлений, которые бот запрашивает у Telegram. chat_member по умолчанию
+# не присылается — его нужно перечислить явно (и бот должен быть админом канала)
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.CHAT_MEMBER]
+
+
+def _is_channel(chat) -> bool:
+    """Относится ли чат к каналу config.CHANNEL_USERNAME (@username или числовой id)."""
+    channel = str(config.CHANNEL_USERNAME)
+    if channel.lstrip("-").isdigit():
+        return chat.id == int(channel)
+    return (chat.username or "").lower() == channel.lstrip("@").lower()
+
+
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обновляет статус подписчика, когда пользователь вступает в канал или выходит из него.
+
+    Статус приходит от Telegram сам — без get_chat_member: он сразу попадает
+    в кэш проверки подписки и в хранилище, а об отписке администратор узнаёт
+    в момент выхода, а не при следующем визите пользователя в бота.
+    """
+    change = update.chat_member
+    if change is None or not _is_channel(change.chat):
         return
 
-    lang = detect_lang(update.effective_user.language_code)
-    text = (update.message.text or "").strip().lower()
+    user = change.new_chat_member.user
+    was_subscribed = change.old_chat_member.status in SUBSCRIBED_STATUSES
+    subscribed = change.new_chat_member.status in SUBSCRIBED_STATUSES
+    if was_subscribed == subscribed:
+        return
 
-    # Получаем локализованные варианты кнопок и сравниваем в lower()
-    try:
-        btn_start = t(lang, "btn_start").strip().lower()
-    except Exception:
-        btn_start = "старт"
-    try:
-        btn_check = t(lang, "btn_check").strip().lower()
-    except Exception:
-        btn_check = "проверка подписки"
-    try:
-        btn_promo = t(lang, "btn_promo").strip().lower()
-    except Exception:
-        btn_promo = "действующий промокод"
+    MEMBERSHIP_CACHE.put(user.id, subscribed, ttl=config.MEMBERSHIP_TTL_EVENT)
+    logger.info("📣 Пользователь %s %s", user.id, "вступил в канал" if subscribed else "вышел из канала")
+
+    sub = await gsa.load_subscriber(user.id)
+    if not (sub.mark_subscribed() if subscribed else sub.mark_unsubscribed()):
+        return
     try:
-        btn_go = t(lang, "btn_go_to_channel").strip().lower()
-    except Exception:
-        btn_go = "перейти в канал"
+        changed = await gsa.commit_subscriber(sub)
+    except Exception as e:
+        logger.error("❌ Не удалось сохранить статус подписки %s: %s", user.id, e)
+        return
+    if changed and not subscribed:
+        await notify_admin_unsubscribed(context, user)
 
-    if text == btn_start:
-        await handle_start_command(update, context)
-    elif text == btn_check:
-        await check_subscription(update, context)
-    elif text == btn_promo:
-        await promo(update, context)
-    elif text == btn_go:
-        # Просто показываем кнопку для перехода к 3-му посту
-        msg = cast(Message, update.message)
-        await msg.reply_text(
-            t(lang, "go_to_channel_prompt"),
-            reply_markup=inline_channel_keyboard(lang),
-        )
-    else:
+
+# ---------- Обработчик текстовых кнопок ----------
+async def go_to_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Просто показываем кнопку для перехода к 3-му посту."""
+    lang = detect_lang(update.effective_user.language_code if update.effective_user else None)
+    await send_reply(update, t(lang, "go_to_channel_prompt"), reply_markup=inline_channel_keyboard(lang))
+
+
+# Ключ локализации кнопки → действие
+_MENU_ACTIONS = {
+    "btn_start": handle_start_command,
+    "btn_check": check_subscription,
+    "btn_promo": promo,
+    "btn_go_to_channel": go_to_channel,
+}
+# Текст кнопки на любом языке (в нижнем регистре) → ключ: разбор нажатия — один поиск в словаре
+_BUTTON_KEYS = reverse_index(_MENU_ACTIONS)
+
+
+async def menu_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message is None or update.effective_user is None:
         return
 
+    action = _MENU_ACTIONS.get(_BUTTON_KEYS.get(normalize_button(update.message.text), ""))
+    if action is not None:
+        await action(update, context)
+
 
 async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle callback queries from inline buttons."""
@@ -633,6 +798,60 @@ async def set_commands(app: Application):
     )
 
 
+async def on_startup(app: Application):
+    """Прогрев до приёма обновлений: команды бота и хранилище готовятся параллельно."""
+    started = time.perf_counter()
+    # Временные сбои Google Sheets хранилища переживают сами; ошибка прогрева
+    # (например, не удался первичный импорт в SQLite) — повод не запускаться
+    await asyncio.gather(set_commands(app), gsa.prewarm())
+    ready = time.perf_counter()
+    logger.info(
+        "🚀 Готов к приёму обновлений: прогрев %.0f мс, с запуска процесса %.2f с",
+        (ready - started) * 1000,
+        ready - _STARTED_AT,
+    )
+
+
+# ---------- Задержка первого обновления после запуска ----------
+# (update_id, время начала обработки) первого обновления
+_FIRST_UPDATE: Optional[Tuple[int, float]] = None
+_FIRST_UPDATE_REPORTED = False
+
+
+async def _first_update_started(update: object, context: ContextTypes.DEFAULT_TYPE):
+    global _FIRST_UPDATE
+    if _FIRST_UPDATE is None and isinstance(update, Update):
+        _FIRST_UPDATE = (update.update_id, time.perf_counter())
+
+
+async def _first_update_done(update: object, context: ContextTypes.DEFAULT_TYPE):
+    global _FIRST_UPDATE_REPORTED
+    if _FIRST_UPDATE_REPORTED or _FIRST_UPDATE is None:
+        return
+    update_id, started = _FIRST_UPDATE
+    if not isinstance(update, Update) or update.update_id != update_id:
+        return
+    _FIRST_UPDATE_REPORTED = True
+    now = time.perf_counter()
+    logger.info(
+        "⏱️ Первое обновление обработано за %.0f мс (%.2f с с запуска процесса)",
+        (now - started) * 1000,
+        now - _STARTED_AT,
+    )
+
+
+async def on_stop(app: Application):
+    """Досылает сводку администратору и очередь исходящих, пока бот ещё может отправлять сообщения."""
+    await ADMIN_DIGEST.flush(OUTBOX.queued_bot(app.bot, PRIORITY_ADMIN))
+    await OUTBOX.stop(config.OUTBOX_DRAIN_TIMEOUT)
+
+
+async def on_shutdown(app: Application):
+    """Останавливает пул операций Google Sheets и фоновые задачи хранилища."""
+    gsa.shutdown(wait=True)
+    get_storage().close()
+
+
 # ---------- /setpost command (admin-only) ----------
 async def setpost_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -684,24 +903,86 @@ async def setpost_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_reply(update, f"Номер поста канала изменён {where}: {prev} → {post_num}. Сохранено в {getattr(config,'STATE_FILE','bot_state.json')}")
 
 
+def build_application(request: Optional[BaseRequest] = None) -> Application:
+    """Приложение с обработчиками, хуками и задачами JobQueue — то, что запускает ``main``.
+
+    ``request`` — транспорт Bot API (по умолчанию ``MetricsRequest``);
+    нагрузочный тест ``benchmarks/loadgen.py`` подставляет поддельный.
+    """
+    # Вызовы Bot API считаются по методам (telegram_requests_total); размеры пулов — как по умолчанию
+    builder = (
+        Application.builder()
+        .token(config.TELEGRAM_BOT_TOKEN)
+        .request(request or metrics.MetricsRequest(connection_pool_size=256))
+        # Разные пользователи — параллельно, обновления одного пользователя — по порядку
+        .concurrent_updates(PerUserUpdateProcessor(config.UPDATE_CONCURRENCY))
+    )
+    if config.BOT_MODE == "webhook":
+        # Обновления кладёт в очередь встроенный webhook-сервер; очередь ограничена,
+        # сверх лимита сервер отвечает 503 и Telegram повторяет доставку
+        builder = builder.updater(None).update_queue(asyncio.Queue(maxsize=config.WEBHOOK_QUEUE_SIZE))
+    elif config.BOT_MODE == "polling":
+        builder = builder.get_updates_request(metrics.MetricsRequest(connection_pool_size=1))
+    else:
+        raise RuntimeError(f"❌ Неизвестный режим BOT_MODE={config.BOT_MODE!r} (polling или webhook)")
+    app = builder.build()
+    metrics.gauge("bot_update_queue_depth", "Апдейты, ждущие обработки", app.update_queue.qsize)
+
+    # Новые обработчики
+    # Каждый обработчик обёрнут в track_handler: гистограмма времени и счётчик ошибок
+    app.add_handler(CommandHandler("start", metrics.track_handler(handle_start_command)))  # Приветствие /start -> обработка старта
+    app.add_handler(CommandHandler("check", metrics.track_handler(check_subscription)))
+    app.add_handler(CommandHandler("setpost", metrics.track_handler(setpost_command)))
+    app.add_handler(CommandHandler("promo", metrics.track_handler(promo)))
+    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), metrics.track_handler(menu_text_handler)))
+    app.add_handler(CallbackQueryHandler(metrics.track_handler(callback_query_handler)))
+    app.add_handler(ChatMemberHandler(metrics.track_handler(chat_member_update), ChatMemberHandler.CHAT_MEMBER))
+    # Замер первого обновления: группы до и после основных обработчиков
+    app.add_handler(TypeHandler(Update, _first_update_started), group=-1)
+    app.add_handler(TypeHandler(Update, _first_update_done), group=1)
+
+    app.post_init = on_startup
+    app.post_stop = on_stop
+    app.post_shutdown = on_shutdown
+    app.add_error_handler(error_handler)
+
+    # Сводка администратору отправляется задачей JobQueue; без неё — уведомления сразу
+    if ADMIN_DIGEST.enabled:
+        if app.job_queue is None:
+            logger.warning("JobQueue недоступен (нужен python-telegram-bot[job-queue]) — уведомления администратору без сводки")
+            ADMIN_DIGEST.disable()
+        else:
+            app.job_queue.run_repeating(
+                send_admin_digest,
+                interval=ADMIN_DIGEST.interval,
+                first=ADMIN_DIGEST.interval,
+                name="admin_digest",
+            )
+            logger.info("📬 Сводка администратору: раз в %s с", ADMIN_DIGEST.interval)
+
+    # Сверка подписок — тоже задачей JobQueue; прерванная продолжается вскоре после запуска
+    if config.RECONCILE_INTERVAL > 0:
+        if app.job_queue is None:
+            logger.warning("JobQueue недоступен — сверка подписок отключена")
+        else:
+            app.job_queue.run_repeating(
+                reconcile_subscriptions,
+                interval=config.RECONCILE_INTERVAL,
+                first=RECONCILER.first_delay(config.RECONCILE_INTERVAL),
+                name="reconcile_subscriptions",
+            )
+            logger.info("🔄 Сверка подписок: раз в %s с", config.RECONCILE_INTERVAL)
+    return app
+
+
 def main():
     if not config.TELEGRAM_BOT_TOKEN:
         raise RuntimeError("❌ TELEGRAM_BOT_TOKEN не задан (проверь .env)")
+    if config.BOT_MODE == "webhook" and not config.WEBHOOK_SECRET_TOKEN:
+        raise RuntimeError("❌ WEBHOOK_SECRET_TOKEN не задан: без него webhook примет поддельные обновления")
 
     logger.info("🤖 Инициализация бота...")
-
-    app = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
-
-    # Новые обработчики
-    app.add_handler(CommandHandler("start", handle_start_command))  # Приветствие /start -> обработка старта
-    app.add_handler(CommandHandler("check", check_subscription))
-    app.add_handler(CommandHandler("setpost", setpost_command))
-    app.add_handler(CommandHandler("promo", promo))
-    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), menu_text_handler))
-    app.add_handler(CallbackQueryHandler(lambda u, c: callback_query_handler(u, c)))
-
-    app.post_init = set_commands
-    app.add_error_handler(error_handler)
+    app = build_application()
 
     # Load persistent state (CHANNEL_POST) if present
     try:
@@ -709,8 +990,33 @@ def main():
     except Exception as e:
         logger.debug("Не удалось загрузить сохранённое состояние при запуске: %s", e)
 
-    logger.info("✅ Бот для канала запущен")
-    app.run_polling(drop_pending_updates=True)
+    # Множество уведомлённых пользователей тоже загружаем один раз
+    NOTIFIED_USERS.load()
+
+    if config.METRICS_PORT > 0:
+        try:
+            metrics.start_http_server(config.METRICS_PORT, config.METRICS_ADDR)
+        except OSError as e:
+            logger.warning("Не удалось поднять сервер метрик на %s:%s: %s", config.METRICS_ADDR, config.METRICS_PORT, e)
+
+    logger.info("✅ Бот для канала запущен (%s)", config.BOT_MODE)
+    if config.BOT_MODE == "webhook":
+        # tornado нужен только в режиме webhook
+        import webhook_server
+        asyncio.run(
+            webhook_server.serve(
+                app,
+                listen=config.WEBHOOK_LISTEN,
+                port=config.WEBHOOK_PORT,
+                url_path=config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET_TOKEN,
+                webhook_url=config.WEBHOOK_URL,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=ALLOWED_UPDATES,
+            )
+        )
+    else:
+        app.run_polling(drop_pending_updates=True, allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
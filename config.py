@@ -15,13 +15,101 @@ _admin_env = os.getenv("ADMIN_ID")
 ADMIN_ID = int(_admin_env) if (_admin_env and _admin_env.strip() != "") else None
 PROMO_CODE = os.getenv("PROMO_CODE", "ART10")
 
+# Кэш проверки подписки (get_chat_member): размер и время жизни положительного/отрицательного ответа, сек
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "10000"))
+MEMBERSHIP_TTL_POSITIVE = float(os.getenv("MEMBERSHIP_TTL_POSITIVE", "60"))
+MEMBERSHIP_TTL_NEGATIVE = float(os.getenv("MEMBERSHIP_TTL_NEGATIVE", "5"))
+# Время жизни статуса, пришедшего обновлением chat_member (вступление/выход из канала), сек:
+# Telegram сам сообщит о следующем изменении, поэтому его можно хранить дольше
+MEMBERSHIP_TTL_EVENT = float(os.getenv("MEMBERSHIP_TTL_EVENT", "3600"))
+
+# После скольких дописанных ID журнал уведомлённых пользователей сворачивается в снимок
+NOTIFIED_USERS_COMPACT_THRESHOLD = int(os.getenv("NOTIFIED_USERS_COMPACT_THRESHOLD", "1000"))
+
+# Сводка уведомлений администратору: интервал отправки (сек; 0 — каждое событие сразу),
+# типы событий, которые всё равно отправляются сразу (через запятую: new_user, new_subscriber,
+# promo_received, unsubscribed), число строк подробностей на тип и язык сводки
+ADMIN_DIGEST_INTERVAL = float(os.getenv("ADMIN_DIGEST_INTERVAL", "0"))
+ADMIN_DIGEST_IMMEDIATE = [s.strip() for s in os.getenv("ADMIN_DIGEST_IMMEDIATE", "").split(",") if s.strip()]
+ADMIN_DIGEST_MAX_DETAILS = int(os.getenv("ADMIN_DIGEST_MAX_DETAILS", "10"))
+ADMIN_DIGEST_LANG = os.getenv("ADMIN_DIGEST_LANG", "ru")
+
+# Фоновая сверка подписок всех подписчиков через get_chat_member: интервал (сек; 0 — выключена),
+# число одновременных проверок, проверок в секунду, записей в пачке и файл контрольной точки
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "86400"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "5"))
+RECONCILE_RATE = float(os.getenv("RECONCILE_RATE", "15"))
+RECONCILE_CHUNK = int(os.getenv("RECONCILE_CHUNK", "200"))
+RECONCILE_CHECKPOINT_FILE = os.getenv("RECONCILE_CHECKPOINT_FILE", "reconcile_checkpoint.json")
+
 # Which post number to link to when sending users to the channel (can be updated with /setpost)
 CHANNEL_POST = int(os.getenv("CHANNEL_POST", "1"))
 
+# ---------- Приём обновлений ----------
+# polling — run_polling; webhook — встроенный HTTP-сервер (TLS завершается выше, на прокси/балансировщике)
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+# Адрес webhook-сервера: по умолчанию только локальный, за прокси на той же машине
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Публичный https-адрес webhook (с путём). Пусто — не регистрировать webhook при старте
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Секрет, который Telegram присылает в X-Telegram-Bot-Api-Secret-Token; в режиме webhook обязателен
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+# Сколько принятых обновлений может ждать обработки; сверх этого сервер отвечает 503
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Сколько одновременных соединений Telegram открывает к webhook (1–100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Метрики в формате Prometheus (GET /metrics): порт (0 — не поднимать сервер) и адрес
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_ADDR = os.getenv("METRICS_ADDR", "127.0.0.1")
+
+# Сколько обновлений обрабатывается одновременно (обновления одного пользователя — всегда по очереди)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+
+# Исходящие сообщения (outbox.py) — лимиты Telegram: всего сообщений в секунду, в личный чат в секунду
+# (и сколько подряд), в группу или канал в минуту (и сколько подряд); 0 — без ограничения.
+# Сколько раз повторять сообщение после RetryAfter и сколько секунд досылать очередь при остановке
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_PRIVATE_RATE = float(os.getenv("OUTBOX_PRIVATE_RATE", "1"))
+OUTBOX_PRIVATE_BURST = int(os.getenv("OUTBOX_PRIVATE_BURST", "3"))
+OUTBOX_GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", "20"))
+OUTBOX_GROUP_BURST = int(os.getenv("OUTBOX_GROUP_BURST", "3"))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "5"))
+OUTBOX_DRAIN_TIMEOUT = float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "10"))
+
 # ---------- Google Sheets (move sheet id and credentials to .env) ----------
 GOOGLE_SHEETS_ID = os.getenv("GOOGLE_SHEETS_ID", "")
 GOOGLE_CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "credentials.json")
 SHEET_NAME = os.getenv("SHEET_NAME", "Sheet1")
+# Как часто (в секундах) перечитывать лист подписчиков в резидентный индекс; 0 — только по запросу
+SUBSCRIBERS_REFRESH_INTERVAL = int(os.getenv("SUBSCRIBERS_REFRESH_INTERVAL", "300"))
+# ---------- Хранилище подписчиков ----------
+# "sheets" — только таблица; "sqlite" — локальная база как основное хранилище с зеркалом в Google Sheets
+# (переход описан в README, раздел «Хранилище подписчиков»)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sheets")
+SQLITE_DB_FILE = os.getenv("SQLITE_DB_FILE", "subscribers.db")
+# Как часто (сек) переносить изменения из SQLite в Google Sheets; 0 — не зеркалировать
+SHEETS_MIRROR_INTERVAL = float(os.getenv("SHEETS_MIRROR_INTERVAL", "30"))
+
+# Пул потоков для операций с Google Sheets: число воркеров и сколько операций может ждать в очереди
+SHEETS_WORKERS = int(os.getenv("SHEETS_WORKERS", "4"))
+SHEETS_QUEUE_SIZE = int(os.getenv("SHEETS_QUEUE_SIZE", "100"))
+# Квота Google Sheets API: запросов в минуту (0 — без ограничения), допустимый всплеск,
+# число повторов при 429/5xx и границы экспоненциальной задержки (сек)
+SHEETS_QUOTA_PER_MINUTE = float(os.getenv("SHEETS_QUOTA_PER_MINUTE", "60"))
+SHEETS_QUOTA_BURST = int(os.getenv("SHEETS_QUOTA_BURST", "10"))
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+SHEETS_BACKOFF_BASE = float(os.getenv("SHEETS_BACKOFF_BASE", "1"))
+SHEETS_BACKOFF_MAX = float(os.getenv("SHEETS_BACKOFF_MAX", "32"))
+# Асинхронный клиент Sheets API (sheets_async_client): адрес API и размер пула keep-alive соединений
+SHEETS_API_URL = os.getenv("SHEETS_API_URL", "https://sheets.googleapis.com/v4")
+SHEETS_HTTP_POOL_SIZE = int(os.getenv("SHEETS_HTTP_POOL_SIZE", "10"))
+# Буферизация лога промокодов: размер пачки, интервал отправки (сек) и файл локального спула
+PROMO_LOG_BATCH_SIZE = int(os.getenv("PROMO_LOG_BATCH_SIZE", "50"))
+PROMO_LOG_FLUSH_INTERVAL = float(os.getenv("PROMO_LOG_FLUSH_INTERVAL", "10"))
+PROMO_LOG_SPOOL_FILE = os.getenv("PROMO_LOG_SPOOL_FILE", "promo_log_spool.jsonl")
 
 # ---------- Локализация ----------
 # Build pinned post URL (derived from channel and post number)
@@ -0,0 +1,220 @@
+# google_sheets_async.py
+"""Асинхронные версии функций google_sheets_service_account и хранилища подписчиков.
+
+gspread синхронный: прямой вызов из обработчика блокирует event loop, и один
+медленный запрос к Google задерживает ответы всем пользователям. Здесь все
+операции с таблицей (и с основным хранилищем ``subscribers.get_storage()``)
+выполняются в выделенном пуле потоков, а обработчики ожидают результат
+через ``await``.
+
+Сам ``google_sheets_service_account`` (а с ним gspread и google-auth)
+импортируется при первом обращении: бот на SQLite без зеркала
+(``SHEETS_MIRROR_INTERVAL=0``) не загружает их вовсе, а на Sheets или с
+зеркалом — загружает в фазе прогрева (``prewarm``), не задерживая импорт
+модуля бота.
+"""
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple, TypeVar
+
+import config
+import metrics
+from singleflight import AsyncSingleFlight
+from subscribers import SubscriberContext, SubscriberOp, get_storage
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _gs():
+    """Модуль google_sheets_service_account (импортируется при первом вызове)."""
+    import google_sheets_service_account as gs
+    return gs
+
+
+class SheetsExecutor:
+    """Пул потоков для операций с Google Sheets с ограниченной очередью.
+
+    Одновременно выполняется не больше ``workers`` операций, и ещё не больше
+    ``queue_size`` ждут в очереди пула. Остальные вызывающие ждут на семафоре
+    (backpressure), не занимая память очереди пула.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Сколько операций сейчас выполняется или ждёт в пуле."""
+        return self._pending
+
+    def _ensure_started(self) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="sheets"
+            )
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Выполняет ``fn(*args, **kwargs)`` в пуле и возвращает результат."""
+        self._ensure_started()
+        assert self._slots is not None
+        async with self._slots:
+            self._pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._executor, functools.partial(fn, *args, **kwargs)
+                )
+            finally:
+                self._pending -= 1
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Останавливает пул; незавершённые операции дожидаются при ``wait=True``."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        self._slots = None
+        logger.info("🛑 Пул операций Google Sheets остановлен")
+
+
+_EXECUTOR = SheetsExecutor(config.SHEETS_WORKERS, config.SHEETS_QUEUE_SIZE)
+
+
+metrics.gauge(
+    "sheets_executor_pending", "Операции хранилища, выполняемые или ждущие в пуле потоков", lambda: _EXECUTOR.pending
+)
+
+
+# Одинаковые одновременные чтения (лист целиком, запись одного пользователя)
+# занимают один слот пула, а не по слоту на каждый обработчик
+_FLIGHT = AsyncSingleFlight("sheets_reads")
+
+
+def get_executor() -> SheetsExecutor:
+    """Возвращает общий пул операций с Google Sheets."""
+    return _EXECUTOR
+
+
+def shutdown(wait: bool = True) -> None:
+    _EXECUTOR.shutdown(wait=wait)
+
+
+async def load_subscribers_df():
+    return await _FLIGHT.do("subscribers_df", _EXECUTOR.run, _gs().load_subscribers_df)
+
+
+async def save_subscribers_df(df) -> None:
+    await _EXECUTOR.run(_gs().save_subscribers_df, df)
+
+
+async def refresh_subscriber_index() -> int:
+    return await _FLIGHT.do("refresh_index", _EXECUTOR.run, _gs().refresh_subscriber_index)
+
+
+async def log_promo_issue(
+    user_id: int,
+    promo: str,
+    timestamp: Optional[str] = None,
+    source: Optional[str] = None,
+) -> None:
+    await _EXECUTOR.run(_gs().log_promo_issue, user_id, promo, timestamp=timestamp, source=source)
+
+
+async def user_row(user_id: int):
+    return await _FLIGHT.do(("user_row", user_id), _EXECUTOR.run, _gs().user_row, user_id)
+
+
+async def user_has_promo(user_id: int) -> Tuple[bool, Optional[str]]:
+    return await _FLIGHT.do(("user_has_promo", user_id), _EXECUTOR.run, _gs().user_has_promo, user_id)
+
+
+async def save_subscriber_to_sheet(
+    user_id: int,
+    username: Optional[str],
+    full_name: Optional[str],
+    promo_code: str,
+    issued_by: Optional[str] = None,
+) -> bool:
+    return await _EXECUTOR.run(
+        _gs().save_subscriber_to_sheet, user_id, username, full_name, promo_code, issued_by=issued_by
+    )
+
+
+async def mark_unsubscribed(user_id: int) -> bool:
+    return await _EXECUTOR.run(_gs().mark_unsubscribed, user_id)
+
+
+async def mark_subscribed_if_exists(user_id: int) -> None:
+    await _EXECUTOR.run(_gs().mark_subscribed_if_exists, user_id)
+
+
+async def load_subscriber(user_id: int) -> SubscriberContext:
+    """Загружает запись пользователя из основного хранилища для обработки апдейта."""
+    return await _EXECUTOR.run(get_storage().load, user_id)
+
+
+async def commit_subscriber(ctx: SubscriberContext) -> bool:
+    """Записывает изменения, накопленные в ``ctx`` за апдейт (без запроса, если их нет)."""
+    if not ctx.dirty:
+        return False
+    return await _EXECUTOR.run(ctx.commit)
+
+
+async def log_promo(user_id: int, promo: str, source: Optional[str] = None) -> None:
+    """Записывает выдачу промокода в основное хранилище."""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    await _EXECUTOR.run(get_storage().log_promo, user_id, promo, timestamp, source)
+
+
+async def subscriber_records() -> List[Dict]:
+    """Все записи основного хранилища (для сверок)."""
+    return await _EXECUTOR.run(lambda: list(get_storage().records()))
+
+
+def _apply_many_background(changes: Mapping[int, Sequence[SubscriberOp]]) -> List[Dict]:
+    from sheets_scheduler import PRIORITY_BACKGROUND, priority
+
+    # Массовая запись не должна отнимать квоту Sheets у ответов пользователям
+    with priority(PRIORITY_BACKGROUND):
+        return get_storage().apply_many(changes)
+
+
+async def apply_many(changes: Mapping[int, Sequence[SubscriberOp]]) -> List[Dict]:
+    """Массовое изменение записей одной операцией хранилища (фоновый приоритет)."""
+    return await _EXECUTOR.run(_apply_many_background, changes)
+
+
+def _prewarm() -> None:
+    started = time.perf_counter()
+    storage = get_storage()
+    if storage.name == "sheets" or config.SHEETS_MIRROR_INTERVAL > 0:
+        try:
+            _gs().prewarm()
+            logger.info(f"🔥 Google Sheets готов за {(time.perf_counter() - started) * 1000:.0f} мс")
+        except Exception as e:
+            # Сбой таблицы не должен помешать подготовить само хранилище (схему SQLite и т. п.)
+            logger.warning(f"⚠️ Не удалось прогреть Google Sheets: {e}")
+    started = time.perf_counter()
+    storage.start()
+    logger.info(f"🔥 Хранилище подписчиков ({storage.name}) готово за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+
+async def prewarm() -> None:
+    """Готовит хранилище до приёма обновлений.
+
+    Авторизация в Google, открытие таблицы и листов, проверка заголовка,
+    загрузка индекса подписчиков (или базы SQLite) и запуск фоновых задач —
+    всё, за что иначе заплатил бы первый пользователь после перезапуска.
+    """
+    await _EXECUTOR.run(_prewarm)
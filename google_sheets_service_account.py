@@ -1,14 +1,37 @@
 # google_sheets_service_account.py
+import atexit
+import json
 import logging
 import os
+import re
+import threading
+import time
 from datetime import datetime
-from typing import List, Optional, Tuple
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, TypeVar
 
-import pandas as pd
 import gspread
+from gspread.utils import rowcol_to_a1
+from google.auth.exceptions import RefreshError
 from google.oauth2 import service_account
 
 import config
+import metrics
+from sheets_scheduler import PRIORITY_BACKGROUND, SchedulingHTTPClient, is_quota_error, priority
+from singleflight import SingleFlight
+from subscribers import (
+    COLUMNS,
+    SubscriberContext,
+    SubscriberOp,
+    SubscriberRecord,
+    SubscriberStorage,
+    apply_ops,
+    now_str,
+)
+
+if TYPE_CHECKING:
+    # pandas нужен только выгрузке/загрузке DataFrame целиком и импортируется там же
+    import pandas as pd
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +41,12 @@ SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 # Файл с ключом сервисного аккаунта
 SERVICE_ACCOUNT_FILE = config.GOOGLE_CREDENTIALS_FILE
 
+# Заголовок листа promo_log
+PROMO_LOG_SHEET = 'promo_log'
+PROMO_LOG_HEADER = ['user_id', 'promo_code', 'timestamp', 'issued_by']
+
+T = TypeVar("T")
+
 
 def print_config_debug():
     """Выводит диагностическую информацию о конфигурации Google Sheets."""
@@ -82,8 +111,8 @@ def _get_gspread_client() -> gspread.Client:
             sa_file, scopes=SCOPES
         )
 
-        # Создаем клиент gspread
-        gc = gspread.authorize(credentials)
+        # Создаем клиент gspread; все его запросы идут через планировщик квоты
+        gc = gspread.authorize(credentials, http_client=SchedulingHTTPClient)
         logger.info("✅ Успешное подключение к Google Sheets через Service Account")
         return gc
 
@@ -119,15 +148,10 @@ def _get_gspread_client() -> gspread.Client:
         raise RuntimeError(error_msg) from e
 
 
-def _open_sheet(gc: Optional[gspread.Client] = None) -> gspread.Spreadsheet:
-    """Открывает таблицу Google Sheets с поддержкой разных версий gspread."""
-    if gc is None:
-        gc = _get_gspread_client()
-
+def _open_methods(gc: gspread.Client) -> List[Callable[[], gspread.Spreadsheet]]:
+    """Способы открытия таблицы для разных версий gspread (в порядке предпочтения)."""
     spreadsheet_url = f"https://docs.google.com/spreadsheets/d/{config.GOOGLE_SHEETS_ID}"
-
-    # Пробуем разные методы открытия в зависимости от версии gspread
-    methods_to_try = [
+    return [
         # Метод 1: open_by_url (рекомендуемый для новых версий)
         lambda: gc.open_by_url(spreadsheet_url),
 
@@ -141,15 +165,28 @@ def _open_sheet(gc: Optional[gspread.Client] = None) -> gspread.Spreadsheet:
         lambda: gc.open(config.GOOGLE_SHEETS_ID),
     ]
 
-    for i, method in enumerate(methods_to_try, 1):
+
+def _open_sheet_with_method(
+    gc: gspread.Client, preferred: Optional[int] = None
+) -> Tuple[gspread.Spreadsheet, int]:
+    """Открывает таблицу и возвращает её вместе с номером сработавшего метода.
+
+    Если передан ``preferred``, сначала пробуется он.
+    """
+    methods = list(enumerate(_open_methods(gc), 1))
+    if preferred is not None:
+        methods.sort(key=lambda m: m[0] != preferred)
+
+    for i, method in methods:
         try:
             spreadsheet = method()
             logger.info(f"✅ Таблица открыта методом {i}: {config.GOOGLE_SHEETS_ID}")
-            return spreadsheet
+            return spreadsheet, i
         except Exception as e:
             logger.warning(f"⚠️ Метод {i} не сработал: {e}")
             continue
 
+    spreadsheet_url = f"https://docs.google.com/spreadsheets/d/{config.GOOGLE_SHEETS_ID}"
     # Если ни один метод не сработал
     raise RuntimeError(
         f"❌ Не удалось открыть таблицу ни одним из доступных методов.\n"
@@ -162,84 +199,227 @@ def _open_sheet(gc: Optional[gspread.Client] = None) -> gspread.Spreadsheet:
     )
 
 
-def _sheet(gc: Optional[gspread.Client] = None) -> gspread.Worksheet:
-    """Получает рабочий лист из таблицы."""
-    sp = _open_sheet(gc)
+def _open_sheet(gc: Optional[gspread.Client] = None) -> gspread.Spreadsheet:
+    """Открывает таблицу Google Sheets с поддержкой разных версий gspread."""
+    if gc is None:
+        gc = _get_gspread_client()
+    spreadsheet, _ = _open_sheet_with_method(gc)
+    return spreadsheet
+
+
+def _get_or_create_worksheet(
+    sp: gspread.Spreadsheet,
+    title: str,
+    header: Optional[List[str]] = None,
+) -> gspread.Worksheet:
+    """Возвращает лист ``title``, создавая его (с заголовком ``header``) при отсутствии."""
     try:
-        worksheet = sp.worksheet(config.SHEET_NAME)
-        logger.info(f"✅ Лист найден: {config.SHEET_NAME}")
+        worksheet = sp.worksheet(title)
+        logger.info(f"✅ Лист найден: {title}")
         return worksheet
     except gspread.WorksheetNotFound:
-        logger.warning(f"⚠️ Лист '{config.SHEET_NAME}' не найден. Создаю новый...")
+        logger.warning(f"⚠️ Лист '{title}' не найден. Создаю новый...")
         try:
             # Исправлено: передаем int вместо строк для rows и cols
             worksheet = sp.add_worksheet(
-                title=config.SHEET_NAME,
+                title=title,
                 rows=1000,  # ← int вместо "1000"
                 cols=10     # ← int вместо "10"
             )
-            logger.info(f"✅ Создан новый лист: {config.SHEET_NAME}")
+            if header:
+                worksheet.append_row(header)
+            logger.info(f"✅ Создан новый лист: {title}")
             return worksheet
         except Exception as e:
             logger.error(f"❌ Ошибка создания листа: {e}")
-            raise RuntimeError(f"❌ Не удалось создать лист '{config.SHEET_NAME}': {e}") from e
-
-
-def _ensure_header(worksheet: gspread.Worksheet) -> List[str]:
-    """Убеждается, что в листе есть необходимые заголовки."""
-    expected = [
-        "user_id",
-        "username",
-        "full_name",
-        "joined_at",
-        "promo_code",
-        "issued_by",
-        "status",
-        "unsubscribed_at",
-    ]
+            raise RuntimeError(f"❌ Не удалось создать лист '{title}': {e}") from e
 
-    try:
-        hdr = worksheet.row_values(1)
-        logger.info(f"📋 Текущие заголовки: {hdr}")
-    except Exception:
-        hdr = []
-        logger.warning("⚠️ Не удалось получить заголовки")
 
-    if not hdr:
-        try:
-            worksheet.append_row(expected)
-            logger.info(f"✅ Создан заголовок: {expected}")
-            return expected
-        except Exception as e:
-            logger.error(f"❌ Ошибка создания заголовка: {e}")
-            raise RuntimeError(f"❌ Не удалось создать заголовок: {e}") from e
+def _sheet(gc: Optional[gspread.Client] = None) -> gspread.Worksheet:
+    """Получает рабочий лист из таблицы."""
+    return _get_or_create_worksheet(_open_sheet(gc), config.SHEET_NAME)
+
+
+def _is_handle_error(exc: BaseException) -> bool:
+    """Ошибки, после которых кэшированные клиент/таблица/листы нужно пересоздать.
+
+    Это ошибки авторизации (401/403, невозможность обновить токен) и «не найдено»
+    (таблица или лист удалены/переименованы). Квоты, 5xx и сетевые сбои сюда не
+    относятся — для них пересоздание хэндлов ничего не даёт.
+    """
+    if isinstance(exc, (gspread.SpreadsheetNotFound, gspread.WorksheetNotFound, RefreshError)):
+        return True
+    if isinstance(exc, gspread.exceptions.APIError):
+        # 403 из-за лимитов — это квота, а не права доступа
+        return getattr(exc, "code", None) in (401, 403, 404) and not is_quota_error(exc)
+    return False
+
+
+class _SheetSchema:
+    """Заголовок листа подписчиков и карта «колонка → номер», один раз на сессию.
 
-    # Проверяем наличие всех необходимых колонок
-    missing_cols = []
-    for col in expected:
-        if col not in hdr:
-            missing_cols.append(col)
+    Заголовок читается при первом обращении, дальше чтения и записи адресуют
+    ячейки по карте без запросов к API. Расхождение с листом (колонки
+    переставили или добавили) замечается бесплатно при каждой полной загрузке
+    листа: первая строка ``get_all_values`` и есть заголовок. Недостающие
+    колонки дописываются в конец строки заголовка на месте.
+    """
+
+    def __init__(self, expected: Sequence[str]):
+        self.expected = list(expected)
+        self._lock = threading.Lock()
+        # Заголовок и номера колонок (с 0) по именам — меняются вместе
+        self._state: Optional[Tuple[List[str], Dict[str, int]]] = None
+
+    def columns(self, worksheet: gspread.Worksheet) -> Tuple[List[str], Dict[str, int]]:
+        """Заголовок и карта колонок (при первом обращении — ``row_values(1)`` и миграция)."""
+        state = self._state
+        if state is not None:
+            return state
+        with self._lock:
+            if self._state is None:
+                self._apply(worksheet, worksheet.row_values(1))
+            return self._state  # type: ignore[return-value]
+
+    def header(self, worksheet: gspread.Worksheet) -> List[str]:
+        return self.columns(worksheet)[0]
+
+    def observe(self, worksheet: gspread.Worksheet, row: List[str]) -> List[str]:
+        """Сверяет заголовок с первой строкой, только что прочитанной с листа."""
+        row = list(row)
+        # get_all_values дополняет строки пустыми ячейками до ширины данных
+        while row and row[-1] == "":
+            row.pop()
+        with self._lock:
+            known = self._state[0] if self._state is not None else None
+            if row != known:
+                if known is not None:
+                    logger.warning(f"⚠️ Заголовок листа изменился: {known} → {row}")
+                self._apply(worksheet, row)
+            return self._state[0]  # type: ignore[index]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._state = None
+
+    def _apply(self, worksheet: gspread.Worksheet, row: List[str]) -> None:
+        header = self._migrate(worksheet, row)
+        columns: Dict[str, int] = {}
+        for i, name in enumerate(header):
+            if name:
+                columns.setdefault(name, i)
+        self._state = (header, columns)
+
+    def _migrate(self, worksheet: gspread.Worksheet, row: List[str]) -> List[str]:
+        if not row:
+            worksheet.update([self.expected], range_name="A1")
+            logger.info(f"✅ Создан заголовок: {self.expected}")
+            return list(self.expected)
+        missing = [col for col in self.expected if col not in row]
+        if not missing:
+            return row
+        header = row + missing
+        col_count = getattr(worksheet, "col_count", None)
+        if col_count is not None and col_count < len(header):
+            worksheet.add_cols(len(header) - col_count)
+        cell_range = f"{rowcol_to_a1(1, len(row) + 1)}:{rowcol_to_a1(1, len(header))}"
+        worksheet.update([missing], range_name=cell_range)
+        logger.info(f"✅ Добавлены колонки в заголовок: {missing}")
+        return header
+
+
+class _SheetsSession:
+    """Долгоживущая сессия Google Sheets на весь процесс.
+
+    Аутентифицируется один раз, запоминает сработавший метод открытия таблицы
+    и держит хэндлы ``Spreadsheet``/``Worksheet``. Access-токен сервисного
+    аккаунта обновляется прозрачно: gspread работает через ``AuthorizedSession``,
+    которая перевыпускает истёкший токен перед запросом. Хэндлы сбрасываются
+    только после ошибки авторизации или «не найдено» (см. ``_is_handle_error``).
+    """
 
-    # Дополняем заголовок недостающими колонками
-    if missing_cols:
+    def __init__(self, client_factory: Optional[Callable[[], gspread.Client]] = None):
+        self._client_factory = client_factory or _get_gspread_client
+        self._lock = threading.RLock()
+        self._client: Optional[gspread.Client] = None
+        self._spreadsheet: Optional[gspread.Spreadsheet] = None
+        self._open_method: Optional[int] = None
+        self._worksheets: Dict[str, gspread.Worksheet] = {}
+        self.schema = _SheetSchema(COLUMNS)
+
+    def client(self) -> gspread.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = self._client_factory()
+            return self._client
+
+    def spreadsheet(self) -> gspread.Spreadsheet:
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet, self._open_method = _open_sheet_with_method(
+                    self.client(), preferred=self._open_method
+                )
+            return self._spreadsheet
+
+    def worksheet(self, title: Optional[str] = None, header: Optional[List[str]] = None) -> gspread.Worksheet:
+        """Возвращает кэшированный лист (по умолчанию ``config.SHEET_NAME``)."""
+        title = title or config.SHEET_NAME
+        with self._lock:
+            ws = self._worksheets.get(title)
+            if ws is None:
+                ws = _get_or_create_worksheet(self.spreadsheet(), title, header)
+                self._worksheets[title] = ws
+            return ws
+
+    def reset(self) -> None:
+        """Сбрасывает все хэндлы; следующий вызов заново авторизуется и откроет таблицу."""
+        with self._lock:
+            self._client = None
+            self._spreadsheet = None
+            self._worksheets.clear()
+        # Лист могли пересоздать или заменить — заголовок перечитаем
+        self.schema.invalidate()
+        logger.info("🔄 Сессия Google Sheets сброшена")
+
+    def run(
+        self,
+        fn: Callable[[gspread.Worksheet], T],
+        title: Optional[str] = None,
+        header: Optional[List[str]] = None,
+    ) -> T:
+        """Выполняет ``fn(worksheet)``; при ошибке хэндлов пересоздаёт их и повторяет один раз."""
         try:
-            worksheet.append_row(missing_cols)
-            logger.info(f"✅ Добавлены колонки: {missing_cols}")
+            return fn(self.worksheet(title, header))
         except Exception as e:
-            logger.warning(f"⚠️ Не удалось добавить колонки: {e}")
+            if not _is_handle_error(e):
+                raise
+            logger.warning(f"⚠️ Хэндлы Google Sheets устарели ({e}), переподключаюсь...")
+            self.reset()
+            return fn(self.worksheet(title, header))
 
-    # Возвращаем обновленные заголовки
-    try:
-        updated_headers = worksheet.row_values(1)
-        logger.info(f"📋 Обновленные заголовки: {updated_headers}")
-        return updated_headers
-    except Exception as e:
-        logger.error(f"❌ Ошибка получения заголовков: {e}")
-        return hdr
+
+_SESSION = _SheetsSession()
+
+# Одновременные загрузки листа подписчиков и перестроения индекса выполняются один раз
+_FETCH_FLIGHT = SingleFlight("sheets_fetch")
+_REFRESH_FLIGHT = SingleFlight("index_refresh")
+
+
+def get_session() -> _SheetsSession:
+    """Возвращает общую для процесса сессию Google Sheets."""
+    return _SESSION
 
 
-def _dataframe_from_rows(rows: List[List], header: List[str]) -> pd.DataFrame:
+def prewarm() -> None:
+    """Авторизуется, открывает таблицу, находит листы и проверяет заголовок заранее."""
+    _SESSION.run(_SESSION.schema.header)
+    _SESSION.worksheet(PROMO_LOG_SHEET, PROMO_LOG_HEADER)
+
+
+def _dataframe_from_rows(rows: List[List], header: List[str]) -> "pd.DataFrame":
     """Конвертирует данные из таблицы в DataFrame."""
+    import pandas as pd
+
     # Убираем полностью пустые строки
     cleaned_rows = [r for r in rows if any(str(v).strip() for v in r)]
 
@@ -262,7 +442,7 @@ def _dataframe_from_rows(rows: List[List], header: List[str]) -> pd.DataFrame:
     return df
 
 
-def _rows_from_dataframe(df: pd.DataFrame, header: List[str]) -> List[List]:
+def _rows_from_dataframe(df: "pd.DataFrame", header: List[str]) -> List[List]:
     """Конвертирует DataFrame в формат для записи в таблицу."""
     # Дополняем недостающие колонки пустыми значениями
     for col in header:
@@ -284,24 +464,36 @@ def _rows_from_dataframe(df: pd.DataFrame, header: List[str]) -> List[List]:
     return df.values.tolist()
 
 
-def load_subscribers_df() -> pd.DataFrame:
-    """Загружает данные подписчиков из Google Sheets."""
-    try:
-        gc = _get_gspread_client()
-        ws = _sheet(gc)
-        header = _ensure_header(ws)
-
+def _fetch_sheet_values() -> Tuple[List[str], List[List[str]]]:
+    """Скачивает лист подписчиков целиком: (заголовок, строки данных без заголовка)."""
+    def _load(ws: gspread.Worksheet) -> Tuple[List[str], List[List[str]]]:
         all_values = ws.get_all_values()
+        # Первая строка — заголовок: заодно сверяем его с картой колонок
+        header = _SESSION.schema.observe(ws, all_values[0] if all_values else [])
+        return header, all_values[1:]
+
+    # Лист нужен и индексу, и выгрузке в DataFrame — одновременные загрузки объединяются.
+    # Поколение записей в ключе: к загрузке, начатой до последней записи, не присоединяемся
+    return _FETCH_FLIGHT.do(("subscribers", _INDEX.generation), _SESSION.run, _load)
 
-        if not all_values:
-            logger.info("📭 Таблица пуста (нет данных)")
-            return pd.DataFrame(columns=header)
 
-        # Первая строка — заголовок, данные начинаются со второй
-        data_rows = all_values[1:] if len(all_values) > 1 else []
-        df = _dataframe_from_rows(data_rows, header)
+def _fetch_subscribers_df() -> "pd.DataFrame":
+    """Скачивает лист подписчиков в DataFrame; ошибки пробрасываются вызывающему."""
+    import pandas as pd
+
+    header, data_rows = _fetch_sheet_values()
+    if not data_rows:
+        logger.info("📭 Таблица пуста (нет данных)")
+        return pd.DataFrame(columns=header)
+    return _dataframe_from_rows(data_rows, header)
 
-        return df
+
+def load_subscribers_df() -> "pd.DataFrame":
+    """Загружает данные подписчиков из Google Sheets."""
+    import pandas as pd
+
+    try:
+        return _fetch_subscribers_df()
 
     except Exception as e:
         logger.error(f"❌ Ошибка чтения Google Sheets: {e}")
@@ -312,12 +504,257 @@ def load_subscribers_df() -> pd.DataFrame:
         ])
 
 
-def save_subscribers_df(df: pd.DataFrame):
-    """Сохраняет данные подписчиков в Google Sheets."""
+def _records_from_dataframe(df: "pd.DataFrame") -> Tuple[Dict[int, SubscriberRecord], Dict[int, int]]:
+    """Строит (user_id → запись, user_id → номер строки) из DataFrame, записанного на лист подряд."""
+    import pandas as pd
+
+    records: Dict[int, SubscriberRecord] = {}
+    rows: Dict[int, int] = {}
+    for i, rec in enumerate(df.to_dict("records")):
+        uid = rec.get("user_id")
+        if uid is None or pd.isna(uid):
+            continue
+        rec["user_id"] = int(uid)
+        # Первая запись пользователя главная — как и при поиске по маске
+        if rec["user_id"] not in records:
+            records[rec["user_id"]] = SubscriberRecord.from_dict(rec)
+            rows[rec["user_id"]] = i + 2  # строка 1 — заголовок
+    return records, rows
+
+
+class _SubscriberIndex:
+    """Резидентный индекс подписчиков: user_id → запись и номер строки на листе.
+
+    Записи хранятся компактно (``SubscriberRecord``) и разбираются из строк
+    ``get_all_values`` без pandas. Загружается с листа один раз и дальше поддерживается в актуальном состоянии
+    записью «насквозь» (write-through) из функций, меняющих лист. Полная
+    перезагрузка происходит раз в ``config.SUBSCRIBERS_REFRESH_INTERVAL`` секунд
+    (0 — только по запросу через ``refresh_subscriber_index``).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._records: Dict[int, SubscriberRecord] = {}
+        self._rows: Dict[int, int] = {}
+        self._loaded_at: Optional[float] = None
+        # Растёт с каждой записью в индекс (put/replace)
+        self.generation = 0
+        # Записи, сделанные во время загрузки листа: user_id → (запись, номер строки)
+        self._journal: Optional[Dict[int, Tuple[SubscriberRecord, Optional[int]]]] = None
+
+    def _is_stale(self) -> bool:
+        if self._loaded_at is None:
+            return True
+        interval = config.SUBSCRIBERS_REFRESH_INTERVAL
+        return interval > 0 and time.monotonic() - self._loaded_at >= interval
+
+    def refresh(self) -> int:
+        """Перечитывает лист целиком. Возвращает число записей в индексе.
+
+        Записи на лист не ждут загрузки: всё, что ``put`` внёс в индекс, пока
+        лист скачивался, снимок может не увидеть, поэтому такие записи собираются
+        в журнал и накладываются поверх снимка. Иначе только что дописанный
+        пользователь пропал бы из индекса и при следующем обращении был бы
+        записан на лист повторно.
+        """
+        with self._lock:
+            journal = self._journal = {}
+        try:
+            header, data_rows = _fetch_sheet_values()
+            parse = SubscriberRecord.parser(header)
+            records: Dict[int, SubscriberRecord] = {}
+            rows: Dict[int, int] = {}
+            for i, values in enumerate(data_rows):
+                record = parse(values)
+                if record is not None and record.user_id not in records:
+                    records[record.user_id] = record
+                    rows[record.user_id] = i + 2  # строка 1 — заголовок
+            with self._lock:
+                if self._journal is not journal:
+                    # Индекс заменили целиком (save_subscribers_df), пока грузился лист — снимок старше
+                    return len(self._records)
+                row_unknown = False
+                for user_id, (record, row) in journal.items():
+                    records[user_id] = record
+                    if row is not None:
+                        rows[user_id] = row
+                    else:
+                        row_unknown = True
+                self.replace(records, rows)
+                if row_unknown:
+                    self._loaded_at = None
+        finally:
+            with self._lock:
+                if self._journal is journal:
+                    self._journal = None
+        logger.info(f"📇 Индекс подписчиков обновлён: {len(records)} записей")
+        return len(records)
+
+    def _refresh_if_stale(self) -> int:
+        if self._is_stale():
+            return self.refresh()
+        return len(self)
+
+    def ensure_fresh(self) -> None:
+        if not self._is_stale():
+            return
+        try:
+            # Все, кто обратился к устаревшему индексу, ждут одну загрузку листа
+            # и при сбое получают её ошибку, а не повторяют загрузку по очереди
+            _REFRESH_FLIGHT.do("index", self._refresh_if_stale)
+        except Exception as e:
+            # Оставляем прежние данные; при первой загрузке индекс пуст,
+            # и следующая попытка будет при следующем обращении.
+            logger.error(f"❌ Не удалось обновить индекс подписчиков: {e}")
+
+    def replace(self, records: Dict[int, SubscriberRecord], rows: Dict[int, int]) -> None:
+        with self._lock:
+            self._records = records
+            self._rows = rows
+            self._loaded_at = time.monotonic()
+            self.generation += 1
+            # Загружаемый сейчас снимок листа старше этих данных
+            self._journal = None
+
+    def invalidate(self) -> None:
+        """Помечает индекс устаревшим: следующее обращение перечитает лист."""
+        with self._lock:
+            self._loaded_at = None
+
+    def get(self, user_id: int, strict: bool = False) -> Optional[SubscriberRecord]:
+        """Возвращает запись пользователя.
+
+        При ``strict=True`` бросает ``RuntimeError``, если индекс так и не удалось
+        загрузить: записывать «новых» пользователей вслепую нельзя — это дубли.
+        """
+        self.ensure_fresh()
+        if strict and self._loaded_at is None:
+            raise RuntimeError("❌ Индекс подписчиков не загружен")
+        return self._records.get(int(user_id))
+
+    def row_of(self, user_id: int) -> Optional[int]:
+        return self._rows.get(int(user_id))
+
+    def put(self, record: Dict, row: Optional[int]) -> None:
+        with self._lock:
+            user_id = int(record["user_id"])
+            self._records[user_id] = SubscriberRecord.from_dict(record)
+            self.generation += 1
+            if self._journal is not None:
+                self._journal[user_id] = (self._records[user_id], row)
+            if row is not None:
+                self._rows[user_id] = row
+            else:
+                # Номер строки неизвестен — перечитаем лист при следующем обращении
+                self._loaded_at = None
+
+    def records(self) -> List[Dict]:
+        """Все записи индекса словарями."""
+        return [record.to_dict() for record in list(self._records.values())]
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+_INDEX = _SubscriberIndex()
+
+metrics.gauge("sheets_subscriber_index_size", "Записей в резидентном индексе подписчиков", lambda: len(_INDEX))
+
+# Запись на лист подписчиков сериализуется: номера строк в индексе должны
+# соответствовать порядку дозаписи.
+_WRITE_LOCK = threading.RLock()
+
+
+def refresh_subscriber_index() -> int:
+    """Принудительно перезагружает индекс подписчиков с листа."""
+    return _REFRESH_FLIGHT.do("index", _INDEX.refresh)
+
+
+def _cell_value(value) -> str:
+    """Готовит значение к записи в ячейку: None/NaN/NA → пустая строка."""
+    if value is None:
+        return ""
     try:
-        gc = _get_gspread_client()
-        ws = _sheet(gc)
-        header = _ensure_header(ws)
+        # NaN не равен сам себе; у pandas.NA сравнение неоднозначно и бросает TypeError
+        if value != value:
+            return ""
+    except TypeError:
+        return ""
+    return str(value)
+
+
+def _row_from_updated_range(response) -> Optional[int]:
+    """Достаёт номер строки из ответа append ('Sheet1!A5:H5' → 5)."""
+    try:
+        updated_range = response["updates"]["updatedRange"]
+    except (KeyError, TypeError):
+        return None
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) if match else None
+
+
+def _write_subscribers(items: Sequence[Tuple[Dict, Optional[List[str]]]]) -> None:
+    """Записывает записи подписчиков на лист минимальным числом запросов.
+
+    Для известных строк обновляется диапазон от первой до последней колонки из
+    ``changed`` (все диапазоны — одним ``batch_update``), новые записи
+    дописываются в конец таблицы одним ``append_rows``.
+    """
+    def _write(ws: gspread.Worksheet) -> List[Optional[int]]:
+        header, columns = _SESSION.schema.columns(ws)
+        rows: List[Optional[int]] = [None] * len(items)
+        updates: List[Dict] = []
+        appended: List[Tuple[int, List[str]]] = []
+
+        for i, (record, changed) in enumerate(items):
+            values = [_cell_value(record.get(col)) for col in header]
+            row = _INDEX.row_of(record["user_id"])
+            if row is None:
+                appended.append((i, values))
+                continue
+            rows[i] = row
+            cols = [columns[col] for col in (changed or header) if col in columns]
+            if not cols:
+                continue
+            first, last = min(cols), max(cols)
+            updates.append({
+                "range": f"{rowcol_to_a1(row, first + 1)}:{rowcol_to_a1(row, last + 1)}",
+                "values": [values[first:last + 1]],
+            })
+
+        if len(updates) == 1:
+            ws.update(updates[0]["values"], range_name=updates[0]["range"])
+        elif updates:
+            ws.batch_update(updates)
+
+        if appended:
+            response = ws.append_rows([values for _, values in appended], table_range="A1")
+            first_row = _row_from_updated_range(response)
+            for offset, (i, _) in enumerate(appended):
+                rows[i] = first_row + offset if first_row is not None else None
+        return rows
+
+    with _WRITE_LOCK:
+        try:
+            rows = _SESSION.run(_write)
+        except Exception:
+            # Запись могла дойти до листа (дозапись не повторяется после таймаута):
+            # перечитаем лист, прежде чем снова решать, кого дописывать
+            _INDEX.invalidate()
+            raise
+        for (record, _), row in zip(items, rows):
+            _INDEX.put(record, row)
+
+
+def _write_subscriber(record: Dict, changed: Optional[List[str]] = None) -> None:
+    """Записывает одну запись подписчика на лист (см. ``_write_subscribers``)."""
+    _write_subscribers([(record, changed)])
+
+
+def save_subscribers_df(df: "pd.DataFrame"):
+    """Сохраняет данные подписчиков в Google Sheets."""
+    def _save(ws: gspread.Worksheet) -> None:
+        header = _SESSION.schema.header(ws)
 
         rows = _rows_from_dataframe(df, header)
 
@@ -331,50 +768,190 @@ def save_subscribers_df(df: pd.DataFrame):
         else:
             logger.info("📭 Нет данных для записи")
 
+    try:
+        with _WRITE_LOCK:
+            _SESSION.run(_save)
+            _INDEX.replace(*_records_from_dataframe(df))
     except Exception as e:
         logger.error(f"❌ Ошибка записи в Google Sheets: {e}")
         raise RuntimeError(f"❌ Не удалось сохранить данные: {e}") from e
 
 
+class _PromoLogWriter:
+    """Буферизованная запись лога промокодов (write-behind) с локальным спулом.
+
+    Записи копятся в памяти и одновременно дописываются в спул-файл
+    (JSON Lines, только дозапись). На лист ``promo_log`` они уходят одним
+    ``append_rows``, когда набирается ``config.PROMO_LOG_BATCH_SIZE`` записей
+    или проходит ``config.PROMO_LOG_FLUSH_INTERVAL`` секунд. После успешной
+    отправки спул переписывается оставшимися записями; при старте всё, что
+    в нём осталось, отправляется заново — строки лога не теряются при падении.
+    """
+
+    def __init__(self, spool_file: str):
+        self._spool = Path(spool_file)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer: List[List[str]] = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Один обработчик на весь процесс: stop() без запущенного потока ничего не делает
+        atexit.register(self.stop)
+
+    @property
+    def pending(self) -> int:
+        """Сколько записей ещё не отправлено на лист."""
+        return len(self._buffer)
+
+    def start(self) -> None:
+        """Поднимает записи из спула и запускает фоновую отправку."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            # Спул всегда содержит весь буфер: после stop() записи не дублируются
+            spooled = self._read_spool()
+            replayed = spooled[len(self._buffer):]
+            self._buffer = spooled
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._loop, name="promo-log-writer", daemon=True)
+            self._thread.start()
+        if replayed:
+            logger.info(f"♻️ Из спула лога промокодов восстановлено записей: {len(replayed)}")
+            self._wakeup.set()
+
+    def stop(self) -> None:
+        """Останавливает фоновую отправку и пытается отправить остаток."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        thread.join()
+        self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            # Записи остаются в спуле и уйдут на лист при следующем запуске
+            logger.warning(f"⚠️ Не удалось отправить остаток лога промокодов, он сохранён в спуле: {e}")
+
+    def add(self, row: List[str]) -> None:
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            self._buffer.append(row)
+            with self._spool.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(dict(zip(PROMO_LOG_HEADER, row)), ensure_ascii=False) + "\n")
+            full = len(self._buffer) >= config.PROMO_LOG_BATCH_SIZE
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Отправляет накопленные записи одним запросом. Возвращает их число."""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._buffer)
+            if not batch:
+                return 0
+            # Лог — фоновая запись: пропускаем вперёд запросы, которых ждут пользователи
+            with priority(PRIORITY_BACKGROUND):
+                _SESSION.run(lambda ws: ws.append_rows(batch), PROMO_LOG_SHEET, PROMO_LOG_HEADER)
+            with self._lock:
+                # Новые записи дописывались в конец — отправленные лежат в начале
+                del self._buffer[:len(batch)]
+                self._rewrite_spool()
+        logger.info(f"✅ В promo_log отправлено записей: {len(batch)}")
+        return len(batch)
+
+    def _loop(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(config.PROMO_LOG_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось отправить лог промокодов, повторю позже: {e}")
+
+    def _read_spool(self) -> List[List[str]]:
+        if not self._spool.exists():
+            return []
+        rows = []
+        with self._spool.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Оборванная последняя строка после падения
+                    logger.warning(f"⚠️ Пропущена повреждённая строка спула: {line!r}")
+                    continue
+                rows.append([str(entry.get(col, "")) for col in PROMO_LOG_HEADER])
+        return rows
+
+    def _rewrite_spool(self) -> None:
+        tmp = self._spool.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            for row in self._buffer:
+                f.write(json.dumps(dict(zip(PROMO_LOG_HEADER, row)), ensure_ascii=False) + "\n")
+        tmp.replace(self._spool)
+
+
+_PROMO_LOG = _PromoLogWriter(config.PROMO_LOG_SPOOL_FILE)
+
+metrics.gauge(
+    "promo_log_pending", "Записи лога промокодов, ещё не отправленные на лист", lambda: _PROMO_LOG.pending
+)
+
+
+def start_promo_log_writer() -> None:
+    """Запускает отправку лога промокодов и досылает неотправленное из спула."""
+    _PROMO_LOG.start()
+
+
+def stop_promo_log_writer() -> None:
+    """Останавливает отправку лога промокодов, отправив накопленное."""
+    _PROMO_LOG.stop()
+
+
+def flush_promo_log() -> int:
+    """Немедленно отправляет накопленные записи лога промокодов."""
+    return _PROMO_LOG.flush()
+
+
 def log_promo_issue(user_id: int, promo: str, timestamp: Optional[str] = None, source: Optional[str] = None, gc: Optional[gspread.Client] = None) -> None:
     """Appends a log entry about promo issuance to a sheet named 'promo_log'.
 
     Columns: user_id, promo_code, timestamp, issued_by
+
+    Without an explicit ``gc`` the entry is buffered and sent in batches
+    (see ``_PromoLogWriter``).
     """
     try:
         if timestamp is None:
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        if gc is None:
-            gc = _get_gspread_client()
-
-        sp = _open_sheet(gc)
-        # Try to get or create worksheet named 'promo_log'
-        try:
-            ws = sp.worksheet('promo_log')
-        except Exception:
-            ws = sp.add_worksheet(title='promo_log', rows=1000, cols=10)
-            ws.append_row(['user_id', 'promo_code', 'timestamp', 'issued_by'])
-
         # Ensure we pass strings to append_row
-        ws.append_row([str(user_id), str(promo), str(timestamp), str(source or "")])
-        logger.info(f"✅ Logged promo for user {user_id}: {promo}")
+        row = [str(user_id), str(promo), str(timestamp), str(source or "")]
+
+        if gc is not None:
+            # Явно переданный клиент — открываем лист через него, минуя общую сессию
+            ws = _get_or_create_worksheet(_open_sheet(gc), PROMO_LOG_SHEET, PROMO_LOG_HEADER)
+            ws.append_row(row)
+            logger.info(f"✅ Logged promo for user {user_id}: {promo}")
+        else:
+            _PROMO_LOG.add(row)
+            logger.info(f"📝 Queued promo log for user {user_id}: {promo}")
     except Exception as e:
         logger.warning(f"⚠️ Не удалось записать лог промокода: {e}")
 
 
-def user_row(user_id: int) -> Optional[pd.Series]:
-    """Находит запись пользователя по ID."""
-    df = load_subscribers_df()
-    if df.empty:
-        logger.info(f"🔍 Пользователь {user_id}: таблица пуста")
-        return None
-
-    mask = df["user_id"] == user_id
-    if mask.any():
-        user_data = df[mask].iloc[0]
+def user_row(user_id: int) -> Optional[Dict]:
+    """Находит запись пользователя по ID (в резидентном индексе, без запроса к API)."""
+    record = _INDEX.get(user_id)
+    if record is not None:
         logger.info(f"✅ Пользователь {user_id} найден в таблице")
-        return user_data
+        return record.to_dict()
     else:
         logger.info(f"🔍 Пользователь {user_id} не найден в таблице")
         return None
@@ -382,10 +959,11 @@ def user_row(user_id: int) -> Optional[pd.Series]:
 
 def user_has_promo(user_id: int) -> Tuple[bool, Optional[str]]:
     """Проверяет, есть ли у пользователя промокод."""
-    row = user_row(user_id)
-    if row is None:
+    record = _INDEX.get(user_id)
+    if record is None:
+        logger.info(f"🔍 Пользователь {user_id} не найден в таблице")
         return False, None
-    promo = row.get("promo_code") or None
+    promo = record.promo_code or None
     has_promo = bool(promo)
 
     if has_promo:
@@ -396,6 +974,79 @@ def user_has_promo(user_id: int) -> Tuple[bool, Optional[str]]:
     return has_promo, promo
 
 
+class SheetsSubscriberStorage(SubscriberStorage):
+    """Хранилище подписчиков прямо в Google Sheets (лист ``config.SHEET_NAME``).
+
+    Чтения идут из резидентного индекса, записи — построчно (``_write_subscribers``),
+    лог промокодов — через буферизованный ``_PromoLogWriter``.
+    """
+
+    name = "sheets"
+
+    def start(self) -> None:
+        try:
+            refresh_subscriber_index()
+        except Exception as e:
+            # Не фатально: индекс загрузится при первом обращении
+            logger.warning(f"⚠️ Не удалось загрузить индекс подписчиков при запуске: {e}")
+        start_promo_log_writer()
+
+    def close(self) -> None:
+        stop_promo_log_writer()
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        record = _INDEX.get(user_id)
+        return record.to_dict() if record is not None else None
+
+    @staticmethod
+    def _prepare(user_id: int, ops: Sequence[SubscriberOp]) -> Optional[Tuple[Dict, Optional[List[str]]]]:
+        """Новая запись и изменённые колонки; None, если сохранять нечего."""
+        # strict: без загруженного индекса «новая» запись может оказаться дублем
+        stored = _INDEX.get(user_id, strict=True)
+        current = stored.to_dict() if stored is not None else None
+        record = apply_ops(current, ops, now_str())
+        if record is None or record == current:
+            return None
+        changed = None if current is None else [col for col in record if record[col] != current.get(col)]
+        return record, changed
+
+    def apply(self, user_id: int, ops: Sequence[SubscriberOp]) -> Optional[Dict]:
+        with _WRITE_LOCK:
+            prepared = self._prepare(user_id, ops)
+            if prepared is None:
+                return None
+            _write_subscriber(*prepared)
+            return prepared[0]
+
+    def apply_many(self, changes: Mapping[int, Sequence[SubscriberOp]]) -> List[Dict]:
+        """Все изменения — одним ``batch_update`` (и одним ``append_rows`` для новых)."""
+        with _WRITE_LOCK:
+            items = [prepared for prepared in (self._prepare(uid, ops) for uid, ops in changes.items()) if prepared]
+            if items:
+                _write_subscribers(items)
+            return [record for record, _ in items]
+
+    def log_promo(self, user_id: int, promo: str, timestamp: str, source: Optional[str]) -> None:
+        _PROMO_LOG.add([str(user_id), str(promo), str(timestamp), str(source or "")])
+
+    def records(self) -> Iterable[Dict]:
+        _INDEX.ensure_fresh()
+        return _INDEX.records()
+
+
+_SHEETS_STORAGE = SheetsSubscriberStorage()
+
+
+def sheets_storage() -> SheetsSubscriberStorage:
+    """Хранилище подписчиков в Google Sheets (основное или зеркало SQLite)."""
+    return _SHEETS_STORAGE
+
+
+def load_subscriber(user_id: int) -> SubscriberContext:
+    """Загружает запись пользователя с листа для обработки одного апдейта."""
+    return _SHEETS_STORAGE.load(user_id)
+
+
 def save_subscriber_to_sheet(
     user_id: int,
     username: Optional[str],
@@ -408,47 +1059,13 @@ def save_subscriber_to_sheet(
     Возвращает True, если это новая запись.
     """
     try:
-        df = load_subscribers_df()
-        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        idx = df.index[df["user_id"] == user_id]
-
-        if len(idx) == 0:
-            # Новая запись
-            new_row = pd.Series({
-                "user_id": user_id,
-                "username": username or "",
-                "full_name": full_name or "",
-                "joined_at": now_str,
-                "promo_code": promo_code,
-                "issued_by": issued_by or "",
-                "status": "подписан",
-                "unsubscribed_at": "",
-            })
-            df = pd.concat([df, new_row.to_frame().T], ignore_index=True)
-            save_subscribers_df(df)
+        created = _SHEETS_STORAGE.save_subscriber(user_id, username, full_name, promo_code, issued_by)
+
+        if created:
             logger.info(f"🆕 Новый подписчик добавлен: {user_id} (@{username})")
-            return True
         else:
-            # Обновление существующей записи
-            i = idx[0]
-
-            if pd.isna(df.at[i, "username"]) or df.at[i, "username"] == "":
-                df.at[i, "username"] = username or ""
-            if pd.isna(df.at[i, "full_name"]) or df.at[i, "full_name"] == "":
-                df.at[i, "full_name"] = full_name or ""
-            if pd.isna(df.at[i, "promo_code"]) or df.at[i, "promo_code"] == "":
-                df.at[i, "promo_code"] = promo_code
-            # Обновляем поле issued_by если передан источник выдачи
-            if issued_by is not None and (pd.isna(df.at[i, "issued_by"]) or df.at[i, "issued_by"] == ""):
-                df.at[i, "issued_by"] = issued_by
-            df.at[i, "status"] = "подписан"
-            if pd.isna(df.at[i, "joined_at"]) or df.at[i, "joined_at"] == "":
-                df.at[i, "joined_at"] = now_str
-            df.at[i, "unsubscribed_at"] = ""
-
-            save_subscribers_df(df)
             logger.info(f"🔄 Обновлена запись пользователя: {user_id}")
-            return False
+        return created
 
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения пользователя {user_id}: {e}")
@@ -458,26 +1075,17 @@ def save_subscriber_to_sheet(
 def mark_unsubscribed(user_id: int) -> bool:
     """Отмечает пользователя как отписавшегося."""
     try:
-        df = load_subscribers_df()
-        if df.empty:
-            logger.warning(f"⚠️ Попытка отписать несуществующего пользователя: {user_id}")
-            return False
-
-        idx = df.index[df["user_id"] == user_id]
+        ctx = _SHEETS_STORAGE.load(user_id)
 
-        if len(idx) == 0:
+        if not ctx.exists:
             logger.warning(f"⚠️ Пользователь {user_id} не найден для отписки")
             return False
 
-        i = idx[0]
-        prev_status = df.at[i, "status"]
-        if prev_status == "отписан":
+        if not ctx.mark_unsubscribed():
             logger.info(f"ℹ️ Пользователь {user_id} уже отписан")
             return False
 
-        df.at[i, "status"] = "отписан"
-        df.at[i, "unsubscribed_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        save_subscribers_df(df)
+        ctx.commit()
         logger.info(f"👋 Пользователь отписан: {user_id}")
         return True
 
@@ -489,21 +1097,14 @@ def mark_unsubscribed(user_id: int) -> bool:
 def mark_subscribed_if_exists(user_id: int) -> None:
     """Обновляет статус пользователя на 'подписан'."""
     try:
-        df = load_subscribers_df()
-        if df.empty:
-            logger.info(f"ℹ️ Нет данных для обновления статуса пользователя {user_id}")
-            return
-
-        idx = df.index[df["user_id"] == user_id]
+        ctx = _SHEETS_STORAGE.load(user_id)
 
-        if len(idx) == 0:
+        if not ctx.exists:
             logger.info(f"ℹ️ Пользователь {user_id} не найден для обновления статуса")
             return
 
-        i = idx[0]
-        if df.at[i, "status"] != "подписан":
-            df.at[i, "status"] = "подписан"
-            save_subscribers_df(df)
+        if ctx.mark_subscribed():
+            ctx.commit()
             logger.info(f"✅ Статус обновлен на 'подписан': {user_id}")
         else:
             logger.info(f"ℹ️ Пользователь {user_id} уже имеет статус 'подписан'")
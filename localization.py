@@ -1,23 +1,38 @@
 import json
-import os
-from typing import Dict
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
 
-LOCALES_DIR = "locales"
+# Каталоги лежат рядом с модулем — не зависим от текущей директории
+LOCALES_DIR = Path(__file__).resolve().with_name("locales")
 DEFAULT_LANG = "ru"
 _LOCALES_CACHE: Dict[str, Dict] = {}
+# Разобранные шаблоны: язык → ключ → (шаблон, нужен ли format())
+_TEMPLATES: Dict[str, Dict[str, Tuple[str, bool]]] = {}
+
+
+def _needs_format(template: str) -> bool:
+    # Без фигурных скобок format() вернёт строку как есть — его можно не вызывать
+    return "{" in template or "}" in template
+
+
+def _load_all() -> None:
+    """Читает все каталоги один раз (при импорте модуля)."""
+    for path in sorted(LOCALES_DIR.glob("*.json")):
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        _LOCALES_CACHE[path.stem] = data
+        _TEMPLATES[path.stem] = {
+            key: (value, _needs_format(value)) for key, value in data.items() if isinstance(value, str)
+        }
 
 
 def load_locale(lang: str) -> Dict:
-    if lang in _LOCALES_CACHE:
-        return _LOCALES_CACHE[lang]
-    path = os.path.join(LOCALES_DIR, f"{lang}.json")
-    if not os.path.exists(path):
-        lang = DEFAULT_LANG
-        path = os.path.join(LOCALES_DIR, f"{DEFAULT_LANG}.json")
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    _LOCALES_CACHE[lang] = data
-    return data
+    return _LOCALES_CACHE.get(lang) or _LOCALES_CACHE.get(DEFAULT_LANG, {})
+
+
+def languages() -> Tuple[str, ...]:
+    """Языки, для которых есть каталоги."""
+    return tuple(_LOCALES_CACHE)
 
 
 def detect_lang(telegram_lang_code: str | None) -> str:
@@ -30,9 +45,34 @@ def detect_lang(telegram_lang_code: str | None) -> str:
 
 
 def t(lang: str, key: str, **kwargs) -> str:
-    data = load_locale(lang)
-    template = data.get(key, key)
+    templates = _TEMPLATES.get(lang) or _TEMPLATES.get(DEFAULT_LANG, {})
+    template, needs_format = templates.get(key, (key, False))
+    if not needs_format:
+        return template
     try:
         return template.format(**kwargs)
     except Exception:
         return template
+
+
+def normalize_button(text: Optional[str]) -> str:
+    """Текст кнопки в виде для сравнения: без крайних пробелов, в нижнем регистре."""
+    return (text or "").strip().lower()
+
+
+def reverse_index(keys: Iterable[str]) -> Dict[str, str]:
+    """Нормализованный текст ключей ``keys`` во всех языках → ключ.
+
+    Нужен для разбора нажатий на reply-кнопки: текст приходит на языке
+    пользователя, а действие определяется одним поиском в словаре.
+    """
+    index: Dict[str, str] = {}
+    for lang in languages():
+        for key in keys:
+            text = normalize_button(t(lang, key))
+            if text and text != key:
+                index.setdefault(text, key)
+    return index
+
+
+_load_all()
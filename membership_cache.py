@@ -0,0 +1,79 @@
+# membership_cache.py
+"""Кэш результатов проверки подписки на канал (get_chat_member).
+
+Пользователи часто жмут кнопки по нескольку раз подряд, и каждая проверка
+подписки — отдельный запрос к Telegram API, который упирается в flood-лимиты.
+Кэш хранит ответ с раздельным временем жизни для «подписан» и «не подписан»
+(отрицательный ответ живёт меньше: пользователь мог только что подписаться),
+ограничен по размеру и вытесняет давно не использованные записи (LRU).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Статусы участника канала (ChatMember.status), которые считаются подпиской
+SUBSCRIBED_STATUSES = ("member", "administrator", "creator")
+
+
+class MembershipCache:
+    """LRU-кэш user_id → подписан ли пользователь, с раздельными TTL."""
+
+    def __init__(self, max_size: int, positive_ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        # user_id → (подписан, момент истечения по time.monotonic())
+        self._entries: "OrderedDict[int, Tuple[bool, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int) -> Optional[bool]:
+        """Возвращает закэшированный статус или None, если записи нет или она истекла."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id: int, subscribed: bool, ttl: Optional[float] = None) -> None:
+        """Запоминает статус; ``ttl`` заменяет время жизни по умолчанию для этого ответа."""
+        if ttl is None:
+            ttl = self.positive_ttl if subscribed else self.negative_ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (subscribed, time.monotonic() + ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: int) -> None:
+        """Забывает статус пользователя — например, когда стало известно, что он изменился."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики попаданий/промахов и текущий размер."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
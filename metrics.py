@@ -0,0 +1,328 @@
+# metrics.py
+"""Метрики бота в текстовом формате Prometheus.
+
+Счётчики, гистограммы и gauge-и регистрируются в общем реестре и отдаются
+по HTTP (``GET /metrics``) на локальном порту ``config.METRICS_PORT``:
+
+* ``bot_handler_duration_seconds`` / ``bot_handler_errors_total`` — обработчики
+  апдейтов (оборачиваются ``track_handler`` при регистрации);
+* ``sheets_requests_total`` / ``sheets_request_duration_seconds`` — запросы к
+  Google Sheets API по операциям (см. ``sheets_scheduler``);
+* ``telegram_requests_total`` / ``telegram_request_duration_seconds`` — вызовы
+  Bot API по методам (через ``MetricsRequest``);
+* gauge-и размеров кэшей и глубины очередей считаются в момент запроса.
+
+Внешних зависимостей нет: формат простой, сервер — ``http.server`` в отдельном потоке.
+"""
+import bisect
+import functools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # По ключу меток: [счётчики по корзинам (последняя — +Inf), сумма, количество]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(e[0]), e[1], e[2])) for key, e in self._values.items())
+        lines = self._header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+GaugeValue = Union[float, Dict[LabelValues, float]]
+
+
+class Gauge(_Metric):
+    """Значение считается функцией в момент запроса метрик.
+
+    ``kind="counter"`` — для монотонных счётчиков, которые уже ведёт сам объект
+    (например, попадания в кэш).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        fn: Callable[[], GaugeValue],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.debug("Gauge %s не посчитан: %s", self.name, e)
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(float(v))}"
+            for key, v in sorted(value.items())
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, Gauge):
+                # Повторный импорт модуля — возвращаем уже накопленные значения
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help_text, labelnames))  # type: ignore[return-value]
+
+
+def histogram(
+    name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, help_text, labelnames, buckets))  # type: ignore[return-value]
+
+
+def gauge(
+    name: str,
+    help_text: str,
+    fn: Callable[[], GaugeValue],
+    labelnames: Sequence[str] = (),
+    kind: str = "gauge",
+) -> Gauge:
+    """Регистрирует (или заменяет) метрику, значение которой возвращает ``fn``."""
+    return REGISTRY.register(Gauge(name, help_text, fn, labelnames, kind))  # type: ignore[return-value]
+
+
+# ---------- Обработчики апдейтов ----------
+HANDLER_DURATION = histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта обработчиком", ("handler",)
+)
+HANDLER_ERRORS = counter(
+    "bot_handler_errors_total", "Исключения в обработчиках апдейтов", ("handler",)
+)
+
+
+def track_handler(handler: Callable, name: Optional[str] = None) -> Callable:
+    """Оборачивает async-обработчик: гистограмма времени и счётчик ошибок."""
+    label = name or getattr(handler, "__name__", "handler")
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=label)
+            raise
+        finally:
+            HANDLER_DURATION.observe(time.perf_counter() - started, handler=label)
+
+    return wrapper
+
+
+# ---------- Telegram Bot API ----------
+TELEGRAM_REQUESTS = counter(
+    "telegram_requests_total", "Вызовы Telegram Bot API", ("method", "outcome")
+)
+TELEGRAM_DURATION = histogram(
+    "telegram_request_duration_seconds", "Время вызова Telegram Bot API", ("method",)
+)
+
+
+def _telegram_outcome(status: int) -> str:
+    if status == 200:
+        return "ok"
+    if status == 429:
+        return "flood"
+    return "error"
+
+
+class MetricsRequest(HTTPXRequest):
+    """``HTTPXRequest``, считающий вызовы Bot API по методам."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            TELEGRAM_REQUESTS.inc(method=api_method, outcome="exception")
+            raise
+        finally:
+            TELEGRAM_DURATION.observe(time.perf_counter() - started, method=api_method)
+        TELEGRAM_REQUESTS.inc(method=api_method, outcome=_telegram_outcome(status))
+        return status, payload
+
+
+# ---------- HTTP ----------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # Запросы сборщика метрик не логируем
+        pass
+
+
+_SERVER: Optional[ThreadingHTTPServer] = None
+
+
+def start_http_server(port: int, addr: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Поднимает ``GET /metrics`` в фоновом потоке (повторный вызов ничего не делает)."""
+    global _SERVER
+    if _SERVER is None:
+        _SERVER = ThreadingHTTPServer((addr, port), _MetricsHandler)
+        _SERVER.daemon_threads = True
+        threading.Thread(target=_SERVER.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info("📈 Метрики: http://%s:%s/metrics", addr, _SERVER.server_address[1])
+    return _SERVER
+
+
+def stop_http_server() -> None:
+    global _SERVER
+    if _SERVER is not None:
+        _SERVER.shutdown()
+        _SERVER.server_close()
+        _SERVER = None
@@ -0,0 +1,140 @@
+# notified_users.py
+"""Множество user_id, о которых администратор уже уведомлён.
+
+Множество держится в памяти и загружается один раз при старте. На диске оно
+хранится как снимок (JSON-список, прежний формат ``notified_users.json``) плюс
+журнал новых ID (по одному в строке, только дозапись). Отметка пользователя —
+проверка в множестве и не больше одной короткой дозаписи в журнал.
+
+Когда журнал разрастается, фоновый поток сворачивает его в снимок. Сворачивание
+безопасно при падении на любом шаге: журнал сначала переименовывается в
+``*.compacting`` (новые ID пишутся уже в свежий журнал), затем снимок
+атомарно заменяется через временный файл, и только после этого удаляется
+свёрнутый журнал. При загрузке читаются все три файла.
+"""
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class NotifiedUsers:
+    """Резидентное множество уведомлённых пользователей с журналом на диске."""
+
+    def __init__(self, snapshot_file: Path, compact_threshold: int = 1000):
+        self.snapshot_file = Path(snapshot_file)
+        self.log_file = self.snapshot_file.with_suffix(".log")
+        self.compacting_file = self.snapshot_file.with_suffix(".compacting")
+        self.compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._users: Optional[Set[int]] = None
+        self._log_lines = 0
+        self._compactor: Optional[threading.Thread] = None
+
+    def load(self) -> None:
+        """Читает снимок и журналы; повторный вызов ничего не делает."""
+        with self._lock:
+            if self._users is not None:
+                return
+            users: Set[int] = set()
+            try:
+                if self.snapshot_file.exists():
+                    with self.snapshot_file.open("r", encoding="utf-8") as f:
+                        data = json.load(f)
+                        if isinstance(data, list):
+                            users.update(int(x) for x in data)
+            except Exception as e:
+                logger.warning("Не удалось загрузить кэш уведомлённых пользователей: %s", e)
+            users.update(self._read_log(self.compacting_file))
+            log_users = self._read_log(self.log_file)
+            users.update(log_users)
+            self._users = users
+            self._log_lines = len(log_users)
+        logger.info("📇 Уведомлённых пользователей загружено: %s", len(users))
+
+    @staticmethod
+    def _read_log(path: Path) -> Set[int]:
+        users: Set[int] = set()
+        if not path.exists():
+            return users
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        users.add(int(line))
+                    except ValueError:
+                        # Оборванная последняя строка после падения
+                        continue
+        except Exception as e:
+            logger.warning("Не удалось прочитать журнал уведомлённых пользователей %s: %s", path, e)
+        return users
+
+    def __contains__(self, user_id: int) -> bool:
+        if self._users is None:
+            self.load()
+        assert self._users is not None
+        return int(user_id) in self._users
+
+    def __len__(self) -> int:
+        if self._users is None:
+            self.load()
+        assert self._users is not None
+        return len(self._users)
+
+    def add(self, user_id: int) -> None:
+        """Отмечает пользователя уведомлённым: дописывает ID в журнал, если его ещё нет."""
+        if self._users is None:
+            self.load()
+        assert self._users is not None
+        user_id = int(user_id)
+        with self._lock:
+            if user_id in self._users:
+                return
+            self._users.add(user_id)
+            try:
+                with self.log_file.open("a", encoding="utf-8") as f:
+                    f.write(f"{user_id}\n")
+                self._log_lines += 1
+            except Exception as e:
+                logger.warning("Не удалось сохранить кэш уведомлённых пользователей: %s", e)
+            need_compact = self._log_lines >= self.compact_threshold
+        if need_compact:
+            self.compact_in_background()
+
+    def compact_in_background(self) -> None:
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(
+                target=self.compact, name="notified-users-compactor", daemon=True
+            )
+            self._compactor.start()
+
+    def compact(self) -> None:
+        """Сворачивает журнал в снимок (см. описание модуля)."""
+        with self._lock:
+            if self._users is None:
+                return
+            users = sorted(self._users)
+            try:
+                if self.log_file.exists() and not self.compacting_file.exists():
+                    self.log_file.replace(self.compacting_file)
+                self._log_lines = 0
+            except Exception as e:
+                logger.warning("Не удалось начать сворачивание журнала уведомлённых: %s", e)
+                return
+        try:
+            tmp = self.snapshot_file.with_suffix(".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                json.dump(users, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            tmp.replace(self.snapshot_file)
+            self.compacting_file.unlink(missing_ok=True)
+            logger.info("🗜️ Журнал уведомлённых пользователей свёрнут: %s ID", len(users))
+        except Exception as e:
+            logger.warning("Не удалось свернуть журнал уведомлённых пользователей: %s", e)
@@ -0,0 +1,396 @@
+# outbox.py
+"""Очередь исходящих сообщений с приоритетами и лимитами Telegram.
+
+Ответы пользователям, поздравления в канале и уведомления администратору
+уходят через один диспетчер:
+
+* приоритет: ответ пользователю (``PRIORITY_REPLY``) уходит раньше поста в
+  канал (``PRIORITY_CHANNEL``), пост — раньше сообщения администратору
+  (``PRIORITY_ADMIN``). При наплыве пользователь получает ответ первым, а
+  поздравления и уведомления догоняют;
+* лимиты: не больше ``global_rate`` сообщений в секунду всего, в личный чат —
+  ``private_rate`` в секунду (подряд до ``private_burst``), в группу или канал —
+  ``group_rate`` в секунду (подряд до ``group_burst``); 0 — без ограничения.
+  Сообщения в один чат уходят по одному и по порядку;
+* ``RetryAfter``: сообщение возвращается в начало очереди своего чата и
+  уходит после названной Telegram паузы (не больше ``max_retries`` раз). Для
+  группы или канала пауза касается только этого чата, для личного чата — всех
+  отправок: это общий лимит бота.
+
+``send`` ждёт отправки и возвращает результат (ответ пользователю), ``submit``
+только ставит сообщение в очередь — ошибки пишутся в лог. Воркер запускается
+при первой отправке в текущем event loop.
+"""
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_REPLY = 0
+PRIORITY_CHANNEL = 1
+PRIORITY_ADMIN = 2
+PRIORITY_NAMES = {PRIORITY_REPLY: "reply", PRIORITY_CHANNEL: "channel", PRIORITY_ADMIN: "admin"}
+
+# Как часто (сек) забывать чаты без очереди, у которых лимит уже восстановился
+_SWEEP_INTERVAL = 60.0
+
+ChatId = Union[int, str]
+SendFactory = Callable[[], Awaitable[Any]]
+
+_MESSAGES = metrics.counter(
+    "bot_outbox_messages_total",
+    "Исходящие сообщения по итогу: sent, failed или cancelled (отправитель перестал ждать)",
+    ("priority", "outcome"),
+)
+_RETRIES = metrics.counter("bot_outbox_retry_after_total", "Ответы RetryAfter на исходящие сообщения", ("priority",))
+_LATENCY = metrics.histogram(
+    "bot_outbox_send_latency_seconds", "От постановки сообщения в очередь до его отправки", ("priority",)
+)
+
+
+def _seconds(value) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+def is_private(chat_id: ChatId) -> bool:
+    """Личный чат — положительный id; группы и каналы — отрицательный id или @username."""
+    try:
+        return int(chat_id) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+class _Bucket:
+    """Маркеры на отправку: ``rate`` в секунду, не больше ``burst`` подряд (rate <= 0 — без ограничения)."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет маркер."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "factory", "future", "enqueued", "attempts")
+
+    def __init__(self, priority: int, seq: int, factory: SendFactory, future: asyncio.Future, enqueued: float):
+        self.priority = priority
+        self.seq = seq
+        self.factory = factory
+        self.future = future
+        self.enqueued = enqueued
+        self.attempts = 0
+
+
+class _Chat:
+    __slots__ = ("key", "jobs", "bucket", "busy", "not_before")
+
+    def __init__(self, key: ChatId, bucket: _Bucket):
+        self.key = key
+        self.jobs: Deque[_Job] = deque()
+        self.bucket = bucket
+        self.busy = False
+        self.not_before = 0.0
+
+
+class _QueuedBot:
+    """``send_message`` через диспетчер — для кода, которому передают ``bot`` (сводка администратору)."""
+
+    def __init__(self, dispatcher: "OutboundDispatcher", bot, priority: int):
+        self._dispatcher = dispatcher
+        self._bot = bot
+        self._priority = priority
+
+    async def send_message(self, chat_id: ChatId, text: str, **kwargs):
+        factory = functools.partial(self._bot.send_message, chat_id=chat_id, text=text, **kwargs)
+        return await self._dispatcher.send(chat_id, factory, self._priority)
+
+
+class OutboundDispatcher:
+    """Диспетчер исходящих сообщений: приоритеты, лимиты на бота и на чат, повтор после RetryAfter."""
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        private_rate: float = 1.0,
+        private_burst: int = 3,
+        group_rate: float = 20 / 60,
+        group_burst: int = 3,
+        max_retries: int = 5,
+    ):
+        self.global_rate = global_rate
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+
+        self._global = _Bucket(global_rate, max(1.0, global_rate), time.monotonic())
+        self._paused_until = 0.0
+        self._chats: Dict[ChatId, _Chat] = {}
+        # Чаты, готовые к отправке: (приоритет, номер первого сообщения, чат)
+        self._ready: List[Tuple[int, int, ChatId]] = []
+        # Чаты, ждущие своего лимита или паузы: (когда, номер, чат)
+        self._waiting: List[Tuple[float, int, ChatId]] = []
+        self._seq = itertools.count()
+        self._depth: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+        self._in_flight = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+
+        metrics.gauge(
+            "bot_outbox_queue_depth", "Исходящие сообщения в очереди", lambda: {
+                (PRIORITY_NAMES[priority],): count for priority, count in self._depth.items()
+            }, ("priority",),
+        )
+        metrics.gauge("bot_outbox_in_flight", "Исходящие сообщения, отправляемые сейчас", lambda: self._in_flight)
+
+    @property
+    def depth(self) -> int:
+        """Сколько сообщений ждёт отправки."""
+        return sum(self._depth.values())
+
+    # ---------- Постановка в очередь ----------
+    async def send(self, chat_id: ChatId, factory: SendFactory, priority: int = PRIORITY_REPLY) -> Any:
+        """Ставит сообщение в очередь и ждёт отправки; ошибка отправки пробрасывается."""
+        return await self._enqueue(chat_id, factory, priority)
+
+    def submit(self, chat_id: ChatId, factory: SendFactory, priority: int) -> asyncio.Future:
+        """Ставит сообщение в очередь, не дожидаясь отправки; ошибка пишется в лог."""
+        future = self._enqueue(chat_id, factory, priority)
+        future.add_done_callback(functools.partial(self._log_failure, chat_id, priority))
+        return future
+
+    def queued_bot(self, bot, priority: int) -> _QueuedBot:
+        """Объект с ``send_message`` бота, отправляющий через очередь с приоритетом ``priority``."""
+        return _QueuedBot(self, bot, priority)
+
+    @staticmethod
+    def _log_failure(chat_id: ChatId, priority: int, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(
+                "Не удалось отправить сообщение (%s) в %s: %s", PRIORITY_NAMES[priority], chat_id, future.exception()
+            )
+
+    def _enqueue(self, chat_id: ChatId, factory: SendFactory, priority: int) -> asyncio.Future:
+        loop = self._ensure_worker()
+        now = time.monotonic()
+        future = loop.create_future()
+        job = _Job(priority, next(self._seq), factory, future, now)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(chat_id, self._bucket_for(chat_id, now))
+        chat.jobs.append(job)
+        self._depth[priority] += 1
+        self._idle.clear()  # type: ignore[union-attr]
+        if len(chat.jobs) == 1:
+            self._schedule(chat, now)
+        self._wakeup.set()  # type: ignore[union-attr]
+        return future
+
+    def _bucket_for(self, chat_id: ChatId, now: float) -> _Bucket:
+        if is_private(chat_id):
+            return _Bucket(self.private_rate, self.private_burst, now)
+        return _Bucket(self.group_rate, self.group_burst, now)
+
+    def _ensure_worker(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Новый event loop (например, следующий asyncio.run): очередь прежнего уже не отправить
+            self._reset()
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._idle.set()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run(), name="outbox")
+        return loop
+
+    def _reset(self) -> None:
+        dropped = self.depth
+        if dropped:
+            logger.warning("📤 Очередь исходящих сообщений сброшена, потеряно %s", dropped)
+        self._chats.clear()
+        self._ready.clear()
+        self._waiting.clear()
+        self._depth = {priority: 0 for priority in PRIORITY_NAMES}
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._task = None
+
+    # ---------- Отправка ----------
+    def _schedule(self, chat: _Chat, now: float) -> None:
+        """Ставит чат в готовые или в ожидающие — по его лимиту и паузе."""
+        if not chat.jobs or chat.busy:
+            return
+        ready_at = max(chat.not_before, now + chat.bucket.delay(now))
+        if ready_at <= now:
+            head = chat.jobs[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat.key))
+        else:
+            heapq.heappush(self._waiting, (ready_at, next(self._seq), chat.key))
+
+    def _peek_ready(self) -> Optional[_Chat]:
+        # Записи в куче не удаляются при изменениях чата — устаревшие пропускаем здесь
+        while self._ready:
+            _, seq, key = self._ready[0]
+            chat = self._chats.get(key)
+            if chat is not None and not chat.busy and chat.jobs and chat.jobs[0].seq == seq:
+                return chat
+            heapq.heappop(self._ready)
+        return None
+
+    async def _run(self) -> None:
+        wakeup = self._wakeup
+        last_sweep = time.monotonic()
+        while True:
+            wakeup.clear()  # type: ignore[union-attr]
+            now = time.monotonic()
+            if now - last_sweep >= _SWEEP_INTERVAL:
+                self._sweep(now)
+                last_sweep = now
+            while self._waiting and self._waiting[0][0] <= now:
+                _, _, key = heapq.heappop(self._waiting)
+                chat = self._chats.get(key)
+                if chat is not None:
+                    self._schedule(chat, now)
+
+            chat = self._peek_ready()
+            if chat is None:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+            else:
+                timeout = max(self._paused_until - now, self._global.delay(now))
+                if timeout <= 0:
+                    heapq.heappop(self._ready)
+                    self._dispatch(chat, now)
+                    continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)  # type: ignore[union-attr]
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, chat: _Chat, now: float) -> None:
+        job = chat.jobs.popleft()
+        self._depth[job.priority] -= 1
+        if job.future.done():
+            # Отправитель перестал ждать (обработчик отменён) — сообщение уже не нужно
+            _MESSAGES.inc(priority=PRIORITY_NAMES[job.priority], outcome="cancelled")
+            self._schedule(chat, now)
+            self._check_idle()
+            return
+        self._global.take(now)
+        chat.bucket.take(now)
+        chat.busy = True
+        self._in_flight += 1
+        self._loop.create_task(self._send(chat, job))  # type: ignore[union-attr]
+
+    async def _send(self, chat: _Chat, job: _Job) -> None:
+        name = PRIORITY_NAMES[job.priority]
+        try:
+            result = await job.factory()
+        except RetryAfter as e:
+            _RETRIES.inc(priority=name)
+            job.attempts += 1
+            if job.attempts > self.max_retries or job.future.done():
+                _MESSAGES.inc(priority=name, outcome="failed")
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                pause = _seconds(e.retry_after)
+                resume = time.monotonic() + pause
+                if is_private(chat.key):
+                    self._paused_until = max(self._paused_until, resume)
+                chat.not_before = max(chat.not_before, resume)
+                chat.jobs.appendleft(job)
+                self._depth[job.priority] += 1
+                logger.warning("⏳ RetryAfter %.0f с при отправке в %s — сообщение повторится", pause, chat.key)
+        except Exception as e:
+            _MESSAGES.inc(priority=name, outcome="failed")
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            _MESSAGES.inc(priority=name, outcome="sent")
+            _LATENCY.observe(time.monotonic() - job.enqueued, priority=name)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            if not job.future.done() and job not in chat.jobs:
+                job.future.cancel()
+            chat.busy = False
+            self._in_flight -= 1
+            self._schedule(chat, time.monotonic())
+            self._check_idle()
+            self._wakeup.set()  # type: ignore[union-attr]
+
+    def _check_idle(self) -> None:
+        if self.depth == 0 and self._in_flight == 0:
+            self._idle.set()  # type: ignore[union-attr]
+
+    def _sweep(self, now: float) -> None:
+        idle = [
+            key for key, chat in self._chats.items()
+            if not chat.jobs and not chat.busy and chat.not_before <= now and chat.bucket.full(now)
+        ]
+        for key in idle:
+            del self._chats[key]
+
+    # ---------- Остановка ----------
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт, пока очередь опустеет. False — не успела за ``timeout`` секунд."""
+        if self._idle is None or self._loop is not asyncio.get_running_loop():
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """Досылает очередь (не дольше ``timeout`` секунд) и останавливает воркер."""
+        if not await self.join(timeout):
+            logger.warning("📤 Очередь исходящих сообщений отправлена не до конца: осталось %s", self.depth)
+        task, self._task = self._task, None
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,212 @@
+# reconciliation.py
+"""Фоновая сверка статуса подписки для всего списка подписчиков.
+
+Статус «отписан» записывается, только когда пользователь сам пришёл в бота
+после отписки. Сверка проходит по всем записям со статусом «подписан»,
+проверяет каждого через ``get_chat_member`` и сохраняет отписавшихся:
+
+* проверки идут параллельно, но не больше ``concurrency`` одновременно и не
+  чаще ``rate`` в секунду — чтобы оставить лимит Bot API ответам
+  пользователям; на ``RetryAfter`` пауза общая для всех проверок;
+* записи обходятся по возрастанию ``user_id`` пачками по ``chunk_size``;
+  изменения пачки уходят в хранилище одним ``apply_many`` (для Google
+  Sheets — один ``batch_update``), после чего в файл контрольной точки
+  пишется последний проверенный ``user_id`` и счётчики. Прерванная сверка
+  (перезапуск, сбой) продолжается с этого места;
+* о каждом отписавшемся сообщается через ``on_unsubscribed`` — бот копит их
+  и отправляет администратору одной сводкой в конце сверки.
+
+Ошибки отдельных проверок пропускаются (запись остаётся как есть). Если в
+пачке не удалась ни одна проверка (бот не администратор канала, нет сети),
+сверка останавливается до следующего запуска.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from telegram.error import RetryAfter, TelegramError
+
+import google_sheets_async as gsa
+import metrics
+from membership_cache import SUBSCRIBED_STATUSES
+from subscribers import STATUS_SUBSCRIBED, op_mark_unsubscribed
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд после запуска продолжить прерванную (или ни разу не
+# выполненную) сверку
+RESUME_DELAY = 60.0
+# Сколько раз повторять проверку после RetryAfter
+_MAX_ATTEMPTS = 3
+
+
+def _seconds(value) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class _RateLimiter:
+    """Не чаще ``rate`` вызовов в секунду, равномерно и без всплесков."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float) -> None:
+        """Сдвигает все следующие вызовы (ответ Telegram RetryAfter)."""
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+def load_checkpoint(path: Path) -> Dict:
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning("Контрольная точка сверки %s не прочитана: %s", path, e)
+        return {}
+
+
+def save_checkpoint(path: Path, data: Dict) -> None:
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    tmp.replace(path)
+
+
+class SubscriptionReconciler:
+    """Сверка подписок с контрольной точкой в ``checkpoint_file``."""
+
+    def __init__(
+        self,
+        channel: str,
+        checkpoint_file: str,
+        concurrency: int = 5,
+        rate: float = 15.0,
+        chunk_size: int = 200,
+    ):
+        self.channel = channel
+        self.checkpoint = Path(checkpoint_file)
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.chunk_size = max(1, chunk_size)
+        self.running = False
+        # Прогресс текущей (или последней) сверки
+        self.total = 0
+        self.checked = 0
+        self.unsubscribed = 0
+        self.errors = 0
+
+        metrics.gauge("bot_reconcile_running", "Идёт ли сверка подписок", lambda: int(self.running))
+        metrics.gauge(
+            "bot_reconcile_progress", "Прогресс сверки подписок", lambda: {
+                ("total",): self.total,
+                ("checked",): self.checked,
+                ("unsubscribed",): self.unsubscribed,
+                ("errors",): self.errors,
+            }, ("state",),
+        )
+
+    def first_delay(self, interval: float) -> float:
+        """Через сколько секунд запускать сверку: прерванная продолжается сразу."""
+        state = load_checkpoint(self.checkpoint)
+        finished = state.get("finished_at")
+        if state.get("cursor") is not None or not finished:
+            return RESUME_DELAY
+        return max(RESUME_DELAY, float(finished) + interval - time.time())
+
+    async def _check(self, bot, user_id: int, slots: asyncio.Semaphore, limiter: _RateLimiter) -> Optional[bool]:
+        """Подписан ли пользователь; None — проверить не удалось."""
+        async with slots:
+            for _ in range(_MAX_ATTEMPTS):
+                await limiter.wait()
+                try:
+                    member = await bot.get_chat_member(chat_id=self.channel, user_id=user_id)
+                except RetryAfter as e:
+                    limiter.pause(_seconds(e.retry_after))
+                    continue
+                except TelegramError as e:
+                    logger.debug("Сверка: подписка %s не проверена: %s", user_id, e)
+                    return None
+                return member.status in SUBSCRIBED_STATUSES
+        return None
+
+    async def run(self, bot, on_unsubscribed: Callable[[Dict], None]) -> Optional[Dict]:
+        """Одна сверка (или её продолжение). Возвращает итоговое состояние
+        (``checked``, ``unsubscribed``, ``errors``) или None, если сверка уже идёт
+        или была остановлена."""
+        if self.running:
+            logger.info("🔄 Сверка подписок уже идёт — пропускаем запуск")
+            return None
+        self.running = True
+        try:
+            return await self._run(bot, on_unsubscribed)
+        finally:
+            self.running = False
+
+    async def _run(self, bot, on_unsubscribed: Callable[[Dict], None]) -> Optional[Dict]:
+        state = load_checkpoint(self.checkpoint)
+        cursor = state.get("cursor")
+        if cursor is None:
+            state = {"cursor": None, "checked": 0, "unsubscribed": 0, "errors": 0,
+                     "started_at": time.time(), "finished_at": state.get("finished_at")}
+        else:
+            logger.info("🔄 Сверка подписок продолжается после user_id %s", cursor)
+
+        records = await gsa.subscriber_records()
+        pending: List[int] = sorted(
+            uid for uid in (int(r["user_id"]) for r in records if r.get("status") == STATUS_SUBSCRIBED)
+            if cursor is None or uid > cursor
+        )
+        self.checked = state["checked"]
+        self.unsubscribed = state["unsubscribed"]
+        self.errors = state["errors"]
+        self.total = self.checked + len(pending)
+        logger.info("🔄 Сверка подписок: к проверке %s из %s", len(pending), self.total)
+
+        slots = asyncio.Semaphore(self.concurrency)
+        limiter = _RateLimiter(self.rate)
+        started = time.perf_counter()
+
+        for start in range(0, len(pending), self.chunk_size):
+            chunk = pending[start:start + self.chunk_size]
+            results = await asyncio.gather(*(self._check(bot, uid, slots, limiter) for uid in chunk))
+            failed = sum(1 for subscribed in results if subscribed is None)
+            if failed == len(chunk):
+                logger.error("❌ Сверка подписок остановлена: ни одна проверка в пачке не удалась")
+                return None
+
+            left = [uid for uid, subscribed in zip(chunk, results) if subscribed is False]
+            written = await gsa.apply_many({uid: [op_mark_unsubscribed] for uid in left}) if left else []
+            for record in written:
+                on_unsubscribed(record)
+
+            self.checked += len(chunk)
+            self.unsubscribed += len(written)
+            self.errors += failed
+            state.update(cursor=chunk[-1], checked=self.checked, unsubscribed=self.unsubscribed, errors=self.errors)
+            save_checkpoint(self.checkpoint, state)
+            logger.info(
+                "🔄 Сверка подписок: %s/%s, отписались %s, ошибок %s",
+                self.checked, self.total, self.unsubscribed, self.errors,
+            )
+
+        state.update(cursor=None, finished_at=time.time())
+        save_checkpoint(self.checkpoint, state)
+        logger.info(
+            "✅ Сверка подписок завершена за %.0f с: проверено %s, отписались %s, ошибок %s",
+            time.perf_counter() - started, self.checked, self.unsubscribed, self.errors,
+        )
+        return state
@@ -0,0 +1,110 @@
+# replay_updates.py
+"""Отправляет записанные обновления Telegram в локальный webhook-сервер.
+
+Бот запускается с ``BOT_MODE=webhook`` (``WEBHOOK_URL`` можно не задавать —
+тогда webhook в Telegram не регистрируется), после чего:
+
+    python replay_updates.py updates.json
+    python replay_updates.py updates.jsonl --concurrency 20 --repeat 10
+
+Файл — JSON-объект обновления, JSON-список обновлений или JSONL (по одному
+обновлению в строке), например ответ ``getUpdates`` (поле ``result``).
+При ``--repeat`` update_id у копий делаются уникальными.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+import config
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def load_updates(path: Path) -> List[Dict]:
+    text = path.read_text(encoding="utf-8").strip()
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        # JSONL
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict) and "result" in data:
+        data = data["result"]
+    return data if isinstance(data, list) else [data]
+
+
+async def replay(url: str, updates: List[Dict], secret: str, concurrency: int) -> None:
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers[SECRET_HEADER] = secret
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=30) as client:
+
+        async def post(update: Dict) -> None:
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, content=json.dumps(update), headers=headers)
+                    statuses[response.status_code] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(u) for u in updates))
+        elapsed = time.perf_counter() - started
+
+    print(f"Отправлено обновлений: {len(updates)} за {elapsed:.2f} с ({len(updates) / elapsed:.0f}/с)")
+    print("Ответы:", ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    if len(latencies) >= 2:
+        q = statistics.quantiles(latencies, n=100)
+        print(f"Задержка, мс: p50={q[49] * 1000:.1f} p95={q[94] * 1000:.1f} p99={q[98] * 1000:.1f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", type=Path, help="файлы с обновлениями (JSON или JSONL)")
+    parser.add_argument(
+        "--url",
+        default=f"http://127.0.0.1:{config.WEBHOOK_PORT}/{config.WEBHOOK_PATH.strip('/')}",
+        help="адрес webhook-сервера",
+    )
+    parser.add_argument("--secret", default=config.WEBHOOK_SECRET_TOKEN, help="секрет webhook")
+    parser.add_argument("--concurrency", type=int, default=1, help="одновременных запросов")
+    parser.add_argument("--repeat", type=int, default=1, help="сколько раз повторить набор")
+    args = parser.parse_args()
+
+    updates: List[Dict] = []
+    for path in args.files:
+        updates.extend(load_updates(path))
+    if not updates:
+        print("❌ В файлах нет обновлений")
+        return 1
+
+    replayed = []
+    next_id = max(int(u.get("update_id", 0)) for u in updates) + 1
+    for round_no in range(args.repeat):
+        for update in updates:
+            if round_no:
+                update = dict(update, update_id=next_id)
+                next_id += 1
+            replayed.append(update)
+
+    asyncio.run(replay(args.url, replayed, args.secret, max(1, args.concurrency)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
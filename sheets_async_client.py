@@ -0,0 +1,331 @@
+# sheets_async_client.py
+"""Асинхронный клиент Google Sheets API (значения листов) без gspread и пула потоков.
+
+gspread синхронный: каждый вызов из бота — это передача в поток
+(``google_sheets_async``) и запрос через сессию ``requests``. Этот клиент
+выполняет те же операции прямо в event loop:
+
+* ``get`` / ``batch_get`` / ``update`` / ``batch_update`` / ``append`` /
+  ``clear`` — методы ``spreadsheets.values``, которыми пользуется
+  ``google_sheets_service_account``;
+* все запросы идут через один ``httpx.AsyncClient`` с пулом keep-alive
+  соединений (``config.SHEETS_HTTP_POOL_SIZE``): TLS-рукопожатие платится один
+  раз на соединение, а не на запрос;
+* токен доступа сервисного аккаунта (тот же ``config.GOOGLE_CREDENTIALS_FILE``)
+  получается асинхронно: JWT подписывается локально и обменивается на токен
+  через тот же пул. Одновременные запросы с истёкшим токеном ждут одно
+  обновление;
+* квота, повторы при 429/5xx и метрики — общие с gspread
+  (``sheets_scheduler``), так что оба клиента делят одну квоту проекта;
+  ``append`` после таймаута или 5xx не повторяется — строки могли уже
+  дописаться.
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+from http import HTTPStatus
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+import httpx
+from google.auth import crypt, jwt
+
+import config
+import metrics
+from sheets_scheduler import PRIORITY_INTERACTIVE, QuotaScheduler, get_scheduler, is_idempotent
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+_JWT_GRANT = "urn:ietf:params:oauth:grant-type:jwt-bearer"
+_DEFAULT_TOKEN_URI = "https://oauth2.googleapis.com/token"
+# Значения пишутся как есть, без разбора формул и дат — как у gspread по умолчанию
+_VALUE_INPUT = "RAW"
+
+# Те же метрики, что у gspread-клиента (реестр вернёт уже созданные)
+_REQUESTS = metrics.counter(
+    "sheets_requests_total", "Запросы к Google Sheets API (с повторами — один запрос)", ("operation", "outcome")
+)
+_DURATION = metrics.histogram(
+    "sheets_request_duration_seconds", "Время запроса к Google Sheets API, включая ожидание квоты и повторы",
+    ("operation",),
+)
+_RETRIES = metrics.counter("sheets_retries_total", "Повторы запросов к Google Sheets API", ("reason",))
+
+
+class SheetsAPIError(Exception):
+    """Ответ Sheets API (или сервера токенов) с кодом ошибки."""
+
+    def __init__(self, code: int, message: str, domains: Sequence[str] = (), retry_after: float = 0.0):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+        self.domains = tuple(domains)
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_response(cls, response: httpx.Response) -> "SheetsAPIError":
+        message = response.text
+        domains: List[str] = []
+        try:
+            error = response.json().get("error") or {}
+            if isinstance(error, dict):
+                message = error.get("message") or message
+                domains = [e.get("domain", "") for e in error.get("errors") or [] if isinstance(e, dict)]
+            elif isinstance(error, str):
+                message = error
+        except (ValueError, AttributeError):
+            pass
+        try:
+            retry_after = float(response.headers.get("Retry-After", 0))
+        except ValueError:
+            retry_after = 0.0
+        return cls(response.status_code, message, domains, retry_after)
+
+    @property
+    def is_quota(self) -> bool:
+        """Ошибка квоты/лимита: 429 или 403 с доменом usageLimits."""
+        return self.code == HTTPStatus.TOO_MANY_REQUESTS or (
+            self.code == HTTPStatus.FORBIDDEN and "usageLimits" in self.domains
+        )
+
+
+def _is_retryable(exc: BaseException, idempotent: bool = True) -> bool:
+    if not idempotent:
+        # Запрос точно не применён: отказ по квоте или 401 (токен проверяется до записи)
+        return isinstance(exc, SheetsAPIError) and (exc.is_quota or exc.code == HTTPStatus.UNAUTHORIZED)
+    if isinstance(exc, SheetsAPIError):
+        return (
+            exc.is_quota
+            # Токен отозван или истёк раньше срока — будет получен заново
+            or exc.code == HTTPStatus.UNAUTHORIZED
+            or exc.code == HTTPStatus.REQUEST_TIMEOUT
+            or exc.code >= HTTPStatus.INTERNAL_SERVER_ERROR
+        )
+    return isinstance(exc, httpx.TransportError)
+
+
+def _outcome(exc: Optional[BaseException]) -> str:
+    """Метка исхода запроса — те же значения, что у ``sheets_scheduler``."""
+    if exc is None:
+        return "ok"
+    if isinstance(exc, SheetsAPIError):
+        return "quota" if exc.is_quota else f"http_{exc.code}"
+    return "network" if _is_retryable(exc) else "error"
+
+
+def sheet_range(title: str, cells: Optional[str] = None) -> str:
+    """Диапазон в нотации A1 с именем листа: ``'Лист 1'!A1:H2``."""
+    quoted = "'" + title.replace("'", "''") + "'"
+    return f"{quoted}!{cells}" if cells else quoted
+
+
+class ServiceAccountAuth:
+    """Токен доступа сервисного аккаунта с асинхронным обновлением."""
+
+    # Обновляем токен заранее, чтобы он не истёк посреди запроса
+    REFRESH_MARGIN = 300.0
+
+    def __init__(self, info: Dict[str, Any], scopes: Sequence[str] = SCOPES):
+        self.email = info["client_email"]
+        self.token_uri = info.get("token_uri") or _DEFAULT_TOKEN_URI
+        self.scopes = tuple(scopes)
+        self._signer = crypt.RSASigner.from_service_account_info(info)
+        self._token: Optional[str] = None
+        self._expires = 0.0
+        self._lock = asyncio.Lock()
+        self.refreshes = 0
+
+    @classmethod
+    def from_file(cls, path: str, scopes: Sequence[str] = SCOPES) -> "ServiceAccountAuth":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), scopes)
+
+    @property
+    def valid(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires - self.REFRESH_MARGIN
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """Забывает токен ``token`` (по умолчанию — текущий): следующий запрос получит новый.
+
+        Ответы 401 на запросы со старым токеном не сбрасывают уже полученный новый.
+        """
+        if token is None or token == self._token:
+            self._token = None
+
+    async def token(self, http: httpx.AsyncClient) -> str:
+        if self.valid:
+            return self._token  # type: ignore[return-value]
+        async with self._lock:
+            # Пока ждали блокировку, токен мог обновить другой запрос
+            if not self.valid:
+                await self._refresh(http)
+            return self._token  # type: ignore[return-value]
+
+    async def _refresh(self, http: httpx.AsyncClient) -> None:
+        now = int(time.time())
+        assertion = jwt.encode(self._signer, {
+            "iss": self.email,
+            "scope": " ".join(self.scopes),
+            "aud": self.token_uri,
+            "iat": now,
+            "exp": now + 3600,
+        })
+        response = await http.post(self.token_uri, data={"grant_type": _JWT_GRANT, "assertion": assertion})
+        if response.status_code != HTTPStatus.OK:
+            raise SheetsAPIError.from_response(response)
+        data = response.json()
+        self._token = data["access_token"]
+        self._expires = time.monotonic() + float(data.get("expires_in", 3600))
+        self.refreshes += 1
+        logger.debug("🔑 Токен Google обновлён для %s", self.email)
+
+
+class AsyncSheetsClient:
+    """Операции со значениями одной таблицы поверх общего пула соединений."""
+
+    def __init__(
+        self,
+        spreadsheet_id: str,
+        auth: ServiceAccountAuth,
+        base_url: str = config.SHEETS_API_URL,
+        pool_size: int = config.SHEETS_HTTP_POOL_SIZE,
+        timeout: float = 30.0,
+        scheduler: Optional[QuotaScheduler] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+    ):
+        self.spreadsheet_id = spreadsheet_id
+        self.auth = auth
+        self.scheduler = scheduler or get_scheduler()
+        self.priority = priority
+        self._values_url = f"{base_url.rstrip('/')}/spreadsheets/{quote(spreadsheet_id, safe='')}/values"
+        self._http = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=60.0,
+            ),
+        )
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    async def __aenter__(self) -> "AsyncSheetsClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    # ---------- Операции ----------
+    async def get(self, range_name: str) -> List[List[str]]:
+        """Значения диапазона (строки; пустые хвосты строк Sheets не возвращает)."""
+        data = await self._request("values.get", "GET", f"/{quote(range_name, safe='')}")
+        return data.get("values", [])
+
+    async def batch_get(self, ranges: Sequence[str]) -> List[List[List[str]]]:
+        """Значения нескольких диапазонов одним запросом, в порядке ``ranges``."""
+        params = [("ranges", r) for r in ranges]
+        data = await self._request("values.batchGet", "GET", ":batchGet", params=params)
+        return [vr.get("values", []) for vr in data.get("valueRanges", [])]
+
+    async def update(self, range_name: str, values: Sequence[Sequence[Any]]) -> Dict:
+        body = {"range": range_name, "majorDimension": "ROWS", "values": values}
+        return await self._request(
+            "values.update", "PUT", f"/{quote(range_name, safe='')}",
+            params=[("valueInputOption", _VALUE_INPUT)], body=body,
+        )
+
+    async def batch_update(self, data: Sequence[Dict]) -> Dict:
+        """Несколько диапазонов одним запросом: ``[{"range": ..., "values": [[...]]}, ...]``."""
+        body = {"valueInputOption": _VALUE_INPUT, "data": list(data)}
+        return await self._request("values.batchUpdate", "POST", ":batchUpdate", body=body)
+
+    async def append(self, range_name: str, values: Sequence[Sequence[Any]]) -> Dict:
+        """Дописывает строки после таблицы в ``range_name``; в ответе — ``updates.updatedRange``."""
+        return await self._request(
+            "values.append", "POST", f"/{quote(range_name, safe='')}:append",
+            params=[("valueInputOption", _VALUE_INPUT), ("insertDataOption", "INSERT_ROWS")],
+            body={"majorDimension": "ROWS", "values": values},
+        )
+
+    async def clear(self, range_name: str) -> Dict:
+        return await self._request("values.clear", "POST", f"/{quote(range_name, safe='')}:clear", body={})
+
+    # ---------- Запросы ----------
+    async def _acquire(self) -> None:
+        """Ждёт токен общей квоты, не блокируя event loop."""
+        started = time.monotonic()
+        while True:
+            delay = self.scheduler.try_acquire(self.priority)
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        if self.scheduler.rate > 0:
+            self.scheduler.record_wait(self.priority, time.monotonic() - started)
+
+    async def _send(
+        self, method: str, url: str, params: Optional[List[Tuple[str, str]]], body: Optional[Dict]
+    ) -> Dict:
+        token = await self.auth.token(self._http)
+        response = await self._http.request(
+            method, url, params=params, json=body, headers={"Authorization": f"Bearer {token}"}
+        )
+        if response.status_code == HTTPStatus.UNAUTHORIZED:
+            self.auth.invalidate(token)
+        if response.status_code >= 400:
+            raise SheetsAPIError.from_response(response)
+        return response.json() if response.content else {}
+
+    async def _request(
+        self,
+        operation: str,
+        method: str,
+        suffix: str,
+        params: Optional[List[Tuple[str, str]]] = None,
+        body: Optional[Dict] = None,
+    ) -> Dict:
+        """Запрос в рамках квоты с повторами при временных ошибках (как ``QuotaScheduler.execute``)."""
+        scheduler = self.scheduler
+        idempotent = is_idempotent(method, operation)
+        url = self._values_url + suffix
+        started = time.perf_counter()
+        error: Optional[BaseException] = None
+        attempt = 0
+        try:
+            while True:
+                await self._acquire()
+                scheduler.requests += 1
+                try:
+                    return await self._send(method, url, params, body)
+                except Exception as e:
+                    if not _is_retryable(e, idempotent) or attempt >= scheduler.max_retries:
+                        scheduler.failures += 1
+                        raise
+                    delay = random.uniform(0, min(scheduler.backoff_max, scheduler.backoff_base * 2 ** attempt))
+                    delay = max(delay, getattr(e, "retry_after", 0.0))
+                    attempt += 1
+                    scheduler.retries += 1
+                    _RETRIES.inc(reason=_outcome(e))
+                    logger.warning(
+                        f"⚠️ Временная ошибка Google Sheets ({e}), повтор {attempt}/{scheduler.max_retries} через {delay:.1f} с"
+                    )
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _DURATION.observe(time.perf_counter() - started, operation=operation)
+            _REQUESTS.inc(operation=operation, outcome=_outcome(error))
+
+
+def create_client(**kwargs: Any) -> AsyncSheetsClient:
+    """Клиент таблицы ``config.GOOGLE_SHEETS_ID`` с ключом ``config.GOOGLE_CREDENTIALS_FILE``.
+
+    Создавать внутри работающего event loop и закрывать (``aclose``) при остановке.
+    """
+    auth = ServiceAccountAuth.from_file(config.GOOGLE_CREDENTIALS_FILE)
+    return AsyncSheetsClient(config.GOOGLE_SHEETS_ID, auth, **kwargs)
@@ -0,0 +1,341 @@
+# sheets_scheduler.py
+"""Планировщик запросов к Google Sheets API с учётом квоты.
+
+Все HTTP-запросы gspread проходят через ``SchedulingHTTPClient`` и общий
+``QuotaScheduler``:
+
+* token bucket, настроенный на квоту проекта (``config.SHEETS_QUOTA_PER_MINUTE``),
+  не даёт упереться в 429;
+* запросы ждут токен в порядке приоритета: чтения для пользователей
+  (``PRIORITY_INTERACTIVE``) идут раньше фоновых записей (``PRIORITY_BACKGROUND``:
+  лог промокодов, зеркало SQLite);
+* на 429/408/5xx и сетевые сбои запрос повторяется с экспоненциальной
+  задержкой и jitter (с учётом ``Retry-After``, если он есть); неидемпотентные
+  операции (``values.append`` и структурные ``batchUpdate``) повторяются только
+  после ошибки квоты — таймаут не говорит, применил ли Google запрос;
+* ``stats()`` отдаёт глубину очереди и время ожидания; то же и счётчики по
+  операциям API публикуются в ``metrics``.
+
+Приоритет задаётся для текущего потока контекстным менеджером ``priority()``.
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import requests
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+_local = threading.local()
+
+_REQUESTS = metrics.counter(
+    "sheets_requests_total", "Запросы к Google Sheets API (с повторами — один запрос)", ("operation", "outcome")
+)
+_DURATION = metrics.histogram(
+    "sheets_request_duration_seconds", "Время запроса к Google Sheets API, включая ожидание квоты и повторы",
+    ("operation",),
+)
+_RETRIES = metrics.counter("sheets_retries_total", "Повторы запросов к Google Sheets API", ("reason",))
+_QUOTA_WAIT = metrics.histogram(
+    "sheets_quota_wait_seconds", "Ожидание токена квоты Google Sheets API", ("priority",),
+    buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """Задаёт приоритет запросов к Sheets, выполняемых в текущем потоке."""
+    previous = getattr(_local, "priority", PRIORITY_INTERACTIVE)
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_priority() -> int:
+    return getattr(_local, "priority", PRIORITY_INTERACTIVE)
+
+
+def is_quota_error(exc: BaseException) -> bool:
+    """Ошибка квоты/лимита: 429 или 403 с доменом usageLimits."""
+    if not isinstance(exc, APIError):
+        return False
+    if exc.code == HTTPStatus.TOO_MANY_REQUESTS:
+        return True
+    if exc.code == HTTPStatus.FORBIDDEN:
+        errors = exc.error.get("errors") or []
+        return any(e.get("domain") == "usageLimits" for e in errors if isinstance(e, dict))
+    return False
+
+
+def is_retryable(exc: BaseException, idempotent: bool = True) -> bool:
+    """Имеет ли смысл повторить запрос после этой ошибки.
+
+    Неидемпотентный запрос повторяется только после ошибки квоты: её Google
+    возвращает, не выполнив запрос. После таймаута или 5xx запрос мог быть
+    применён, и повтор дописал бы строки второй раз.
+    """
+    if not idempotent:
+        return is_quota_error(exc)
+    if isinstance(exc, APIError):
+        return (
+            is_quota_error(exc)
+            or exc.code == HTTPStatus.REQUEST_TIMEOUT
+            or exc.code >= HTTPStatus.INTERNAL_SERVER_ERROR
+        )
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+
+def _retry_after(exc: BaseException) -> float:
+    """Значение заголовка Retry-After в секундах (0, если его нет)."""
+    response = getattr(exc, "response", None)
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+class QuotaScheduler:
+    """Token bucket с приоритетной очередью ожидания и повторами с backoff."""
+
+    def __init__(
+        self,
+        per_minute: float,
+        burst: int,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+    ):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._tokens = float(self.capacity)
+        self._stamp = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        # Метрики
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.wait_total: Dict[int, float] = {}
+        self.wait_max: Dict[int, float] = {}
+        self.waits: Dict[int, int] = {}
+
+    @property
+    def depth(self) -> int:
+        """Сколько запросов сейчас ждут токен."""
+        return len(self._queue)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def acquire(self, level: int) -> float:
+        """Ждёт токен с приоритетом ``level``. Возвращает время ожидания в секундах."""
+        if self.rate <= 0:
+            return 0.0
+        ticket = (level, next(self._seq))
+        started = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            # Новый запрос мог оказаться важнее текущей головы очереди
+            self._cond.notify_all()
+            try:
+                while True:
+                    self._refill()
+                    if self._queue[0] == ticket:
+                        if self._tokens >= 1:
+                            heapq.heappop(self._queue)
+                            self._tokens -= 1
+                            break
+                        self._cond.wait((1 - self._tokens) / self.rate)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                raise
+            finally:
+                self._cond.notify_all()
+
+        waited = time.monotonic() - started
+        self.record_wait(level, waited)
+        return waited
+
+    def try_acquire(self, level: int) -> float:
+        """Берёт токен без ожидания, если впереди нет запросов с тем же или более высоким приоритетом.
+
+        Возвращает 0, если токен взят, иначе — через сколько секунд попробовать
+        снова. Нужен асинхронным клиентам: они не могут ждать на ``Condition``.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._cond:
+            self._refill()
+            if self._tokens >= 1 and not (self._queue and self._queue[0][0] <= level):
+                self._tokens -= 1
+                return 0.0
+            return max((1 - self._tokens) / self.rate, 0.01)
+
+    @property
+    def tokens(self) -> float:
+        """Свободные токены на текущий момент (с учётом пополнения после простоя)."""
+        with self._cond:
+            self._refill()
+            return self._tokens
+
+    def record_wait(self, level: int, waited: float) -> None:
+        """Учитывает ожидание токена в статистике и метриках."""
+        _QUOTA_WAIT.observe(waited, priority=_PRIORITY_NAMES.get(level, str(level)))
+        self.waits[level] = self.waits.get(level, 0) + 1
+        self.wait_total[level] = self.wait_total.get(level, 0.0) + waited
+        self.wait_max[level] = max(self.wait_max.get(level, 0.0), waited)
+        if waited > 1:
+            logger.info(f"⏳ Запрос к Google Sheets ждал квоту {waited:.1f} с (приоритет {level})")
+
+    def execute(self, fn: Callable[[], T], idempotent: bool = True) -> T:
+        """Выполняет запрос ``fn`` в рамках квоты, повторяя его при временных ошибках.
+
+        ``idempotent=False`` — повторять только после ошибки квоты (см. ``is_retryable``).
+        """
+        level = current_priority()
+        attempt = 0
+        while True:
+            self.acquire(level)
+            self.requests += 1
+            try:
+                return fn()
+            except Exception as e:
+                if not is_retryable(e, idempotent) or attempt >= self.max_retries:
+                    self.failures += 1
+                    raise
+                # Экспоненциальная задержка с полным jitter, но не меньше Retry-After
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                delay = max(delay, _retry_after(e))
+                attempt += 1
+                self.retries += 1
+                _RETRIES.inc(reason=_outcome(e))
+                logger.warning(
+                    f"⚠️ Временная ошибка Google Sheets ({e}), повтор {attempt}/{self.max_retries} через {delay:.1f} с"
+                )
+                time.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди, счётчики запросов/повторов и время ожидания по приоритетам."""
+        return {
+            "queue_depth": self.depth,
+            "tokens": round(self.tokens, 2),
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "wait": {
+                _PRIORITY_NAMES.get(level, str(level)): {
+                    "count": self.waits[level],
+                    "avg": self.wait_total[level] / self.waits[level],
+                    "max": self.wait_max[level],
+                }
+                for level in self.waits
+            },
+        }
+
+
+def _outcome(exc: Optional[BaseException]) -> str:
+    """Метка исхода запроса для метрик."""
+    if exc is None:
+        return "ok"
+    if is_quota_error(exc):
+        return "quota"
+    if isinstance(exc, APIError):
+        return f"http_{exc.code}"
+    return "network" if is_retryable(exc) else "error"
+
+
+_OPERATION_SUFFIXES = (":append", ":batchGet", ":batchUpdate", ":batchClear", ":clear")
+
+
+# Операции, которые можно безопасно повторить: чтения и запись значений в заданные диапазоны
+_IDEMPOTENT_OPERATIONS = frozenset({
+    "values.get", "values.update", "values.batchGet", "values.batchUpdate", "values.clear", "values.batchClear",
+})
+
+
+def is_idempotent(method: str, operation: str) -> bool:
+    """Можно ли повторить запрос, не рискуя применить его дважды."""
+    return method.upper() in ("GET", "HEAD", "PUT", "DELETE") or operation in _IDEMPOTENT_OPERATIONS
+
+
+def _operation(method: str, url: str) -> str:
+    """Имя операции Sheets API по методу и URL запроса (без ID таблицы и диапазонов)."""
+    path = url.split("?", 1)[0]
+    if "/values" in path:
+        tail = path.rsplit("/values", 1)[1]
+        for suffix in _OPERATION_SUFFIXES:
+            if tail.endswith(suffix):
+                return "values." + suffix[1:]
+        return {"GET": "values.get", "PUT": "values.update"}.get(method.upper(), f"values.{method.lower()}")
+    if path.endswith(":batchUpdate"):
+        return "batchUpdate"
+    if "drive" in path:
+        return "drive." + method.lower()
+    return "spreadsheets." + method.lower()
+
+
+_SCHEDULER = QuotaScheduler(
+    per_minute=config.SHEETS_QUOTA_PER_MINUTE,
+    burst=config.SHEETS_QUOTA_BURST,
+    max_retries=config.SHEETS_MAX_RETRIES,
+    backoff_base=config.SHEETS_BACKOFF_BASE,
+    backoff_max=config.SHEETS_BACKOFF_MAX,
+)
+
+
+def get_scheduler() -> QuotaScheduler:
+    """Возвращает общий для процесса планировщик запросов к Sheets."""
+    return _SCHEDULER
+
+
+class SchedulingHTTPClient(HTTPClient):
+    """HTTP-клиент gspread, пропускающий каждый запрос через ``QuotaScheduler``."""
+
+    def request(self, method: str, endpoint: str, *args: Any, **kwargs: Any) -> requests.Response:
+        operation = _operation(method, endpoint)
+        started = time.perf_counter()
+        error: Optional[BaseException] = None
+        try:
+            return _SCHEDULER.execute(
+                lambda: HTTPClient.request(self, method, endpoint, *args, **kwargs),
+                idempotent=is_idempotent(method, operation),
+            )
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _DURATION.observe(time.perf_counter() - started, operation=operation)
+            _REQUESTS.inc(operation=operation, outcome=_outcome(error))
+
+
+metrics.gauge("sheets_quota_queue_depth", "Запросы к Sheets API, ждущие токен квоты", lambda: _SCHEDULER.depth)
+metrics.gauge("sheets_quota_tokens", "Свободные токены квоты Sheets API", lambda: _SCHEDULER.tokens)
@@ -0,0 +1,107 @@
+# singleflight.py
+"""Объединение одновременных одинаковых запросов (single-flight).
+
+Когда несколько пользователей одновременно жмут «Проверка подписки», каждый
+обработчик запрашивает одно и то же: лист целиком, запись пользователя,
+статус в канале. Группа ``SingleFlight`` (для потоков) или
+``AsyncSingleFlight`` (для event loop) выполняет только первый вызов для
+ключа; остальные, пришедшие пока он идёт, ждут и получают тот же результат
+или то же исключение.
+
+Результат не кэшируется: после завершения вызова следующий запрос по ключу
+выполняется заново (кэши — отдельно, например ``MembershipCache``).
+Результат общий для всех ожидающих — изменять его нельзя.
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+import metrics
+
+T = TypeVar("T")
+
+_CALLS = metrics.counter(
+    "singleflight_calls_total",
+    "Вызовы через single-flight: выполнены (leader) или дождались чужого результата (shared)",
+    ("group", "role"),
+)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Single-flight для синхронного кода: один вызов на ключ среди всех потоков."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def do(self, key: Hashable, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            _CALLS.inc(group=self.name, role="shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        _CALLS.inc(group=self.name, role="leader")
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """Single-flight для корутин одного event loop.
+
+    Вызов выполняется отдельной задачей: отмена одного из ожидающих не
+    отменяет его для остальных.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[Hashable, "asyncio.Task[Any]"] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    def _finish(self, key: Hashable, task: "asyncio.Task[Any]") -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Ошибку получают ожидающие; если их не осталось — не пишем «never retrieved»
+            task.exception()
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        task = self._tasks.get(key)
+        if task is None:
+            _CALLS.inc(group=self.name, role="leader")
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            _CALLS.inc(group=self.name, role="shared")
+        return await asyncio.shield(task)
@@ -0,0 +1,286 @@
+# sqlite_storage.py
+"""Хранилище подписчиков в локальной SQLite (основное) с зеркалом в Google Sheets.
+
+Обработчики читают и пишут только локальную базу (WAL, ключ — user_id), так
+что квоты Google API больше не на критическом пути. Фоновый ``SheetsMirror``
+переносит изменённые записи и лог промокодов в таблицу, чтобы владелец
+по-прежнему видел данные в Google Sheets. Каждая запись хранит номер версии;
+зеркало помечает перенесённую версию и повторяет перенос после сбоев.
+"""
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import config
+from subscribers import (
+    COLUMNS,
+    SubscriberOp,
+    SubscriberStorage,
+    apply_ops,
+    now_str,
+    op_replace,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _gs():
+    """Модуль google_sheets_service_account (gspread грузится, только если нужна таблица)."""
+    import google_sheets_service_account as gs
+    return gs
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscribers (
+    user_id          INTEGER PRIMARY KEY,
+    username         TEXT NOT NULL DEFAULT '',
+    full_name        TEXT NOT NULL DEFAULT '',
+    joined_at        TEXT NOT NULL DEFAULT '',
+    promo_code       TEXT,
+    issued_by        TEXT,
+    status           TEXT NOT NULL DEFAULT '',
+    unsubscribed_at  TEXT NOT NULL DEFAULT '',
+    version          INTEGER NOT NULL DEFAULT 1,
+    mirrored_version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS subscribers_unmirrored
+    ON subscribers (user_id) WHERE version > mirrored_version;
+
+CREATE TABLE IF NOT EXISTS promo_log (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id    INTEGER NOT NULL,
+    promo_code TEXT NOT NULL,
+    timestamp  TEXT NOT NULL,
+    issued_by  TEXT NOT NULL DEFAULT '',
+    mirrored   INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS promo_log_unmirrored
+    ON promo_log (id) WHERE mirrored = 0;
+"""
+
+_SELECT = f"SELECT {', '.join(COLUMNS)} FROM subscribers"
+_UPSERT = (
+    f"INSERT INTO subscribers ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)}) "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    + ", ".join(f"{col} = excluded.{col}" for col in COLUMNS[1:])
+    + ", version = subscribers.version + 1"
+)
+
+
+def _record_from_row(row: Sequence) -> Dict:
+    record = dict(zip(COLUMNS, row))
+    # Пустые промокод и источник выдачи — None, как в записях с листа
+    for col in ("promo_code", "issued_by"):
+        if not record.get(col):
+            record[col] = None
+    return record
+
+
+def _row_from_record(record: Dict) -> Tuple:
+    values = []
+    for col in COLUMNS:
+        value = record.get(col)
+        if col == "user_id":
+            values.append(int(value))
+        elif col in ("promo_code", "issued_by"):
+            values.append(value or None)
+        else:
+            values.append("" if value is None else str(value))
+    return tuple(values)
+
+
+class SQLiteSubscriberStorage(SubscriberStorage):
+    """Подписчики и лог промокодов в SQLite; изменения зеркалируются в Google Sheets."""
+
+    name = "sqlite"
+
+    def __init__(self, db_file: str):
+        self.db_file = Path(db_file)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._mirror: Optional[SheetsMirror] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        """Соединение текущего потока (sqlite3 не разделяет соединения между потоками)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def start(self) -> None:
+        self._conn().executescript(_SCHEMA)
+        # Без зеркала база самостоятельна и к Google Sheets не обращается вовсе
+        if self.count() == 0 and config.SHEETS_MIRROR_INTERVAL > 0:
+            self.import_from_sheet()
+        if config.SHEETS_MIRROR_INTERVAL > 0:
+            self._mirror = SheetsMirror(self, config.SHEETS_MIRROR_INTERVAL)
+            self._mirror.start()
+        logger.info(f"🗄️ SQLite-хранилище готово: {self.db_file} ({self.count()} записей)")
+
+    def close(self) -> None:
+        if self._mirror is not None:
+            self._mirror.stop()
+            self._mirror = None
+            _gs().stop_promo_log_writer()
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM subscribers").fetchone()[0]
+
+    def import_from_sheet(self) -> int:
+        """Заполняет пустую базу записями с листа (первый запуск на SQLite).
+
+        Бросает ``RuntimeError``, если лист прочитать не удалось: пустая база
+        после такого сбоя выглядела бы как «нет подписчиков», и бот начал бы
+        заводить уже существующих пользователей заново.
+        """
+        gs = _gs()
+        try:
+            # Принудительная загрузка: ошибка не должна превратиться в пустой список
+            gs.refresh_subscriber_index()
+            records = list(gs.sheets_storage().records())
+        except Exception as e:
+            raise RuntimeError(f"❌ Не удалось импортировать подписчиков из Google Sheets: {e}") from e
+        conn = self._conn()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(_UPSERT, [_row_from_record(r) for r in records])
+                # Записи уже есть на листе — зеркалировать их не нужно
+                conn.execute("UPDATE subscribers SET mirrored_version = version")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        logger.info(f"📥 Импортировано подписчиков из Google Sheets: {len(records)}")
+        return len(records)
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        row = self._conn().execute(f"{_SELECT} WHERE user_id = ?", (int(user_id),)).fetchone()
+        return _record_from_row(row) if row is not None else None
+
+    def apply(self, user_id: int, ops: Sequence[SubscriberOp]) -> Optional[Dict]:
+        return next(iter(self.apply_many({user_id: ops})), None)
+
+    def apply_many(self, changes: Mapping[int, Sequence[SubscriberOp]]) -> List[Dict]:
+        """Все изменения — одной транзакцией (один fsync на пачку)."""
+        conn = self._conn()
+        written: List[Dict] = []
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, ops in changes.items():
+                    row = conn.execute(f"{_SELECT} WHERE user_id = ?", (int(user_id),)).fetchone()
+                    current = _record_from_row(row) if row is not None else None
+                    record = apply_ops(current, ops, now_str())
+                    if record is not None:
+                        record = _record_from_row(_row_from_record(record))
+                    if record is None or record == current:
+                        continue
+                    conn.execute(_UPSERT, _row_from_record(record))
+                    written.append(record)
+                conn.execute("COMMIT" if written else "ROLLBACK")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return written
+
+    def log_promo(self, user_id: int, promo: str, timestamp: str, source: Optional[str]) -> None:
+        self._conn().execute(
+            "INSERT INTO promo_log (user_id, promo_code, timestamp, issued_by) VALUES (?, ?, ?, ?)",
+            (int(user_id), str(promo), str(timestamp), str(source or "")),
+        )
+
+    def records(self) -> Iterable[Dict]:
+        return [_record_from_row(row) for row in self._conn().execute(_SELECT)]
+
+    # ---------- Для зеркала ----------
+    def unmirrored(self, limit: int) -> List[Tuple[Dict, int]]:
+        rows = self._conn().execute(
+            f"SELECT {', '.join(COLUMNS)}, version FROM subscribers "
+            "WHERE version > mirrored_version LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [(_record_from_row(row[:-1]), row[-1]) for row in rows]
+
+    def mark_mirrored(self, user_id: int, version: int) -> None:
+        self._conn().execute(
+            "UPDATE subscribers SET mirrored_version = ? WHERE user_id = ? AND mirrored_version < ?",
+            (version, int(user_id), version),
+        )
+
+    def unmirrored_promo_log(self, limit: int) -> List[Tuple[int, List[str]]]:
+        rows = self._conn().execute(
+            "SELECT id, user_id, promo_code, timestamp, issued_by FROM promo_log "
+            "WHERE mirrored = 0 ORDER BY id LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [(row[0], [str(v) for v in row[1:]]) for row in rows]
+
+    def mark_promo_log_mirrored(self, ids: List[int]) -> None:
+        self._conn().executemany("UPDATE promo_log SET mirrored = 1 WHERE id = ?", [(i,) for i in ids])
+
+
+class SheetsMirror:
+    """Фоновый перенос изменений из SQLite в Google Sheets."""
+
+    BATCH = 500
+
+    def __init__(self, storage: SQLiteSubscriberStorage, interval: float):
+        self.storage = storage
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._loop, name="sheets-mirror", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Останавливает поток и делает последний перенос."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        try:
+            self.sync_once()
+        except Exception as e:
+            logger.warning(f"⚠️ Последняя синхронизация с Google Sheets не удалась: {e}")
+
+    def _loop(self) -> None:
+        from sheets_scheduler import PRIORITY_BACKGROUND, priority
+
+        while not self._stopping.wait(self.interval):
+            try:
+                with priority(PRIORITY_BACKGROUND):
+                    self.sync_once()
+            except Exception as e:
+                logger.warning(f"⚠️ Синхронизация с Google Sheets не удалась, повторю позже: {e}")
+
+    def sync_once(self) -> int:
+        """Переносит изменённые записи и новые строки лога. Возвращает число перенесённых."""
+        sheets = _gs().sheets_storage()
+        moved = 0
+        pending = self.storage.unmirrored(self.BATCH)
+        if pending:
+            # Вся пачка — одним batch_update вместо запроса на каждую запись
+            sheets.apply_many({record["user_id"]: [op_replace(record)] for record, _ in pending})
+            for record, version in pending:
+                self.storage.mark_mirrored(record["user_id"], version)
+            moved += len(pending)
+
+        entries = self.storage.unmirrored_promo_log(self.BATCH)
+        for _, row in entries:
+            # Буферизованный писатель со спулом — строка не потеряется и после падения
+            sheets.log_promo(int(row[0]), row[1], row[2], row[3])
+        self.storage.mark_promo_log_mirrored([entry_id for entry_id, _ in entries])
+        moved += len(entries)
+
+        if moved:
+            logger.info(f"🪞 Перенесено в Google Sheets: {moved}")
+        return moved
@@ -0,0 +1,399 @@
+# subscribers.py
+"""Хранилище подписчиков: общий интерфейс и логика изменения записей.
+
+Запись подписчика — словарь с колонками ``COLUMNS`` (в резидентных индексах
+хранится компактно, в ``SubscriberRecord``). Изменения описываются
+чистыми функциями (операциями), которые хранилище применяет к актуальной
+записи атомарно: так одна и та же логика upsert/отписки работает поверх
+Google Sheets (``google_sheets_service_account.SheetsSubscriberStorage``)
+и SQLite (``sqlite_storage.SQLiteSubscriberStorage``).
+
+Какое хранилище основное, задаёт ``config.STORAGE_BACKEND``; обработчики
+получают его через ``get_storage()``.
+"""
+import logging
+import sys
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    "user_id",
+    "username",
+    "full_name",
+    "joined_at",
+    "promo_code",
+    "issued_by",
+    "status",
+    "unsubscribed_at",
+]
+
+STATUS_SUBSCRIBED = "подписан"
+STATUS_UNSUBSCRIBED = "отписан"
+
+
+def parse_user_id(value) -> Optional[int]:
+    """Разбирает user_id из ячейки ('123', '123.0'); None для пустых и нечисловых значений."""
+    text = str(value).strip()
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            number = float(text)
+        except ValueError:
+            return None
+        return int(number) if number.is_integer() else None
+
+
+class SubscriberRecord:
+    """Компактная запись подписчика для резидентных индексов.
+
+    Колонки ``COLUMNS`` лежат в слотах (без ``__dict__`` на каждый объект),
+    прочие колонки листа — в ``extra`` (None, если их нет). Значения колонок с
+    малым числом вариантов (промокод, источник, статус) интернируются — все
+    записи ссылаются на одну строку "подписан". Наружу хранилища по-прежнему
+    отдают словари: ``to_dict()``.
+    """
+
+    __slots__ = tuple(COLUMNS) + ("extra",)
+
+    def __init__(self, user_id: int, **values):
+        self.user_id = user_id
+        for col in COLUMNS[1:]:
+            setattr(self, col, values.pop(col, ""))
+        self.extra: Optional[Dict] = values or None
+
+    @classmethod
+    def parser(cls, header: Sequence[str]) -> Callable[[Sequence[str]], Optional["SubscriberRecord"]]:
+        """Разборщик строк листа с заголовком ``header``.
+
+        Позиции колонок вычисляются один раз на весь лист; разборщик возвращает
+        None для строк без user_id.
+        """
+        width = len(header)
+        # Колонка, которой нет в заголовке, читается из добавленной в конец пустой ячейки
+        positions = [header.index(col) if col in header else width for col in COLUMNS]
+        extra_positions = [(i, col) for i, col in enumerate(header) if col not in COLUMNS]
+        min_len = max(positions + [i for i, _ in extra_positions]) + 1
+        pick = itemgetter(*positions)
+        intern = sys.intern
+
+        def parse(values: Sequence[str]) -> Optional["SubscriberRecord"]:
+            if len(values) < min_len:
+                values = list(values) + [""] * (min_len - len(values))
+            user_id, username, full_name, joined_at, promo_code, issued_by, status, unsubscribed_at = pick(values)
+            user_id = parse_user_id(user_id)
+            if user_id is None:
+                return None
+            record = cls.__new__(cls)
+            record.user_id = user_id
+            record.username = username
+            record.full_name = full_name
+            record.joined_at = joined_at
+            # Пустые промокод и источник выдачи нормализуем в None — как в DataFrame
+            record.promo_code = intern(promo_code) if promo_code.strip() else None
+            record.issued_by = intern(issued_by) if issued_by.strip() else None
+            record.status = intern(status) if status else status
+            record.unsubscribed_at = unsubscribed_at
+            record.extra = {col: values[i] for i, col in extra_positions} if extra_positions else None
+            return record
+
+        return parse
+
+    @classmethod
+    def from_dict(cls, record: Dict) -> "SubscriberRecord":
+        values = dict(record)
+        return cls(int(values.pop("user_id")), **values)
+
+    def get(self, col: str, default=None):
+        if col in self.__slots__:
+            return getattr(self, col)
+        return (self.extra or {}).get(col, default)
+
+    def to_dict(self) -> Dict:
+        record = {col: getattr(self, col) for col in COLUMNS}
+        if self.extra:
+            record.update(self.extra)
+        return record
+
+
+def now_str() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Изменение записи: (запись | None, время) → (новая запись | None, результат).
+# SubscriberContext применяет операции сразу к своему снимку и повторно — к
+# актуальной записи при commit().
+SubscriberOp = Callable[[Optional[Dict], str], Tuple[Optional[Dict], bool]]
+
+
+def op_upsert(
+    user_id: int,
+    username: Optional[str],
+    full_name: Optional[str],
+    promo_code: str,
+    issued_by: Optional[str],
+) -> SubscriberOp:
+    """Upsert подписчика с выдачей промокода. Результат — True, если запись новая."""
+    def op(existing: Optional[Dict], now: str) -> Tuple[Optional[Dict], bool]:
+        if existing is None:
+            # Новая запись
+            return {
+                "user_id": user_id,
+                "username": username or "",
+                "full_name": full_name or "",
+                "joined_at": now,
+                "promo_code": promo_code,
+                "issued_by": issued_by or "",
+                "status": STATUS_SUBSCRIBED,
+                "unsubscribed_at": "",
+            }, True
+
+        # Обновление существующей записи
+        record = dict(existing)
+        if not record.get("username"):
+            record["username"] = username or ""
+        if not record.get("full_name"):
+            record["full_name"] = full_name or ""
+        if not record.get("promo_code"):
+            record["promo_code"] = promo_code
+        # Обновляем поле issued_by если передан источник выдачи
+        if issued_by is not None and not record.get("issued_by"):
+            record["issued_by"] = issued_by
+        record["status"] = STATUS_SUBSCRIBED
+        if not record.get("joined_at"):
+            record["joined_at"] = now
+        record["unsubscribed_at"] = ""
+        return record, False
+
+    return op
+
+
+def op_mark_unsubscribed(existing: Optional[Dict], now: str) -> Tuple[Optional[Dict], bool]:
+    """Отписка существующей записи. Результат — True, если статус изменился."""
+    if existing is None or existing.get("status") == STATUS_UNSUBSCRIBED:
+        return existing, False
+    record = dict(existing)
+    record["status"] = STATUS_UNSUBSCRIBED
+    record["unsubscribed_at"] = now
+    return record, True
+
+
+def op_mark_subscribed(existing: Optional[Dict], now: str) -> Tuple[Optional[Dict], bool]:
+    """Статус 'подписан' для существующей записи. Результат — True, если статус изменился."""
+    if existing is None or existing.get("status") == STATUS_SUBSCRIBED:
+        return existing, False
+    record = dict(existing)
+    record["status"] = STATUS_SUBSCRIBED
+    return record, True
+
+
+def op_replace(record: Dict) -> SubscriberOp:
+    """Заменяет значения записи значениями ``record`` (зеркалирование между хранилищами).
+
+    Колонки, которых нет в ``record``, сохраняются как были.
+    """
+    def op(existing: Optional[Dict], now: str) -> Tuple[Optional[Dict], bool]:
+        merged = dict(existing or {})
+        merged.update(record)
+        return merged, merged != existing
+
+    return op
+
+
+def apply_ops(record: Optional[Dict], ops: Sequence[SubscriberOp], now: str) -> Optional[Dict]:
+    for op in ops:
+        record, _ = op(record, now)
+    return record
+
+
+class SubscriberStorage(ABC):
+    """Интерфейс хранилища подписчиков и лога выдачи промокодов."""
+
+    name = "base"
+
+    def start(self) -> None:
+        """Готовит хранилище к работе (загрузка, фоновые задачи)."""
+
+    def close(self) -> None:
+        """Останавливает фоновые задачи и досылает накопленное."""
+
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[Dict]:
+        """Возвращает запись пользователя или None."""
+
+    @abstractmethod
+    def apply(self, user_id: int, ops: Sequence[SubscriberOp]) -> Optional[Dict]:
+        """Атомарно применяет ``ops`` к актуальной записи и сохраняет результат.
+
+        Возвращает записанную запись или None, если сохранять было нечего.
+        """
+
+    def apply_many(self, changes: Mapping[int, Sequence[SubscriberOp]]) -> List[Dict]:
+        """Применяет операции к нескольким пользователям (массовые сверки, зеркало).
+
+        Хранилища переопределяют метод, чтобы записать всё одной операцией;
+        по умолчанию — ``apply`` для каждого пользователя. Возвращает
+        записанные записи (без тех, где сохранять было нечего).
+        """
+        written = []
+        for user_id, ops in changes.items():
+            record = self.apply(user_id, ops)
+            if record is not None:
+                written.append(record)
+        return written
+
+    @abstractmethod
+    def log_promo(self, user_id: int, promo: str, timestamp: str, source: Optional[str]) -> None:
+        """Записывает факт выдачи промокода."""
+
+    @abstractmethod
+    def records(self) -> Iterable[Dict]:
+        """Все записи подписчиков (для выгрузки и сверок)."""
+
+    # ---------- Операции поверх apply() ----------
+    def load(self, user_id: int) -> "SubscriberContext":
+        """Загружает запись пользователя для обработки одного апдейта."""
+        return SubscriberContext(self, user_id, self.get(user_id))
+
+    def save_subscriber(
+        self,
+        user_id: int,
+        username: Optional[str],
+        full_name: Optional[str],
+        promo_code: str,
+        issued_by: Optional[str] = None,
+    ) -> bool:
+        """Upsert подписчика. Возвращает True, если это новая запись."""
+        ctx = self.load(user_id)
+        created = ctx.upsert(username, full_name, promo_code, issued_by)
+        ctx.commit()
+        return created
+
+    def mark_unsubscribed(self, user_id: int) -> bool:
+        """Отмечает отписку. Возвращает True, если статус изменился."""
+        ctx = self.load(user_id)
+        if not ctx.mark_unsubscribed():
+            return False
+        ctx.commit()
+        return True
+
+    def mark_subscribed_if_exists(self, user_id: int) -> bool:
+        """Возвращает существующей записи статус 'подписан'. True, если статус изменился."""
+        ctx = self.load(user_id)
+        if not ctx.mark_subscribed():
+            return False
+        ctx.commit()
+        return True
+
+
+class SubscriberContext:
+    """Запись подписчика в рамках обработки одного апдейта.
+
+    Загружается один раз (``SubscriberStorage.load``), передаётся во все
+    помощники обработчика и копит изменения; ``commit()`` сохраняет их одной
+    операцией хранилища. Чтения (``exists``, ``status``, ``promo()``) видят уже
+    накопленные изменения.
+    """
+
+    def __init__(self, storage: SubscriberStorage, user_id: int, record: Optional[Dict]):
+        self.storage = storage
+        self.user_id = int(user_id)
+        self._snapshot: Optional[Dict] = dict(record) if record is not None else None
+        self._ops: List[SubscriberOp] = []
+
+    @property
+    def exists(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def record(self) -> Optional[Dict]:
+        return dict(self._snapshot) if self._snapshot is not None else None
+
+    @property
+    def status(self) -> Optional[str]:
+        return self._snapshot.get("status") if self._snapshot is not None else None
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._ops)
+
+    def promo(self) -> Tuple[bool, Optional[str]]:
+        """(есть ли промокод, промокод) — как ``user_has_promo``."""
+        promo = (self._snapshot or {}).get("promo_code") or None
+        return bool(promo), promo
+
+    def _apply(self, op: SubscriberOp) -> bool:
+        self._snapshot, result = op(self._snapshot, now_str())
+        self._ops.append(op)
+        return result
+
+    def upsert(
+        self,
+        username: Optional[str],
+        full_name: Optional[str],
+        promo_code: str,
+        issued_by: Optional[str] = None,
+    ) -> bool:
+        """Upsert как в ``save_subscriber_to_sheet``. Возвращает True, если запись новая."""
+        return self._apply(op_upsert(self.user_id, username, full_name, promo_code, issued_by))
+
+    def mark_unsubscribed(self) -> bool:
+        """Отмечает отписку. Возвращает True, если статус изменился."""
+        return self._apply(op_mark_unsubscribed)
+
+    def mark_subscribed(self) -> bool:
+        """Возвращает статус 'подписан' существующей записи. True, если статус изменился."""
+        return self._apply(op_mark_subscribed)
+
+    def commit(self) -> bool:
+        """Сохраняет накопленные изменения одной операцией. True, если что-то записано.
+
+        Изменения применяются заново к актуальной записи хранилища — на случай,
+        если её успели изменить после загрузки.
+        """
+        if not self._ops:
+            return False
+        ops, self._ops = self._ops, []
+        record = self.storage.apply(self.user_id, ops)
+        if record is None:
+            return False
+        self._snapshot = dict(record)
+        logger.info(f"💾 Запись пользователя {self.user_id} сохранена ({self.storage.name})")
+        return True
+
+
+_STORAGE: Optional[SubscriberStorage] = None
+_STORAGE_LOCK = threading.Lock()
+
+
+def get_storage() -> SubscriberStorage:
+    """Возвращает основное хранилище, выбранное в ``config.STORAGE_BACKEND``."""
+    global _STORAGE
+    if _STORAGE is None:
+        with _STORAGE_LOCK:
+            if _STORAGE is None:
+                backend = config.STORAGE_BACKEND.lower()
+                if backend == "sqlite":
+                    from sqlite_storage import SQLiteSubscriberStorage
+                    _STORAGE = SQLiteSubscriberStorage(config.SQLITE_DB_FILE)
+                elif backend == "sheets":
+                    import google_sheets_service_account as gs
+                    _STORAGE = gs.sheets_storage()
+                else:
+                    raise RuntimeError(f"❌ Неизвестное хранилище STORAGE_BACKEND={config.STORAGE_BACKEND!r}")
+                logger.info(f"🗄️ Хранилище подписчиков: {_STORAGE.name}")
+    return _STORAGE
+
+
+def set_storage(storage: Optional[SubscriberStorage]) -> None:
+    """Подменяет основное хранилище (None — снова выбрать по конфигурации)."""
+    global _STORAGE
+    with _STORAGE_LOCK:
+        _STORAGE = storage
@@ -11,6 +11,8 @@ TEST_PROMO = "TEST-LOG-001"
 print("Запускается тест log_promo_issue()...")
 try:
     gs.log_promo_issue(TEST_USER_ID, TEST_PROMO)
+    # Запись буферизуется — отправляем её на лист сразу
+    gs.flush_promo_log()
     print("✅ Вызов log_promo_issue завершён (проверьте Google Sheets на наличие листа 'promo_log').")
 except Exception as e:
     print(f"❌ Исключение при вызове log_promo_issue: {e}")
@@ -0,0 +1,110 @@
+# update_processor.py
+"""Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+
+Без параллелизма один медленный запрос к Google Sheets задерживает всех, кто
+стоит в очереди за ним. Простое ``concurrent_updates(N)`` ускоряет обработку,
+но позволяет двум обновлениям одного пользователя (двойное нажатие «Хочу код!»)
+выполняться одновременно. ``PerUserUpdateProcessor`` разделяет эти задачи:
+
+* обновления одного пользователя выполняются строго по очереди, в порядке
+  поступления (отдельный ``asyncio.Lock`` на пользователя, FIFO);
+* обновления разных пользователей выполняются параллельно, но не больше
+  ``max_concurrent_updates`` одновременно. Слот берётся уже после блокировки
+  пользователя, поэтому очередь одного пользователя не занимает чужие слоты.
+
+Запись в хранилище атомарна сама по себе (``SubscriberStorage.apply``), а
+порядок по пользователю гарантирует, что проверка «есть ли промокод» и его
+выдача не пересекаются с другим обновлением того же пользователя.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Базовый класс берёт свой семафор ещё до do_process_update; лимит
+# параллелизма здесь свой, а базовому задаём заведомо недостижимый
+_UNBOUNDED = 1_000_000
+
+UPDATE_WAIT = metrics.histogram(
+    "bot_update_wait_seconds", "Ожидание обновления до начала обработки (очередь пользователя и слоты)"
+)
+
+
+def _ordering_key(update: object) -> Optional[int]:
+    """Пользователь (или чат), чьи обновления должны идти по порядку."""
+    if not isinstance(update, Update):
+        return None
+    if update.chat_member is not None:
+        # Вступление/выход из канала упорядочиваем по участнику, а не по
+        # администратору, который его добавил или удалил
+        return update.chat_member.new_chat_member.user.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельно для разных пользователей, последовательно — для одного."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(_UNBOUNDED)
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должен быть положительным")
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # Пользователь → [блокировка, сколько его обновлений ждёт или выполняется]
+        self._users: Dict[int, List[Any]] = {}
+        self.pending = 0
+        self.running = 0
+
+        metrics.gauge("bot_updates_pending", "Принятые обновления, ещё не обработанные", lambda: self.pending)
+        metrics.gauge("bot_updates_running", "Обновления, обрабатываемые прямо сейчас", lambda: self.running)
+        metrics.gauge("bot_update_users_active", "Пользователи с обновлениями в обработке", lambda: len(self._users))
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def _run(self, coroutine: Awaitable[Any], accepted: float) -> None:
+        async with self._slots:
+            UPDATE_WAIT.observe(time.perf_counter() - accepted)
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        accepted = time.perf_counter()
+        key = _ordering_key(update)
+        self.pending += 1
+        try:
+            if key is None:
+                await self._run(coroutine, accepted)
+                return
+            entry = self._users.get(key)
+            if entry is None:
+                entry = self._users[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            try:
+                # Задачи стартуют в порядке поступления обновлений, а ожидающие
+                # asyncio.Lock получают его по очереди — порядок пользователя сохраняется
+                async with entry[0]:
+                    await self._run(coroutine, accepted)
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._users[key]
+        finally:
+            self.pending -= 1
@@ -0,0 +1,241 @@
+# webhook_server.py
+"""Приём обновлений через webhook вместо run_polling.
+
+Встроенный HTTP-сервер (tornado, ставится с ``python-telegram-bot[webhooks]``)
+принимает POST от Telegram и кладёт обновления в ``Application.update_queue``:
+
+* TLS завершается выше (nginx, балансировщик) — сервер слушает обычный HTTP;
+* запросы без правильного ``X-Telegram-Bot-Api-Secret-Token`` отклоняются;
+  без секрета сервер не запускается — иначе любой, кто достучится до порта,
+  мог бы присылать поддельные обновления;
+* очередь приёма ограничена (вместе с обновлениями, уже принятыми
+  ``PerUserUpdateProcessor``): когда она заполнена, сервер отвечает 503, и
+  Telegram повторит доставку позже (или на другую реплику за балансировщиком);
+* ``GET /healthz`` — проверка живости для балансировщика;
+* при остановке (SIGINT/SIGTERM) сервер перестаёт принимать обновления,
+  а ``Application.stop()`` дорабатывает всё, что уже в очереди и в обработке.
+
+Webhook регистрируется в Telegram только если задан ``WEBHOOK_URL``: для
+локальной проверки (``replay_updates.py``) и для реплик, где адрес уже
+зарегистрирован, его можно не задавать.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from http import HTTPStatus
+from typing import Optional, Sequence
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class _ServerState:
+    """Общее состояние обработчиков: приложение, настройки и счётчики."""
+
+    def __init__(self, app: Application, secret_token: str):
+        self.app = app
+        self.secret_token = secret_token
+        self.draining = False
+        # Метрики
+        self.accepted = 0
+        self.rejected_full = 0
+        self.rejected_auth = 0
+        self.bad_requests = 0
+
+    def backlog(self) -> int:
+        """Обновления в очереди приёма и уже принятые обработчиком, но не обработанные.
+
+        При параллельной обработке Application сразу забирает обновления из
+        очереди в задачи, поэтому одной длины очереди для ограничения мало.
+        """
+        return self.app.update_queue.qsize() + getattr(self.app.update_processor, "pending", 0)
+
+    def is_full(self) -> bool:
+        limit = self.app.update_queue.maxsize
+        return limit > 0 and self.backlog() >= limit
+
+
+class _UpdateHandler(tornado.web.RequestHandler):
+    """POST от Telegram: проверка секрета, разбор и постановка в очередь приёма."""
+
+    SUPPORTED_METHODS = ("POST",)  # type: ignore[assignment]
+
+    def initialize(self, state: _ServerState) -> None:
+        self.state = state
+
+    def _reply(self, status: HTTPStatus, **headers: str) -> None:
+        self.set_status(status)
+        for name, value in headers.items():
+            self.set_header(name, value)
+        self.finish()
+
+    async def post(self) -> None:
+        state = self.state
+        if state.draining:
+            # Реплика останавливается — пусть Telegram доставит обновление повторно
+            self._reply(HTTPStatus.SERVICE_UNAVAILABLE, **{"Retry-After": "1"})
+            return
+
+        token = self.request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), state.secret_token.encode()):
+            state.rejected_auth += 1
+            self._reply(HTTPStatus.FORBIDDEN)
+            return
+
+        try:
+            data = json.loads(self.request.body)
+            update = Update.de_json(data, state.app.bot)
+        except Exception as e:
+            state.bad_requests += 1
+            logger.warning("Некорректное обновление в webhook: %s", e)
+            self._reply(HTTPStatus.BAD_REQUEST)
+            return
+
+        try:
+            if state.is_full():
+                raise asyncio.QueueFull
+            state.app.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            state.rejected_full += 1
+            logger.warning(
+                "⚠️ Очередь приёма обновлений заполнена (%s), update %s отклонён",
+                state.backlog(),
+                update.update_id,
+            )
+            self._reply(HTTPStatus.SERVICE_UNAVAILABLE, **{"Retry-After": "1"})
+            return
+
+        state.accepted += 1
+        self._reply(HTTPStatus.OK)
+
+
+class _HealthHandler(tornado.web.RequestHandler):
+    """GET /healthz: 200, пока реплика принимает обновления, и 503 при остановке."""
+
+    SUPPORTED_METHODS = ("GET",)  # type: ignore[assignment]
+
+    def initialize(self, state: _ServerState) -> None:
+        self.state = state
+
+    def get(self) -> None:
+        state = self.state
+        queue = state.app.update_queue
+        self.set_status(HTTPStatus.SERVICE_UNAVAILABLE if state.draining else HTTPStatus.OK)
+        self.set_header("Content-Type", "application/json")
+        self.finish(
+            {
+                "status": "draining" if state.draining else "ok",
+                "queue": queue.qsize(),
+                "backlog": state.backlog(),
+                "queue_size": queue.maxsize,
+                "accepted": state.accepted,
+                "rejected_full": state.rejected_full,
+                "rejected_auth": state.rejected_auth,
+                "bad_requests": state.bad_requests,
+            }
+        )
+
+
+class _WebApp(tornado.web.Application):
+    def log_request(self, handler: tornado.web.RequestHandler) -> None:
+        # Логируем сами и только проблемы, а не каждый запрос
+        pass
+
+
+async def serve(
+    app: Application,
+    listen: str,
+    port: int,
+    url_path: str,
+    secret_token: str,
+    webhook_url: Optional[str] = None,
+    max_connections: int = 40,
+    allowed_updates: Optional[Sequence[str]] = None,
+    stop_signals: Sequence[int] = (signal.SIGINT, signal.SIGTERM),
+) -> None:
+    """Запускает приложение с приёмом обновлений через webhook до сигнала остановки.
+
+    Повторяет жизненный цикл ``Application.run_webhook``: ``post_init``,
+    ``post_stop`` и ``post_shutdown`` вызываются так же.
+    """
+    if not secret_token:
+        raise ValueError("secret_token обязателен: без него webhook примет обновления от кого угодно")
+    state = _ServerState(app, secret_token)
+    path = "/" + url_path.strip("/")
+    web_app = _WebApp(
+        [
+            (rf"{path}/?", _UpdateHandler, {"state": state}),
+            (r"/healthz", _HealthHandler, {"state": state}),
+        ]
+    )
+    server = HTTPServer(web_app, xheaders=True)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in stop_signals:
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: сигналы обрабатываются через KeyboardInterrupt
+            pass
+
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+
+        if webhook_url:
+            await app.bot.set_webhook(
+                url=webhook_url,
+                secret_token=secret_token,
+                max_connections=max_connections,
+                allowed_updates=allowed_updates,
+                # Накопившиеся за время рестарта обновления не теряем
+                drop_pending_updates=False,
+            )
+            logger.info("🔗 Webhook зарегистрирован: %s", webhook_url)
+
+        await app.start()
+        server.listen(port, address=listen)
+        logger.info(
+            "🌐 Webhook-сервер слушает %s:%s%s (очередь приёма: %s)",
+            listen,
+            port,
+            path,
+            app.update_queue.maxsize or "без ограничения",
+        )
+
+        try:
+            await stop_event.wait()
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+
+        # Плавная остановка: новые обновления отклоняем (Telegram их повторит),
+        # уже принятые дорабатываем
+        state.draining = True
+        logger.info("🛑 Остановка: дорабатываю %s обновлений из очереди", app.update_queue.qsize())
+        server.stop()
+        await server.close_all_connections()
+        if app.running:
+            await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        logger.info(
+            "✅ Webhook-сервер остановлен: принято %s, отклонено (очередь) %s",
+            state.accepted,
+            state.rejected_full,
+        )
+    finally:
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)